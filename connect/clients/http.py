@@ -0,0 +1,279 @@
+"""
+http.py
+
+Pooled HTTP client services used to transmit data to external servers.
+A long-lived httpx AsyncClient is maintained for each target host so that connections (and TLS sessions)
+are reused across transmissions, and connection limits are applied per host.
+
+Each target host also has a circuit breaker, which defers transmissions while the host is failing, and an
+adaptive timeout derived from the host's recent response latencies.
+"""
+import asyncio
+import logging
+import httpx
+from typing import Optional
+from urllib.parse import urlsplit
+from connect.config import get_settings
+from connect.support.adaptive_timeout import AdaptiveTimeout
+from connect.support.circuit_breaker import CircuitBreaker
+from connect.support.metrics import get_metrics_registry
+
+
+logger = logging.getLogger(__name__)
+http_client_pool = None
+transmit_targets = {}
+
+
+def get_origin(url: str) -> str:
+    """
+    :param url: a target url
+    :return: the url's origin, scheme://host[:port], without credentials
+    """
+    parsed_url = urlsplit(url)
+    origin = f"{parsed_url.scheme}://{parsed_url.hostname}"
+    return f"{origin}:{parsed_url.port}" if parsed_url.port else origin
+
+
+class HttpClientPool:
+    """
+    A process-wide pool of httpx AsyncClients, keyed by target origin and certificate verification.
+
+    Pool metrics include:
+    - clients_created: AsyncClients created, one per origin and certificate verification setting. Connection
+      reuse is managed by each client's connection pool, per the pool limits.
+    - requests: total requests sent
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_connections_per_host: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        http2: bool = False,
+    ):
+        self._limits = httpx.Limits(
+            max_connections=max_connections_per_host,
+            max_keepalive_connections=min(
+                max_keepalive_connections, max_connections_per_host
+            ),
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._http2 = http2
+        self._clients = {}
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self.metrics = {
+            "clients_created": 0,
+            "requests": 0,
+        }
+
+    def get_client(self, url: str, verify: bool) -> httpx.AsyncClient:
+        """
+        Returns the AsyncClient for the url's origin, creating it if necessary.
+
+        :param url: the target url
+        :param verify: whether to verify the target's certificate
+        :return: an AsyncClient
+        """
+        parsed_url = urlsplit(url)
+        key = (parsed_url.scheme, parsed_url.hostname, parsed_url.port, verify)
+
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        self.metrics["clients_created"] += 1
+        try:
+            client = httpx.AsyncClient(
+                verify=verify, limits=self._limits, http2=self._http2
+            )
+        except ImportError as ie:
+            logger.warning(f"HTTP/2 is not available, using HTTP/1.1: {ie}")
+            self._http2 = False
+            client = httpx.AsyncClient(verify=verify, limits=self._limits)
+
+        self._clients[key] = client
+        logger.debug(
+            f"Created HTTP client for {parsed_url.scheme}://{parsed_url.netloc}"
+        )
+        return client
+
+    async def request(
+        self, method: str, url: str, verify: bool = True, **kwargs
+    ) -> httpx.Response:
+        """
+        Sends a request using the pooled client for the url's origin.
+
+        :param method: the HTTP method
+        :param url: the target url
+        :param verify: whether to verify the target's certificate
+        :param kwargs: additional httpx request arguments, such as json, headers or timeout
+        :return: the httpx Response
+        """
+        client = self.get_client(url, verify)
+        send_kwargs = {}
+        if "timeout" in kwargs:
+            send_kwargs["timeout"] = kwargs.pop("timeout")
+        request = client.build_request(method, url, **kwargs)
+
+        async with self._semaphore:
+            self.metrics["requests"] += 1
+            return await client.send(request, **send_kwargs)
+
+    async def post(self, url: str, verify: bool = True, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, verify, **kwargs)
+
+    async def put(self, url: str, verify: bool = True, **kwargs) -> httpx.Response:
+        return await self.request("PUT", url, verify, **kwargs)
+
+    async def patch(self, url: str, verify: bool = True, **kwargs) -> httpx.Response:
+        return await self.request("PATCH", url, verify, **kwargs)
+
+    async def get(self, url: str, verify: bool = True, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, verify, **kwargs)
+
+    def get_metrics(self) -> dict:
+        """
+        :return: the pool metrics
+        """
+        return dict(self.metrics)
+
+    async def close(self):
+        """
+        Closes all pooled clients and their connections.
+        """
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+def get_http_client_pool() -> Optional[HttpClientPool]:
+    """
+    :return: the HttpClientPool instance
+    """
+    global http_client_pool
+    if not http_client_pool:
+        settings = get_settings()
+        http_client_pool = HttpClientPool(
+            max_connections=settings.http_client_max_connections,
+            max_connections_per_host=settings.http_client_max_connections_per_host,
+            max_keepalive_connections=settings.http_client_max_keepalive_connections,
+            keepalive_expiry=settings.http_client_keepalive_expiry_secs,
+            http2=settings.http_client_http2,
+        )
+        registry = get_metrics_registry()
+        for name in http_client_pool.get_metrics():
+            registry.gauge(
+                f"http_client_pool_{name}",
+                lambda name=name: get_http_client_metrics()[name],
+            )
+        logger.info("Created HTTP client pool")
+    return http_client_pool
+
+
+def get_http_client_metrics() -> dict:
+    """
+    :return: the HttpClientPool metrics, or an empty dict if the pool has not been created
+    """
+    return http_client_pool.get_metrics() if http_client_pool else {}
+
+
+async def close_http_client_pool():
+    """
+    Closes the HttpClientPool instance, if created
+    """
+    global http_client_pool
+    if http_client_pool:
+        await http_client_pool.close()
+        http_client_pool = None
+
+
+class TransmitTarget:
+    """
+    The circuit breaker and adaptive timeout of an external server.
+
+    Target metrics, by origin:
+    - transmit_timeout: the current request timeout, in seconds
+    - transmit_breaker_open: 1 while the circuit breaker defers requests, otherwise 0
+    - transmit_breaker_opened/transmit_breaker_rejected: counters of breaker trips and deferred requests
+    """
+
+    def __init__(self, origin: str):
+        """
+        :param origin: the target origin, from get_origin
+        """
+        settings = get_settings()
+        self.origin = origin
+        self.breaker = CircuitBreaker(
+            settings.transmit_breaker_failure_threshold,
+            settings.transmit_breaker_reset_secs,
+        )
+        self.timeout = AdaptiveTimeout(
+            settings.transmit_timeout_secs,
+            settings.transmit_timeout_min_secs,
+            settings.transmit_timeout_max_secs,
+            percentile=settings.transmit_timeout_percentile,
+            multiplier=settings.transmit_timeout_multiplier,
+            min_samples=settings.transmit_timeout_min_samples,
+        )
+
+        registry = get_metrics_registry()
+        registry.gauge("transmit_timeout", lambda: self.timeout.timeout, target=origin)
+        registry.gauge(
+            "transmit_breaker_open",
+            lambda: int(self.breaker.state != "closed"),
+            target=origin,
+        )
+        self._opened = registry.counter("transmit_breaker_opened", target=origin)
+        self._rejected = registry.counter("transmit_breaker_rejected", target=origin)
+
+    def allow_request(self) -> bool:
+        """
+        :return: True if a request may be sent to the target, False if the target's breaker is open
+        """
+        if self.breaker.allow_request():
+            return True
+        self._rejected.inc()
+        return False
+
+    def get_timeout(self) -> float:
+        """
+        :return: the request timeout, in seconds
+        """
+        return self.timeout.timeout
+
+    def record_response(self, status_code: int, latency: float):
+        """
+        Records a response from the target. Server errors are recorded as breaker failures.
+
+        :param status_code: the response status code
+        :param latency: the response latency, in seconds
+        """
+        self.timeout.observe(latency)
+        if status_code >= 500:
+            self.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def record_failure(self):
+        """
+        Records a failed request, such as a timeout or connection error
+        """
+        if self.breaker.record_failure():
+            logger.warning(
+                f"Transmit target {self.origin} is unavailable, deferring requests for "
+                + f"{self.breaker.reset_timeout}s"
+            )
+            self._opened.inc()
+
+
+def get_transmit_target(url: str) -> TransmitTarget:
+    """
+    :param url: the target url
+    :return: the TransmitTarget for the url's origin
+    """
+    origin = get_origin(url)
+    target = transmit_targets.get(origin)
+    if target is None:
+        target = transmit_targets[origin] = TransmitTarget(origin)
+    return target
@@ -5,26 +5,43 @@ Client services used to support internal and external transactions.
 Service instances are bound to data attributes and accessed through "get" functions.
 """
 import asyncio
+import functools
 import logging
 import time
 from asyncio import get_running_loop
+from collections import deque
 from confluent_kafka import (
     Producer,
     Consumer,
     KafkaException,
     KafkaError,
+    OFFSET_END,
     TopicPartition,
 )
 from confluent_kafka.admin import AdminClient, NewTopic
 from connect.config import get_settings, kafka_sync_topic
-from connect.exceptions import KafkaMessageNotFoundError, KafkaStorageError
-from threading import Thread
-from typing import Callable, List, Optional
+from connect.exceptions import (
+    KafkaMessageNotFoundError,
+    KafkaProducerQueueFullError,
+    KafkaStorageError,
+)
+from connect.support.kafka_segments import (
+    get_segment_headers,
+    parse_segment_headers,
+    segment_message,
+    SegmentedMessage,
+    SegmentStore,
+)
+from connect.support.metrics import get_metrics_registry
+from connect.support.record_cache import get_record_cache
+from threading import Event, Lock, Semaphore, Thread
+from typing import AsyncIterator, Callable, List, Optional, Tuple
 
 
 logger = logging.getLogger(__name__)
 # client instances
 kafka_producer = None
+kafka_consumer_pool = None
 kafka_listeners = []
 
 # ******************************************
@@ -36,10 +53,25 @@ class ConfluentAsyncKafkaProducer:
     Adapted from https://github.com/confluentinc/confluent-kafka-python
     """
 
-    def __init__(self, configs, loop=None):
+    def __init__(
+        self,
+        configs,
+        loop=None,
+        queue_full_timeout: float = 5.0,
+        saturation_ratio: float = 0.9,
+    ):
         self._loop = loop or asyncio.get_running_loop()
         self._producer = Producer(configs)
         self._cancelled = False
+        # delivery reports received by the poll thread, pending hand off to the event loop
+        self._deliveries = []
+        self._deliveries_lock = Lock()
+        # producers waiting for queue capacity are woken as delivery reports are received
+        self._capacity_available = asyncio.Event()
+        self._queue_full_timeout = queue_full_timeout
+        self._saturation_depth = saturation_ratio * int(
+            configs.get("queue.buffering.max.messages", 100000)
+        )
         self._poll_thread = Thread(target=self._poll_loop)
         self._poll_thread.start()
         logger.info(f"Created Kafka Producer")
@@ -48,47 +80,184 @@ class ConfluentAsyncKafkaProducer:
     def _poll_loop(self):
         while not self._cancelled:
             self._producer.poll(0.1)
+            self._dispatch_deliveries()
 
     def close(self):
         self._cancelled = True
         self._poll_thread.join()
 
-    def produce(self, topic, value):
+    def queue_depth(self) -> int:
         """
-        An awaitable produce method.
+        :return: the number of messages waiting to be delivered, or acknowledged, by the broker
         """
-        result = self._loop.create_future()
+        return len(self._producer)
+
+    def is_saturated(self) -> bool:
+        """
+        :return: True if the producer queue depth exceeds the saturation ratio of its capacity
+        """
+        return self.queue_depth() >= self._saturation_depth
+
+    def _on_delivery(self, result, topic, on_delivery) -> Callable:
+        """
+        :return: a delivery callback which queues the delivery report on the poll thread
+        """
+        start_time = time.perf_counter()
 
         def ack(err, msg):
+            latency = time.perf_counter() - start_time
+            with self._deliveries_lock:
+                self._deliveries.append((result, topic, err, msg, latency, on_delivery))
+
+        return ack
+
+    def _dispatch_deliveries(self):
+        """
+        Hands the delivery reports received during a poll to the event loop, with a single wakeup.
+        Runs on the poll thread.
+        """
+        with self._deliveries_lock:
+            deliveries, self._deliveries = self._deliveries, []
+        if deliveries:
+            self._loop.call_soon_threadsafe(self._deliver_all, deliveries)
+
+    def _deliver_all(self, deliveries: List[tuple]):
+        """
+        Resolves the delivery reports received during a poll. Runs on the event loop thread.
+        A delivery callback which raises an error does not affect the batch's other deliveries.
+        """
+        get_metrics_registry().counter("kafka_delivery_dispatches").inc()
+        try:
+            for delivery in deliveries:
+                try:
+                    self._deliver(*delivery)
+                except Exception as ex:
+                    logger.error(
+                        f"Kafka delivery callback error for {delivery[1]}: {ex}"
+                    )
+        finally:
+            self._capacity_available.set()
+
+    def _deliver(self, result, topic, err, msg, latency, on_delivery=None):
+        """
+        Resolves a delivery future and records the delivery latency. Runs on the event loop thread.
+        """
+        get_metrics_registry().histogram("kafka_delivery", topic=topic).observe(latency)
+        if not result.done():
             if err:
-                self._loop.call_soon_threadsafe(
-                    result.set_exception, KafkaException(err)
-                )
+                result.set_exception(KafkaException(err))
             else:
-                self._loop.call_soon_threadsafe(result.set_result, msg)
+                result.set_result(msg)
+        if on_delivery:
+            on_delivery(err, msg)
 
-        self._producer.produce(topic, value, on_delivery=ack)
-        return result
+    def produce(self, topic, value, key=None):
+        """
+        An awaitable produce method.
+        """
+        return self.produce_with_callback(topic, value, on_delivery=None, key=key)
 
-    def produce_with_callback(self, topic, value, on_delivery):
+    def produce_with_callback(self, topic, value, on_delivery, key=None, headers=None):
         """
         A produce method in which delivery notifications are made available
         via both the returned future and on_delivery callback (if specified).
+
+        Records with the same key are stored in the same partition, in order. Records without a key
+        are spread across the topic's partitions.
+
+        If the producer queue is full, the record is produced once queue capacity is available.
+        The returned awaitable raises KafkaProducerQueueFullError if capacity is not available
+        within the queue full timeout.
         """
         result = self._loop.create_future()
+        on_delivery = self._on_delivery(result, topic, on_delivery)
+        produce = functools.partial(
+            self._producer.produce,
+            topic,
+            value,
+            key=key,
+            headers=headers,
+            on_delivery=on_delivery,
+        )
+        try:
+            produce()
+        except BufferError:
+            return self._loop.create_task(
+                self._produce_when_available(topic, produce, result)
+            )
+        return result
 
-        def ack(err, msg):
-            if err:
-                self._loop.call_soon_threadsafe(
-                    result.set_exception, KafkaException(err)
+    async def produce_segments(
+        self, topic, value: bytes, on_delivery=None, key=None, chunk_size=None
+    ):
+        """
+        Produces a record larger than the chunk size as segments, identified by their message headers.
+        Segments are produced with the record's key, or the segment identifier if the record is not keyed,
+        so that all segments are stored in the same partition. The record is located at the offset of its
+        first stored segment.
+
+        :param topic: the topic name
+        :param value: the record
+        :param on_delivery: called with the delivery report of the record's first stored segment, once all
+            segments are stored
+        :param key: the record's key
+        :param chunk_size: the maximum segment size. Defaults to KAFKA_MESSAGE_CHUNK_SIZE.
+        :return: the delivery report of the record's first stored segment
+        :raise: the delivery error, or KafkaProducerQueueFullError, of a segment which could not be stored
+        """
+        chunk_size = chunk_size or get_settings().kafka_message_chunk_size
+        results = []
+        for segment, identifier, count, index in segment_message(value, chunk_size):
+            results.append(
+                self.produce_with_callback(
+                    topic,
+                    segment,
+                    None,
+                    key=key or identifier,
+                    headers=get_segment_headers(identifier, count, index, len(value)),
                 )
-            else:
-                self._loop.call_soon_threadsafe(result.set_result, msg)
-            if on_delivery:
-                self._loop.call_soon_threadsafe(on_delivery, err, msg)
+            )
+        get_metrics_registry().counter("kafka_producer_segments", topic=topic).inc(
+            len(results)
+        )
 
-        self._producer.produce(topic, value, on_delivery=ack)
-        return result
+        msgs = await asyncio.gather(*results)
+        msg = min(msgs, key=lambda m: m.offset())
+        if on_delivery:
+            on_delivery(None, msg)
+        return msg
+
+    async def _produce_when_available(self, topic, produce: Callable, result):
+        """
+        Waits for producer queue capacity, without polling, and produces the record.
+
+        :return: the record's delivery report
+        :raise: KafkaProducerQueueFullError if queue capacity is not available within the timeout
+        """
+        registry = get_metrics_registry()
+        registry.counter("kafka_producer_queue_full", topic=topic).inc()
+        deadline = self._loop.time() + self._queue_full_timeout
+
+        while True:
+            self._capacity_available.clear()
+            try:
+                produce()
+                break
+            except BufferError:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    registry.counter(
+                        "kafka_producer_queue_full_errors", topic=topic
+                    ).inc()
+                    raise KafkaProducerQueueFullError(
+                        f"Kafka producer queue is full, unable to store record in {topic}"
+                    )
+                try:
+                    await asyncio.wait_for(self._capacity_available.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+        return await result
 
 
 def get_kafka_producer() -> Optional[ConfluentAsyncKafkaProducer]:
@@ -101,16 +270,164 @@ def get_kafka_producer() -> Optional[ConfluentAsyncKafkaProducer]:
         producer_config = {
             "bootstrap.servers": "".join(settings.kafka_bootstrap_servers),
             "acks": settings.kafka_producer_acks,
+            "compression.type": settings.kafka_producer_compression_type,
         }
+        if settings.kafka_producer_batch_enabled:
+            # librdkafka batches records from concurrent workflows, delivering each record's own report
+            producer_config["linger.ms"] = (
+                settings.kafka_producer_batch_max_linger_secs * 1000
+            )
+            producer_config[
+                "batch.num.messages"
+            ] = settings.kafka_producer_batch_max_size
+        producer_config.update(settings.kafka_producer_config)
         kafka_producer = ConfluentAsyncKafkaProducer(
-            configs=producer_config, loop=get_running_loop()
+            configs=producer_config,
+            loop=get_running_loop(),
+            queue_full_timeout=settings.kafka_producer_queue_full_timeout_secs,
+            saturation_ratio=settings.kafka_producer_queue_saturation_ratio,
+        )
+        get_metrics_registry().gauge(
+            "kafka_producer_queue_depth", lambda: kafka_producer.queue_depth()
         )
     return kafka_producer
 
 
+def is_kafka_producer_saturated() -> bool:
+    """
+    :return: True if the ConfluentAsyncKafkaProducer has been created and its queue is saturated
+    """
+    return kafka_producer is not None and kafka_producer.is_saturated()
+
+
 # ******************************************
 # Confluent async Kafka consumer and methods
 # ******************************************
+class KafkaConsumerPool:
+    """
+    A bounded pool of long-lived Kafka consumers used for point reads. A pooled consumer is assigned
+    the requested topic partition and offset for each read, so that reads reuse the consumer's
+    established broker connections rather than creating, and closing, a consumer per read.
+
+    Consumers idle for longer than the idle timeout are closed, down to the pool's minimum size.
+    Consumers which fail a read are discarded rather than returned to the pool.
+    """
+
+    def __init__(
+        self,
+        consumer_conf: dict,
+        max_size: int,
+        min_size: int = 0,
+        idle_timeout: float = 300.0,
+    ):
+        """
+        :param consumer_conf: the configuration used to create each consumer
+        :param max_size: the maximum number of consumers. Reads wait for a consumer once all are in use.
+        :param min_size: the number of consumers kept open, and created when the pool is warmed
+        :param idle_timeout: the time, in seconds, after which an idle consumer is closed
+        """
+        self._consumer_conf = consumer_conf
+        self.max_size = max_size
+        self.min_size = min_size
+        self.idle_timeout = idle_timeout
+        # (consumer, release time) tuples, most recently released last
+        self._idle = deque()
+        self._size = 0
+        self._available = asyncio.Semaphore(max_size)
+
+    def size(self) -> int:
+        """
+        :return: the number of open consumers, idle or in use
+        """
+        return self._size
+
+    def idle_count(self) -> int:
+        """
+        :return: the number of idle consumers
+        """
+        return len(self._idle)
+
+    def warm(self):
+        """
+        Creates consumers, up to the pool's minimum size, prior to the first read.
+        """
+        while self._size < self.min_size:
+            self._idle.append((self._create_consumer(), time.monotonic()))
+
+    def _create_consumer(self) -> Consumer:
+        consumer = Consumer(self._consumer_conf)
+        self._size += 1
+        get_metrics_registry().counter("kafka_consumer_pool_created").inc()
+        return consumer
+
+    def _discard(self, consumer: Consumer):
+        self._size -= 1
+        try:
+            consumer.close()
+        except Exception as ex:
+            logger.warning(f"Unable to close pooled Kafka consumer: {ex}")
+
+    def evict_idle(self):
+        """
+        Closes consumers which have been idle for longer than the idle timeout.
+        """
+        expired = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < expired and self._size > self.min_size:
+            consumer, _ = self._idle.popleft()
+            self._discard(consumer)
+            get_metrics_registry().counter("kafka_consumer_pool_evicted").inc()
+
+    async def acquire(self) -> Consumer:
+        """
+        Leases a consumer from the pool, waiting if the pool is at its maximum size and all consumers
+        are in use. The most recently used consumer is leased first, so that surplus consumers go idle.
+
+        :return: the leased consumer, which must be returned with release()
+        """
+        await self._available.acquire()
+        self.evict_idle()
+        if self._idle:
+            consumer, _ = self._idle.pop()
+            return consumer
+
+        try:
+            return self._create_consumer()
+        except Exception:
+            self._available.release()
+            raise
+
+    def release(self, consumer: Consumer, healthy: bool = True):
+        """
+        Returns a leased consumer to the pool. The consumer's assignment is removed so that it stops
+        fetching records while idle.
+
+        :param consumer: the leased consumer
+        :param healthy: False if the consumer failed a read, and should be discarded
+        """
+        try:
+            if healthy:
+                try:
+                    consumer.unassign()
+                    self._idle.append((consumer, time.monotonic()))
+                except KafkaException as ke:
+                    logger.warning(f"Unable to unassign pooled Kafka consumer: {ke}")
+                    healthy = False
+            if not healthy:
+                self._discard(consumer)
+                get_metrics_registry().counter("kafka_consumer_pool_discarded").inc()
+        finally:
+            self._available.release()
+        self.evict_idle()
+
+    def close(self):
+        """
+        Closes the pool's idle consumers.
+        """
+        while self._idle:
+            consumer, _ = self._idle.popleft()
+            self._discard(consumer)
+
+
 class ConfluentAsyncKafkaConsumer:
     """
     A high-level KafkaConsumer class in order to create mutliple instances of
@@ -120,32 +437,44 @@ class ConfluentAsyncKafkaConsumer:
 
     A default consumer_group_id as specified in configs will be used if no
     consumer_group_id is specified at instance creation.
+
+    If a KafkaConsumerPool is provided, the message is read using a pooled consumer.
     """
 
     def __init__(
-        self, topic_name, partition, consumer_conf, offset=None, consumer_group_id=None
+        self,
+        topic_name,
+        partition,
+        consumer_conf,
+        offset=None,
+        consumer_group_id=None,
+        pool: Optional[KafkaConsumerPool] = None,
     ):
 
         # Check if a consumer_group_id was provided by the user; then set it
         if consumer_group_id:
             consumer_conf["group.id"] = consumer_group_id
 
-        self.consumer = Consumer(consumer_conf)
+        self.pool = pool
+        self.consumer = Consumer(consumer_conf) if pool is None else None
         self.topic_name = topic_name
         self.partition = partition
         self.offset = offset
-        logger.info(f"Created Kafka Consumer")
-        logger.debug(f"Kafka Consumer configs = {consumer_conf}")
+        if pool is None:
+            logger.info(f"Created Kafka Consumer")
+            logger.debug(f"Kafka Consumer configs = {consumer_conf}")
 
     async def get_message_from_kafka_cb(self, callback_method) -> None:
         """
         Get a specific message from the kafka_broker and invoke the callback_method automatically with the
         message body passed as an argument to the callback_method.
 
+        Messages read from a specific offset are cached in the RecordCache, and read from the cache if present.
+
         :param callback_method: Takes a callback_method which is automatically called on successfully retrieving
                                 a message from the KafkaBroker.
         """
-        if self.consumer is None:
+        if self.consumer is None and self.pool is None:
             logger.error("Kafka Consumer not initialized prior to this call")
             raise ValueError("ERROR - Consumer not initialized")
 
@@ -153,8 +482,19 @@ class ConfluentAsyncKafkaConsumer:
             logger.error("No callback_method provided for handling of fetched message")
             raise ValueError("ERROR - callback_method not provided")
 
+        location = None
+        if self.offset is not None:
+            location = f"{self.topic_name}:{self.partition}:{self.offset}"
+            message = get_record_cache().get(location)
+            if message is not None:
+                self._close_consumer()
+                return await callback_method(message)
+
         loop = get_running_loop()
         topic_partition = None
+        consumer = self.consumer or await self.pool.acquire()
+        healthy = True
+        poll = None
 
         try:
             # This automatically sets the offset to the one provided by the user if it is not None
@@ -162,10 +502,11 @@ class ConfluentAsyncKafkaConsumer:
                 self.topic_name, self.partition, self.offset
             )
 
-            self.consumer.assign([topic_partition])
+            consumer.assign([topic_partition])
 
             # polls for exactly one record - waits for a configurable max time (seconds)
-            msg = await loop.run_in_executor(None, self.consumer.poll, 5.0)
+            poll = loop.run_in_executor(None, consumer.poll, 5.0)
+            msg = await poll
 
             if msg is None:  # Handle timeout during poll
                 msg = "Consumer error: timeout while polling message from Kafka"
@@ -181,15 +522,39 @@ class ConfluentAsyncKafkaConsumer:
 
                 raise KafkaException(error_msg)
 
-            headers = msg.headers()
+            segment = parse_segment_headers(msg.headers())
             message = None
 
-            if headers is None:
+            if segment is None:
                 message = msg.value()
-            # Re-evaluate later if we will need message semgentation or have a use case where the producer
-            # will chunk messages and record them with the broker
-            # else:
-            #     message = combine_segments(msg.value(), self._generate_header_dictionary(msg.headers()))
+            else:
+                # a segmented record is read from its first stored segment until all segments are read
+                identifier, count, index, size = segment
+                if index != 1:
+                    raise KafkaMessageNotFoundError(
+                        f"{self.topic_name}:{self.partition}:{self.offset} is segment {index} of "
+                        + f"a segmented record, not the record's location"
+                    )
+                segmented = SegmentedMessage(identifier, count, size)
+                segmented.add(index, msg.value())
+                batch_size = get_settings().kafka_consumer_consume_batch_size
+                while not segmented.is_complete():
+                    poll = loop.run_in_executor(
+                        None, functools.partial(consumer.consume, batch_size, 5.0)
+                    )
+                    msgs = await poll
+                    if not msgs:
+                        break
+                    for segment_msg in msgs:
+                        if segment_msg.error():
+                            raise KafkaException(
+                                f"Consumer - error: {segment_msg.error()}"
+                            )
+                        segment = _get_segment(segment_msg)
+                        if segment and segment[0] == segmented.identifier:
+                            segmented.add(segment[2], segment_msg.value())
+                if segmented.is_complete():
+                    message = segmented.buffer
 
             if message is not None:
                 logger.trace(
@@ -197,6 +562,8 @@ class ConfluentAsyncKafkaConsumer:
                     f"and offset - {self.offset}. Invoking callback_method - {callback_method}",
                 )
 
+                if location:
+                    get_record_cache().put(location, message)
                 return await callback_method(message)
             else:
                 _msg_not_found_error = "No message was found that could be fetched for "
@@ -204,20 +571,184 @@ class ConfluentAsyncKafkaConsumer:
 
                 logger.error(_msg_not_found_error)
                 raise KafkaMessageNotFoundError(_msg_not_found_error)
+        except KafkaException:
+            healthy = False
+            raise
         finally:
-            self._close_consumer()
+            self._release_consumer(consumer, healthy, poll)
+
+    async def get_messages_from_kafka_cb(
+        self, end_offset: int, callback_method
+    ) -> AsyncIterator:
+        """
+        Get the messages from the consumer's offset through end_offset, inclusive, using bulk fetches. The
+        callback_method is invoked with each fetched batch of messages, as a list of (location, message body)
+        tuples where location is topic_name:partition:offset, and the callback results are yielded.
 
-    def _generate_header_dictionary(self, headers):
-        headers_dict = {}
-        for key, value in headers:
-            headers_dict[key] = value
-        return headers_dict
+        The range is limited to the messages available in the partition.
+
+        :param end_offset: The last offset to read
+        :param callback_method: Called with each batch of fetched messages
+        :return: an async iterator of the callback_method results
+        :raise: KafkaMessageNotFoundError if no messages are available within the range
+        """
+        if self.consumer is None and self.pool is None:
+            logger.error("Kafka Consumer not initialized prior to this call")
+            raise ValueError("ERROR - Consumer not initialized")
+
+        if callback_method is None:
+            logger.error("No callback_method provided for handling of fetched messages")
+            raise ValueError("ERROR - callback_method not provided")
+
+        if self.offset is None:
+            raise ValueError("ERROR - offset not provided")
+
+        loop = get_running_loop()
+        batch_size = get_settings().kafka_consumer_consume_batch_size
+        consumer = self.consumer or await self.pool.acquire()
+        healthy = True
+        pending = None
+
+        try:
+            topic_partition = TopicPartition(
+                self.topic_name, self.partition, self.offset
+            )
+            pending = loop.run_in_executor(
+                None,
+                functools.partial(
+                    consumer.get_watermark_offsets, topic_partition, timeout=5.0
+                ),
+            )
+            low, high = await pending
+            end_offset = min(end_offset, high - 1)
+            if self.offset < low or self.offset > end_offset:
+                msg = (
+                    f"No messages were found for topic_name: {self.topic_name}, partition: {self.partition}, "
+                    f"offsets: {self.offset}-{end_offset}"
+                )
+                logger.error(msg)
+                raise KafkaMessageNotFoundError(msg)
+
+            consumer.assign([topic_partition])
+            next_offset = self.offset
+            # segmented records being reassembled, by segment identifier
+            segmented_messages = {}
+            while next_offset <= end_offset or (
+                segmented_messages and next_offset < high
+            ):
+                if next_offset > end_offset:
+                    # the remaining segments of records which started within the range are read,
+                    # records which started before the range are not
+                    segmented_messages = {
+                        identifier: segmented
+                        for identifier, segmented in segmented_messages.items()
+                        if segmented.has_segment(1)
+                    }
+                    if not segmented_messages:
+                        break
+                num_messages = min(batch_size, end_offset - next_offset + 1)
+                if next_offset > end_offset:
+                    num_messages = batch_size
+                pending = loop.run_in_executor(
+                    None, functools.partial(consumer.consume, num_messages, 5.0)
+                )
+                msgs = await pending
+                if not msgs:
+                    msg = "Consumer error: timeout while consuming messages from Kafka"
+                    logger.error(msg)
+                    raise KafkaException(msg)
+
+                messages = []
+                for msg in msgs:
+                    if msg.error():
+                        error_msg = f"Consumer - error: {msg.error()}"
+                        logger.error(error_msg)
+                        if msg.error().code() is KafkaError.OFFSET_OUT_OF_RANGE:
+                            raise KafkaMessageNotFoundError(error_msg)
+                        raise KafkaException(error_msg)
+
+                    next_offset = msg.offset() + 1
+                    location = f"{self.topic_name}:{self.partition}:{msg.offset()}"
+                    segment = _get_segment(msg)
+                    if segment is None:
+                        if msg.offset() <= end_offset:
+                            messages.append((location, msg.value()))
+                        continue
+
+                    identifier, count, index, size = segment
+                    segmented = segmented_messages.get(identifier)
+                    if segmented is None:
+                        if msg.offset() > end_offset:
+                            continue
+                        segmented = segmented_messages[identifier] = SegmentedMessage(
+                            identifier, count, size
+                        )
+                        segmented.location = location
+                    if segmented.add(index, msg.value()):
+                        del segmented_messages[identifier]
+                        messages.append((segmented.location, segmented.buffer))
+
+                logger.trace(
+                    f"Fetched {len(messages)} messages for topic_name - {self.topic_name}, "
+                    f"partition - {self.partition}. Invoking callback_method - {callback_method}",
+                )
+                yield await callback_method(messages)
+        except KafkaException:
+            healthy = False
+            raise
+        finally:
+            self._release_consumer(consumer, healthy, pending)
+
+    def _release_consumer(self, consumer, healthy: bool, pending=None):
+        """
+        Closes the consumer, or returns a pooled consumer to its pool.
+
+        :param consumer: The consumer used to read messages
+        :param healthy: False if the read failed, and a pooled consumer should be discarded
+        :param pending: The last executor call made with the consumer
+        """
+        if self.pool is None:
+            self._close_consumer()
+        elif pending is not None and not pending.done():
+            # the request was cancelled while reading, release the consumer once the call completes
+            pending.add_done_callback(lambda _: self.pool.release(consumer))
+        else:
+            self.pool.release(consumer, healthy)
 
     def _close_consumer(self):
         if self.consumer is not None:
             self.consumer.close()
 
 
+def _get_segment(msg) -> Optional[tuple]:
+    """
+    :param msg: a consumed message
+    :return: the message's segment identifier, count, index and record size, or None if the message is not
+        a valid segment
+    """
+    try:
+        return parse_segment_headers(msg.headers())
+    except ValueError as ex:
+        logger.warning(
+            f"Ignoring segment {msg.topic()}:{msg.partition()}:{msg.offset()}: {ex}"
+        )
+        return None
+
+
+def _get_consumer_conf() -> dict:
+    """
+    :return: the default consumer configuration
+    """
+    settings = get_settings()
+    return {
+        "bootstrap.servers": "".join(settings.kafka_bootstrap_servers),
+        "group.id": settings.kafka_consumer_default_group_id,
+        "auto.offset.reset": settings.kafka_consumer_default_auto_offset_reset,
+        "enable.auto.commit": settings.kafka_consumer_default_enable_auto_commit,
+        "enable.auto.offset.store": settings.kafka_consumer_default_enable_auto_offset_store,
+    }
+
+
 def get_kafka_consumer(
     topic_name: str, partition: int, offset: int = None, consumer_group_id: str = None
 ) -> ConfluentAsyncKafkaConsumer:
@@ -226,6 +757,8 @@ def get_kafka_consumer(
     value and optional consumer_group_id(string) values. If an offset is not provided, the offset would begin
     from the first available message at the specified partition.
 
+    Messages are read using the KafkaConsumerPool, if enabled, unless a consumer_group_id is specified.
+
     User is expected to call the get_message_from_kafka_cb() with a callback_method after calling this method.
 
     :param topic_name: The topic name for which we would be looking up a message for.
@@ -241,21 +774,48 @@ def get_kafka_consumer(
         logger.error(msg)
         raise ValueError(msg)
 
-    # We pull default configs from config.py
-    consumer_conf = {
-        "bootstrap.servers": "".join(settings.kafka_bootstrap_servers),
-        "group.id": settings.kafka_consumer_default_group_id,
-        "auto.offset.reset": settings.kafka_consumer_default_auto_offset_reset,
-        "enable.auto.commit": settings.kafka_consumer_default_enable_auto_commit,
-        "enable.auto.offset.store": settings.kafka_consumer_default_enable_auto_offset_store,
-    }
+    pool = None
+    if settings.kafka_consumer_pool_enabled and consumer_group_id is None:
+        pool = get_kafka_consumer_pool()
 
+    # We pull default configs from config.py
     kafka_consumer = ConfluentAsyncKafkaConsumer(
-        topic_name, partition, consumer_conf, offset, consumer_group_id
+        topic_name, partition, _get_consumer_conf(), offset, consumer_group_id, pool
     )
     return kafka_consumer
 
 
+def get_kafka_consumer_pool() -> Optional[KafkaConsumerPool]:
+    """
+    :return: the KafkaConsumerPool instance, warmed to its minimum size
+    """
+    global kafka_consumer_pool
+    if not kafka_consumer_pool:
+        settings = get_settings()
+        pool = KafkaConsumerPool(
+            consumer_conf=_get_consumer_conf(),
+            max_size=settings.kafka_consumer_pool_max_size,
+            min_size=settings.kafka_consumer_pool_min_size,
+            idle_timeout=settings.kafka_consumer_pool_idle_timeout_secs,
+        )
+        pool.warm()
+        registry = get_metrics_registry()
+        registry.gauge("kafka_consumer_pool_size", lambda: pool.size())
+        registry.gauge("kafka_consumer_pool_idle", lambda: pool.idle_count())
+        kafka_consumer_pool = pool
+    return kafka_consumer_pool
+
+
+def close_kafka_consumer_pool():
+    """
+    Closes the KafkaConsumerPool instance, if created
+    """
+    global kafka_consumer_pool
+    if kafka_consumer_pool:
+        kafka_consumer_pool.close()
+        kafka_consumer_pool = None
+
+
 # ************************************************
 # Confluent async Kafka topic listener and methods
 # ************************************************
@@ -263,16 +823,78 @@ class ConfluentAsyncKafkaListener:
     """
     Confluent's AsyncIO Wrapper for a Kafka topic listener
     Adapted from https://github.com/confluentinc/confluent-kafka-python
+
+    A listener may subscribe to topics, using listen(), or be assigned specific topic partitions, using
+    assign(). Messages are consumed in batches on a poll thread and each batch is handled by an async
+    handler on the event loop. All consumer calls are made on the poll thread.
+
+    - At most max_in_flight batches are handled concurrently. While handlers are saturated, or the
+      listener is paused, fetching is paused.
+    - Offsets are committed, in order, once each batch is handled. Handled offsets are not committed
+      out of order when batches are handled concurrently.
+    - If a handler or the consumer fails, the consumer is recreated, after a backoff, and resumes from
+      the last committed offsets. Batches which were not handled are delivered again.
+
+    If partition_workers is enabled, batches are split by partition and each assigned partition is
+    handled by its own worker task. Partitions are handled concurrently, and the messages of each
+    partition are handled in order. When partitions are revoked, their workers finish the current batch,
+    queued batches are dropped, and handled offsets are committed before the partitions are released.
+
+    The lag of each assigned partition, the number of messages which have not been handled, is exposed
+    in the kafka_listener_lag gauge, unless lag_gauges is disabled.
     """
 
     def __init__(self, configs, params, loop=None):
+        """
+        :param configs: the consumer configuration. Automatic offset commits are disabled.
+        :param params: listener parameters:
+            - poll_timeout: the maximum time, in seconds, to wait for messages
+            - batch_size: the maximum number of messages handled in a batch
+            - max_in_flight: the maximum number of batches handled, or queued for a partition worker, concurrently
+            - partition_workers: True to handle each partition with its own worker
+            - commit_offsets: True to commit handled offsets to the consumer group
+            - restart_backoff: the initial time, in seconds, to wait before recreating a failed consumer
+            - restart_max_backoff: the maximum time, in seconds, to wait before recreating a failed consumer
+            - revoke_timeout: the maximum time, in seconds, to wait for the workers of revoked partitions
+            - lag_gauges: True to expose the lag of assigned partitions in the kafka_listener_lag gauge
+        :param loop: the event loop used to run handlers
+        """
         self.poll_timeout = params["poll_timeout"]
-        self.poll_yield = params["poll_yield"]
+        self.batch_size = params.get("batch_size", 100)
+        self.max_in_flight = params.get("max_in_flight", 1)
+        self.partition_workers = params.get("partition_workers", False)
+        self.commit_offsets = params.get("commit_offsets", True)
+        self.restart_backoff = params.get("restart_backoff", 1.0)
+        self.restart_max_backoff = params.get("restart_max_backoff", 30.0)
+        self.revoke_timeout = params.get("revoke_timeout", 10.0)
+        self.lag_gauges = params.get("lag_gauges", True)
         self.topics = None
-        self.callback = None
+        self.handler = None
         self._loop = loop or get_running_loop()
-        self._consumer = Consumer(configs)
+        self._configs = {**configs, "enable.auto.commit": False}
+        self._consumer = Consumer(self._configs)
+        self._partitions = None
+        # assigned (topic, partition) keys. Accessed on the poll thread.
+        self._assigned = set()
+        # next offset to consume for each (topic, partition), once handled
+        self._positions = {}
+        self._lag = {}
+        self._lag_updated = 0.0
         self._cancelled = False
+        self._stopped = Event()
+        self._started = Event()
+        self._pause_requested = False
+        self._paused = False
+        self._in_flight = Semaphore(self.max_in_flight)
+        # incremented when the consumer is recreated, so that stale batches and commits are discarded
+        self._generation = 0
+        self._handler_error = None
+        # handled, or handling, batches in consumption order, by partition worker. Accessed on the event loop thread.
+        self._batches = {}
+        # partition worker (queue, task) tuples by (topic, partition). Accessed on the event loop thread.
+        self._workers = {}
+        # offsets of handled batches, pending commit on the poll thread
+        self._commits = deque()
         self._poll_thread = Thread(target=self._poll_loop)
         self._poll_thread.start()
 
@@ -281,40 +903,442 @@ class ConfluentAsyncKafkaListener:
         logger.debug(f"Kafka Listener params = {params}")
 
     def _poll_loop(self):
+        # wait, without polling, until the listener is started
+        self._started.wait()
+        backoff = self.restart_backoff
+        while not self._cancelled:
+            try:
+                self._consume()
+            except Exception as ex:
+                if self._cancelled:
+                    break
+                logger.error(
+                    f"Listener: {self.topics} failed, restarting in {backoff}s: {ex}"
+                )
+                get_metrics_registry().counter("kafka_listener_restarts").inc()
+                self._generation += 1
+                self._handler_error = None
+                self._assigned.clear()
+                self._close_consumer()
+                if self._stopped.wait(backoff):
+                    break
+                backoff = min(backoff * 2, self.restart_max_backoff)
+                self._consumer = Consumer(self._configs)
+        self._close_consumer()
+
+    def _consume(self):
+        """
+        Consumes messages, and hands each batch to the event loop, until the listener is closed.
+        Runs on the poll thread.
+
+        :raise: KafkaException if the consumer fails, or the handler error if a handler fails
+        """
+        if self._partitions is not None:
+            partitions = [
+                TopicPartition(
+                    p.topic,
+                    p.partition,
+                    self._positions.get((p.topic, p.partition), p.offset),
+                )
+                for p in self._partitions
+            ]
+            self._consumer.assign(partitions)
+            self._on_assign(self._consumer, partitions)
+        else:
+            self._consumer.subscribe(
+                self.topics, on_assign=self._on_assign, on_revoke=self._on_revoke
+            )
+        self._paused = False
+
+        # (partition key, messages) batches, pending dispatch
+        pending = deque()
         while not self._cancelled:
-            if not self.topics:
-                # On startup, until the topic to listen on is set,
-                # we need to yield to enable proper startup.
-                time.sleep(self.poll_yield)
+            if self._handler_error is not None:
+                raise self._handler_error
+            self._commit_handled()
+            self._update_lag()
+
+            if pending:
+                if self._in_flight.acquire(timeout=self.poll_timeout):
+                    self._set_paused(self._pause_requested)
+                    self._dispatch(*pending.popleft())
+                    continue
+                # handlers are saturated, stop fetching while waiting for capacity
+                self._set_paused(True)
+            else:
+                self._set_paused(self._pause_requested)
+
+            msgs = self._consumer.consume(
+                self.batch_size, 0 if pending else self.poll_timeout
+            )
+            messages = []
+            for msg in msgs:
+                error_code = msg.error().code() if msg.error() else None
+                if error_code == KafkaError._PARTITION_EOF:
+                    # End of partition event
+                    logger.trace(
+                        f"Listener: {msg.topic()} [{msg.partition()}] reached end, offset {msg.offset()}"
+                    )
+                elif error_code:
+                    raise KafkaException(msg.error())
+                else:
+                    messages.append(msg)
+
+            if messages and self.partition_workers:
+                partition_messages = {}
+                for msg in messages:
+                    key = (msg.topic(), msg.partition())
+                    partition_messages.setdefault(key, []).append(msg)
+                pending.extend(partition_messages.items())
+            elif messages:
+                pending.append((None, messages))
+
+    def _set_paused(self, pause: bool):
+        """
+        Pauses, or resumes, fetching for the assigned partitions. Runs on the poll thread.
+        """
+        if pause == self._paused:
+            return
+        assignment = self._consumer.assignment()
+        if pause:
+            self._consumer.pause(assignment)
+        else:
+            self._consumer.resume(assignment)
+        self._paused = pause
+        logger.trace(f"Listener: paused = {pause} for {self.topics}")
+
+    def _on_assign(self, consumer, partitions: List[TopicPartition]):
+        """
+        Tracks assigned partitions, and registers their lag gauges. Runs on the poll thread.
+        """
+        registry = get_metrics_registry()
+        for p in partitions:
+            key = (p.topic, p.partition)
+            self._assigned.add(key)
+            if not self.lag_gauges:
                 continue
+            self._loop.call_soon_threadsafe(
+                functools.partial(
+                    registry.gauge,
+                    "kafka_listener_lag",
+                    functools.partial(self._lag.__getitem__, key),
+                    topic=p.topic,
+                    partition=p.partition,
+                )
+            )
+        logger.info(f"Listener: assigned {sorted(self._assigned)}")
 
-            msg = self._consumer.poll(self.poll_timeout)
-            if msg is None:
+    def _on_revoke(self, consumer, partitions: List[TopicPartition]):
+        """
+        Stops the workers of revoked partitions, and commits their handled offsets. Runs on the poll thread.
+        """
+        keys = [(p.topic, p.partition) for p in partitions]
+        self._assigned.difference_update(keys)
+        # the event loop may be waiting for the listener to close
+        if self.partition_workers and not self._cancelled:
+            stopped = asyncio.run_coroutine_threadsafe(
+                self._stop_workers(keys), self._loop
+            )
+            try:
+                stopped.result(self.revoke_timeout)
+            except Exception as ex:
+                logger.warning(f"Listener: unable to stop partition workers: {ex}")
+        self._commit_handled(asynchronous=False)
+        for key in keys:
+            self._lag.pop(key, None)
+        logger.info(f"Listener: revoked {keys}")
+
+    def _dispatch(self, key: Optional[tuple], messages: list):
+        """
+        Hands a batch of messages to the event loop. Messages from partitions which are no longer
+        assigned are dropped. Runs on the poll thread, after acquiring an in flight slot.
+
+        :param key: the (topic, partition) of a partition worker batch, or None
+        :param messages: the batch messages
+        """
+        offsets = {}
+        assigned = []
+        for msg in messages:
+            partition = (msg.topic(), msg.partition())
+            if partition in self._assigned:
+                offsets[partition] = msg.offset() + 1
+                assigned.append(msg)
+        if not assigned:
+            self._in_flight.release()
+            return
+
+        asyncio.run_coroutine_threadsafe(
+            self._submit(key, assigned, offsets, self._generation), self._loop
+        )
+
+    async def _submit(
+        self, key: Optional[tuple], messages: list, offsets: dict, generation: int
+    ):
+        """
+        Handles a batch, or queues it for its partition worker. Runs on the event loop thread.
+        """
+        batch = {"offsets": offsets, "generation": generation, "handled": False}
+        self._batches.setdefault(key, deque()).append(batch)
+        if key is None:
+            await self._handle(key, messages, batch)
+            return
+
+        worker = self._workers.get(key)
+        if worker is None:
+            queue = asyncio.Queue()
+            task = self._loop.create_task(self._partition_worker(key, queue))
+            worker = self._workers[key] = (queue, task)
+        worker[0].put_nowait((messages, batch))
+
+    async def _partition_worker(self, key: tuple, queue: asyncio.Queue):
+        """
+        Handles the batches of a single partition, in order, until stopped.
+        """
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            messages, batch = item
+            if batch["generation"] != self._generation:
+                # the consumer was recreated, the messages will be delivered again
+                self._in_flight.release()
                 continue
+            await self._handle(key, messages, batch)
 
-            error_code = msg.error().code() if msg and msg.error() else None
-            if error_code == KafkaError._PARTITION_EOF:
-                # End of partition event
-                logger.trace(
-                    f"Listener: {msg.topic()} [{msg.partition()}] reached end, offset {msg.offset()}"
-                )
-            elif error_code:
-                # other error
-                raise KafkaException(msg.error())
-            else:
-                # no error - process callback
-                self.callback(msg)
+    async def _stop_workers(self, keys: List[tuple]):
+        """
+        Stops the workers of revoked partitions. The current batch is completed, and queued batches are
+        dropped. Runs on the event loop thread.
+        """
+        tasks = []
+        for key in keys:
+            worker = self._workers.pop(key, None)
+            if worker is None:
+                continue
+            queue, task = worker
+            while not queue.empty():
+                queue.get_nowait()
+                self._in_flight.release()
+            queue.put_nowait(None)
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        for key in keys:
+            self._batches.pop(key, None)
+
+    async def _handle(self, key: Optional[tuple], messages: list, batch: dict):
+        """
+        Handles a batch of messages, and queues the offsets of handled batches for commit, in order.
+        Runs on the event loop thread.
+        """
+        registry = get_metrics_registry()
+        try:
+            start = time.perf_counter()
+            await self.handler(messages)
+            batch["handled"] = True
+            registry.histogram("kafka_listener_handler").observe(
+                time.perf_counter() - start
+            )
+            registry.counter("kafka_listener_messages").inc(len(messages))
+        except Exception as ex:
+            logger.error(f"Listener: handler failed for {self.topics}: {ex}")
+            registry.counter("kafka_listener_handler_errors").inc()
+            if batch["generation"] == self._generation:
+                self._handler_error = ex
+        finally:
+            self._in_flight.release()
+
+        batches = self._batches.get(key, ())
+        while batches and (
+            batches[0]["handled"] or batches[0]["generation"] != self._generation
+        ):
+            handled = batches.popleft()
+            if handled["handled"] and handled["generation"] == self._generation:
+                self._commits.append((handled["generation"], handled["offsets"]))
+
+    def _commit_handled(self, asynchronous: bool = True):
+        """
+        Commits the offsets of handled batches. Runs on the poll thread.
+        """
+        offsets = {}
+        while self._commits:
+            generation, batch_offsets = self._commits.popleft()
+            if generation == self._generation:
+                offsets.update(batch_offsets)
+        if not offsets:
+            return
+
+        self._positions.update(offsets)
+        if self.commit_offsets:
+            self._consumer.commit(
+                offsets=[TopicPartition(t, p, o) for (t, p), o in offsets.items()],
+                asynchronous=asynchronous,
+            )
+
+    def _update_lag(self):
+        """
+        Updates the lag of each assigned partition, at most once per second, from the cached high
+        watermarks. Runs on the poll thread.
+        """
+        now = time.monotonic()
+        if now - self._lag_updated < 1.0:
+            return
+        self._lag_updated = now
+
+        for topic, partition in self._assigned:
+            position = self._positions.get((topic, partition))
+            if position is None:
+                continue
+            _, high = self._consumer.get_watermark_offsets(
+                TopicPartition(topic, partition), cached=True
+            )
+            if high >= 0:
+                self._lag[(topic, partition)] = max(high - position, 0)
+
+    def _close_consumer(self):
+        try:
+            self._consumer.close()
+        except Exception as ex:
+            logger.warning(f"Unable to close Kafka listener consumer: {ex}")
 
     def close(self):
         self._cancelled = True
-        self.topics = None
-        self.callback = None
+        self._stopped.set()
+        self._started.set()
         self._poll_thread.join()
+        for _, task in self._workers.values():
+            task.cancel()
+        self._workers.clear()
+
+    def listen(self, topics: List[str], handler: Callable):
+        """
+        Subscribes to topics, using the consumer group.
 
-    def listen(self, topics: List[str], callback: Callable):
-        self._consumer.subscribe(topics)
-        self.callback = callback
+        :param topics: the topic names
+        :param handler: an async callable, called with each batch of messages
+        """
+        self.handler = handler
         self.topics = topics
+        self._started.set()
+
+    def assign(self, partitions: List[TopicPartition], handler: Callable):
+        """
+        Listens to specific topic partitions, from the offset set in each TopicPartition.
+
+        :param partitions: the topic partitions to listen to
+        :param handler: an async callable, called with each batch of messages
+        """
+        self.handler = handler
+        self.topics = list({partition.topic for partition in partitions})
+        self._partitions = partitions
+        self._started.set()
+
+    def list_partitions(self, topic: str) -> List[int]:
+        """
+        :param topic: the topic name
+        :return: the topic's partition ids
+        :raise: KafkaMessageNotFoundError if the topic does not exist
+        """
+        metadata = self._consumer.list_topics(topic, timeout=5.0).topics.get(topic)
+        if metadata is None or metadata.error is not None or not metadata.partitions:
+            raise KafkaMessageNotFoundError(f"Topic {topic} was not found")
+        return sorted(metadata.partitions.keys())
+
+    def pause(self):
+        """
+        Requests that fetching is paused. Batches already consumed are still handled.
+        """
+        self._pause_requested = True
+
+    def resume(self):
+        """
+        Requests that paused fetching is resumed.
+        """
+        self._pause_requested = False
+
+
+class KafkaTopicStream:
+    """
+    Streams the messages of a topic, or topic partition, to the event loop using a
+    ConfluentAsyncKafkaListener.
+
+    Messages are buffered in a bounded queue. The listener's handler waits for queue capacity, so the
+    listener stops fetching while max_buffered messages are queued, and a slow reader does not cause
+    messages to accumulate in memory.
+
+    Segmented records are reassembled in the stream's own SegmentStore, as streams of the same topic
+    receive the same segments. Invalid segments are skipped.
+    """
+
+    def __init__(
+        self,
+        listener: ConfluentAsyncKafkaListener,
+        max_buffered: int,
+        max_segment_bytes: int,
+    ):
+        """
+        :param listener: the listener used to consume messages. Batches must be handled one at a time
+            so that messages are streamed in order.
+        :param max_buffered: the maximum number of queued messages
+        :param max_segment_bytes: the maximum total size of the segmented records being reassembled
+        """
+        self._listener = listener
+        self._loop = listener._loop
+        self._queue = asyncio.Queue(maxsize=max_buffered)
+        self._segment_store = SegmentStore(
+            max_segment_bytes, get_settings().kafka_segments_purge_timeout
+        )
+
+    async def start(
+        self, topic: str, partition: Optional[int] = None, offset: int = OFFSET_END
+    ):
+        """
+        Starts streaming messages.
+
+        :param topic: the topic name
+        :param partition: the partition id, or None to stream all of the topic's partitions
+        :param offset: the offset to start from in each partition, OFFSET_END, OFFSET_BEGINNING or an offset
+        :raise: KafkaMessageNotFoundError if the topic does not exist
+        """
+        if partition is None:
+            partitions = await self._loop.run_in_executor(
+                None, self._listener.list_partitions, topic
+            )
+        else:
+            partitions = [partition]
+
+        self._listener.assign(
+            [TopicPartition(topic, p, offset) for p in partitions], self._handle
+        )
+
+    async def _handle(self, messages: list):
+        for msg in messages:
+            location = f"{msg.topic()}:{msg.partition()}:{msg.offset()}"
+            value = msg.value()
+            if _get_segment(msg) is not None:
+                # segmented records are sent once reassembled, located at their first segment
+                try:
+                    segmented = self._segment_store.add(value, msg.headers(), location)
+                except ValueError as ve:
+                    logger.warning(f"Topic stream: skipping segment {location}: {ve}")
+                    continue
+                if segmented is None:
+                    continue
+                location, value = segmented.location, segmented.buffer
+            await self._queue.put((location, value))
+
+    async def get(self) -> Tuple[str, bytes]:
+        """
+        Waits for the next message.
+
+        :return: tuple of the message location, topic:partition:offset, and the message body
+        """
+        return await self._queue.get()
+
+    async def close(self):
+        """
+        Closes the stream's listener, without blocking the event loop while the poll thread exits.
+        """
+        await self._loop.run_in_executor(None, self._listener.close)
 
 
 def create_kafka_listeners():
@@ -331,21 +1355,44 @@ def create_kafka_listeners():
 
 def create_topics():
     """
-    Create any required kafka topics if they don't exist.
+    Create any required kafka topics if they don't exist. Topics are created with the partition count
+    configured in KAFKA_ADMIN_NEW_TOPIC_PARTITIONS_OVERRIDES, or KAFKA_ADMIN_NEW_TOPIC_PARTITIONS.
+
+    Existing topics are not repartitioned, as adding partitions changes the partition of keyed records.
     """
     settings = get_settings()
     client = AdminClient(
         {"bootstrap.servers": "".join(settings.kafka_bootstrap_servers)}
     )
     metadata = client.list_topics()
-    if metadata.topics.get(kafka_sync_topic) is None:
-        new_topic = NewTopic(
-            kafka_sync_topic,
-            num_partitions=settings.kafka_admin_new_topic_partitions,
-            replication_factor=settings.kafka_admin_new_topic_replication_factor,
-        )
-        client.create_topics([new_topic])
-        logger.debug(f"create_topics: created topic = {kafka_sync_topic}")
+    topics = {
+        kafka_sync_topic: settings.kafka_admin_new_topic_partitions,
+        **settings.kafka_admin_new_topic_partitions_overrides,
+    }
+
+    new_topics = []
+    for topic, partitions in topics.items():
+        topic_metadata = metadata.topics.get(topic)
+        if topic_metadata is None:
+            new_topics.append(
+                NewTopic(
+                    topic,
+                    num_partitions=partitions,
+                    replication_factor=settings.kafka_admin_new_topic_replication_factor,
+                )
+            )
+        elif len(topic_metadata.partitions) < partitions:
+            logger.warning(
+                f"create_topics: topic {topic} has {len(topic_metadata.partitions)} partitions, "
+                + f"{partitions} are configured"
+            )
+
+    if new_topics:
+        client.create_topics(new_topics)
+        for new_topic in new_topics:
+            logger.debug(
+                f"create_topics: created topic = {new_topic.topic}, partitions = {new_topic.num_partitions}"
+            )
 
 
 def stop_kafka_listeners():
@@ -356,8 +1403,11 @@ def stop_kafka_listeners():
         listener.close()
 
 
-def get_kafka_listener() -> Optional[ConfluentAsyncKafkaListener]:
+def get_kafka_listener(
+    params: Optional[dict] = None,
+) -> Optional[ConfluentAsyncKafkaListener]:
     """
+    :param params: listener parameters which override the configured parameters
     :return: a new connected ConfluentAsyncKafkaListener instance
     """
     settings = get_settings()
@@ -368,13 +1418,48 @@ def get_kafka_listener() -> Optional[ConfluentAsyncKafkaListener]:
     }
     listener_params = {
         "poll_timeout": settings.kafka_listener_timeout,
-        "poll_yield": settings.kafka_topics_timeout,
+        "batch_size": settings.kafka_listener_batch_size,
+        "max_in_flight": settings.kafka_listener_max_in_flight,
+        "partition_workers": settings.kafka_listener_partition_workers,
+        "commit_offsets": True,
+        "restart_backoff": settings.kafka_listener_restart_backoff_secs,
+        "restart_max_backoff": settings.kafka_listener_restart_max_backoff_secs,
+        **(params or {}),
     }
     return ConfluentAsyncKafkaListener(
         configs=consumer_conf, params=listener_params, loop=get_running_loop()
     )
 
 
+async def get_kafka_topic_stream(
+    topic: str, partition: Optional[int] = None, offset: int = OFFSET_END
+) -> KafkaTopicStream:
+    """
+    :param topic: the topic name
+    :param partition: the partition id, or None to stream all of the topic's partitions
+    :param offset: the offset to start from in each partition, OFFSET_END, OFFSET_BEGINNING or an offset
+    :return: a new, started, KafkaTopicStream instance. The caller must close the stream.
+    :raise: KafkaMessageNotFoundError if the topic does not exist
+    """
+    # messages are streamed in order, and stream offsets are not committed to the consumer group.
+    # Lag gauges are not registered, as they would replace the consumer group listener's gauges.
+    listener = get_kafka_listener(
+        {"max_in_flight": 1, "commit_offsets": False, "lag_gauges": False}
+    )
+    settings = get_settings()
+    stream = KafkaTopicStream(
+        listener,
+        settings.kafka_topic_stream_max_buffered,
+        settings.kafka_topic_stream_segments_max_bytes,
+    )
+    try:
+        await stream.start(topic, partition, offset)
+    except Exception:
+        await stream.close()
+        raise
+    return stream
+
+
 # *************************************
 # Kafka callback for storage operations
 # *************************************
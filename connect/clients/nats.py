@@ -4,15 +4,17 @@ NATS message subscribers and message handlers
 """
 import asyncio
 import connect.workflows.core as core
-import json
+import functools
+import httpx
 import logging
 import os
 import ssl
+import time
 from asyncio import get_running_loop
 from datetime import datetime
-from httpx import AsyncClient
 from nats.aio.client import Client as NatsClient, Msg
 from typing import Callable, List, Optional
+from connect.clients.http import get_http_client_pool, get_transmit_target
 from connect.clients.kafka import get_kafka_producer, KafkaCallback
 from connect.config import (
     get_settings,
@@ -21,24 +23,39 @@ from connect.config import (
     nats_retransmit_subject,
     kafka_sync_topic,
 )
+from connect.exceptions import TransmitTargetUnavailableError
 from connect.support.encoding import (
-    decode_to_dict,
-    ConnectEncoder,
+    encode_json,
+    decode_json,
+    decode_record,
+    decode_to_bytes,
 )
+from connect.support.metrics import get_metrics_registry
+from connect.support.record_keys import (
+    get_key_strategy,
+    get_record_key,
+    resource_key_strategies,
+)
+from connect.support.retransmit_queue import (
+    close_retransmit_queue,
+    get_retransmit_queue,
+)
+from connect.support.retransmit_scheduler import RetransmitScheduler
 
 
 logger = logging.getLogger(__name__)
 nats_client = None
 nats_clients = []
-timing_metrics = {}
-nats_retransmit_queue = []
-nats_retransmit_canceled = False
+retransmit_scheduler = None
+nats_timing_export_canceled = False
 
 
 async def create_nats_subscribers():
     """
     Create NATS subscribers.  Add additional subscribers as needed.
+    The retransmit queue is recovered from its log in an executor, before retransmit messages are received.
     """
+    await asyncio.get_running_loop().run_in_executor(None, get_retransmit_queue)
     await start_sync_event_subscribers()
     await start_timing_subscriber()
     await start_retransmit_subscriber()
@@ -46,6 +63,9 @@ async def create_nats_subscribers():
     retransmit_loop = asyncio.get_event_loop()
     retransmit_loop.create_task(retransmitter())
 
+    if get_settings().connect_timing_export_enabled:
+        retransmit_loop.create_task(timing_exporter())
+
 
 async def start_sync_event_subscribers():
     """
@@ -72,6 +92,7 @@ async def start_sync_event_subscribers():
 async def start_timing_subscriber():
     """
     Create a NATS subscriber for the NATS subject TIMING at the local NATS server/cluster.
+    TIMING messages contain the timing metrics exported by other LFH instances.
     """
     settings = get_settings()
 
@@ -88,10 +109,16 @@ async def start_timing_subscriber():
 async def start_retransmit_subscriber():
     """
     Create a NATS subscriber 'nats_retransmit_subject', as defined in config.py, for the local NATS server/cluster.
+    Messages queued for retransmission prior to a restart are recovered from the retransmit queue log.
     """
     settings = get_settings()
 
-    # subscribe to TIMING.* from the local NATS server or cluster
+    retransmit_queue = get_retransmit_queue()
+    get_metrics_registry().gauge(
+        "retransmit_queue_length", lambda: len(retransmit_queue)
+    )
+
+    # subscribe to nats_retransmit_subject from the local NATS server or cluster
     client = await get_nats_client()
     await subscribe(
         client,
@@ -116,42 +143,64 @@ async def subscribe(client: NatsClient, subject: str, callback: Callable, server
 
 async def nats_sync_event_handler(msg: Msg):
     """
-    Callback for NATS 'nats_sync_subject' messages
+    Callback for NATS 'nats_sync_subject' messages. Messages may use either record format.
 
     :param msg: a message delivered from the NATS server
     """
     subject = msg.subject
     reply = msg.reply
-    data = msg.data.decode()
+    data = msg.data
     logger.trace(f"nats_sync_event_handler: received a message on {subject} {reply}")
 
     # if the message is from our local LFH, don't store in kafka
-    message = json.loads(data)
+    message, msg_data = decode_record(data)
     if get_settings().connect_lfh_id == message["lfh_id"]:
         logger.trace(
             "nats_sync_event_handler: detected local LFH message, not storing in kafka",
         )
         return
 
-    # store the message in kafka
+    # store the message in kafka, keyed as the replayed record is keyed
+    key_strategy = get_key_strategy(message["data_format"])
+    resource = None
+    if key_strategy in resource_key_strategies:
+        # the payload is parsed once, and only if the key is derived from its resource
+        try:
+            resource = decode_json(msg_data)
+        except ValueError:
+            pass
+    record_key = get_record_key(key_strategy, message["uuid"], resource)
     kafka_producer = get_kafka_producer()
     kafka_cb = KafkaCallback()
-    await kafka_producer.produce_with_callback(
-        kafka_sync_topic, data, on_delivery=kafka_cb.get_kafka_result
-    )
+    if len(data) > get_settings().kafka_message_chunk_size:
+        await kafka_producer.produce_segments(
+            kafka_sync_topic,
+            data,
+            on_delivery=kafka_cb.get_kafka_result,
+            key=record_key,
+        )
+    else:
+        await kafka_producer.produce_with_callback(
+            kafka_sync_topic,
+            data,
+            on_delivery=kafka_cb.get_kafka_result,
+            key=record_key,
+        )
     logger.trace(
         f"nats_sync_event_handler: stored msg in kafka topic {kafka_sync_topic} at {kafka_cb.kafka_result}",
     )
 
     # process the message into the local store
     settings = get_settings()
-    msg_data = decode_to_dict(message["data"])
+    # the replayed record is stored as received, without decoding the data to a dict
     workflow = core.CoreWorkflow(
         message=msg_data,
+        raw_message=msg_data,
         origin_url=message["consuming_endpoint_url"],
         certificate_verify=settings.certificate_verify,
         lfh_id=message["lfh_id"],
         data_format=message["data_format"],
+        record_key=record_key,
         transmit_server=None,
         do_sync=False,
     )
@@ -165,25 +214,38 @@ async def nats_sync_event_handler(msg: Msg):
 
 def nats_timing_event_handler(msg: Msg):
     """
-    Callback for NATS TIMING messages - calculates the average run time for any function timed with @timer.
+    Callback for NATS TIMING messages - merges the timing metrics exported by other LFH instances
+    into the local metrics registry.
 
     :param msg: a message delivered from the NATS server
     """
-    data = msg.data.decode()
+    message = decode_json(msg.data)
+    lfh_id = message["lfh_id"]
+    if get_settings().connect_lfh_id == lfh_id:
+        return
 
-    message = json.loads(data)
-    function_name = message["function"]
-    global timing_metrics
-    if function_name not in timing_metrics:
-        timing_metrics[function_name] = {"total": 0.0, "count": 0, "average": 0.0}
+    get_metrics_registry().update_remote(lfh_id, message["metrics"])
+    logger.trace(f"nats_timing_event_handler: updated timing metrics for {lfh_id}")
 
-    metric = timing_metrics[function_name]
-    metric["total"] += message["elapsed_time"]
-    metric["count"] += 1
-    metric["average"] = metric["total"] / metric["count"]
-    logger.trace(
-        f"nats_timing_event_handler: {function_name}() average elapsed time = {metric['average']:.8f}s",
-    )
+
+async def timing_exporter():
+    """
+    Periodically publishes the local timing metrics to the NATS subject TIMING, for aggregation
+    across LFH instances.
+    """
+    settings = get_settings()
+    logger.trace("Starting timing export loop")
+
+    while not nats_timing_export_canceled:
+        await asyncio.sleep(settings.connect_timing_export_interval_secs)
+        message = {
+            "lfh_id": settings.connect_lfh_id,
+            "metrics": get_metrics_registry().export(),
+        }
+        try:
+            await publish("TIMING", encode_json(message))
+        except Exception as ex:
+            logger.error(f"timing_exporter: unable to publish timing metrics {ex}")
 
 
 async def nats_retransmit_event_handler(msg: Msg):
@@ -194,28 +256,41 @@ async def nats_retransmit_event_handler(msg: Msg):
     """
     subject = msg.subject
     reply = msg.reply
-    data = msg.data.decode()
     logger.trace(
         f"nats_retransmit_event_handler: received a message on {subject} {reply}"
     )
 
-    message = json.loads(data)
-    await do_retransmit(message, -1)
+    message = decode_json(msg.data)
+    await do_retransmit(message)
 
 
-async def do_retransmit(message: dict, queue_pos: int):
+async def do_retransmit(message: dict, queued: bool = False) -> bool:
     """
-    Process messages from NATS or the nats_retransmit_queue.
+    Process messages from NATS or the retransmit queue. Messages are retransmitted in order for each target
+    endpoint, so a new message is queued, without retransmitting, if messages are queued for its target.
+    Server error responses are retried, while client error responses fail permanently. Messages are deferred
+    while the target's TransmitTarget circuit breaker is open, and responses are recorded by the TransmitTarget,
+    so that transmissions and retransmissions to the target share its circuit breaker.
 
     :param message: the LFH message containing the data to retransmit
-    :param queue_pos: the position of the message in the queue.  queue_pos will be -1 if
-        the message has not yet been queued or 0 <= queue_pos < len(nats_retransmit_queue).
+    :param queued: True if the message is the next message queued for its target endpoint
+    :return: True if the message was retransmitted, or failed permanently, and False if the message
+        is queued for retransmission
     """
-    global nats_retransmit_queue
     settings = get_settings()
     max_retries = settings.nats_retransmit_max_retries
-    kafka_producer = get_kafka_producer()
-    resource = decode_to_dict(message["data"])
+    retransmit_queue = get_retransmit_queue()
+
+    if not queued and retransmit_queue.has_target(message["target_endpoint_url"]):
+        if retransmit_queue.put(message):
+            logger.trace(f"do_retransmit: queued message behind queued target messages")
+            _notify_retransmitter()
+            return False
+        message["status"] = "FAILED"
+        await _send_retransmit_outcome(message)
+        return True
+
+    resource = decode_to_bytes(message["data"])
     if "retransmit_count" not in message:
         message["retransmit_count"] = 0
     message["retransmit_count"] += 1
@@ -225,17 +300,41 @@ async def do_retransmit(message: dict, queue_pos: int):
         logger.trace(
             f"do_retransmit #{message['retransmit_count']}: retransmitting to: {message['target_endpoint_url']}"
         )
-        async with AsyncClient(verify=settings.certificate_verify) as client:
-            if message["operation"] == "POST":
-                await client.post(message["target_endpoint_url"], json=resource)
-            elif message["operation"] == "PUT":
-                await client.put(message["target_endpoint_url"], json=resource)
-            elif message["operation"] == "PATCH":
-                await client.patch(message["target_endpoint_url"], json=resource)
+        client = get_http_client_pool()
+        verify = settings.certificate_verify
+        headers = {"Content-Type": "application/json"}
+        send = {"POST": client.post, "PUT": client.put, "PATCH": client.patch}.get(
+            message["operation"]
+        )
+        if send is None:
+            raise ValueError(f"Unsupported operation {message['operation']}")
+
+        message.pop("transmit_status_code", None)
+        target = get_transmit_target(message["target_endpoint_url"])
+        if not target.allow_request():
+            raise TransmitTargetUnavailableError(target.origin)
+        request_start = time.perf_counter()
+        try:
+            response = await send(
+                message["target_endpoint_url"],
+                verify,
+                content=resource,
+                headers=headers,
+                timeout=target.get_timeout(),
+            )
+        except BaseException:
+            target.record_failure()
+            raise
+        target.record_response(
+            response.status_code, time.perf_counter() - request_start
+        )
+        message["transmit_status_code"] = response.status_code
+        # server errors are retried, while client errors fail permanently
+        response.raise_for_status()
 
         # if the message came from the retransmit queue, remove it
-        if not queue_pos == -1:
-            nats_retransmit_queue.pop(queue_pos)
+        if queued:
+            retransmit_queue.remove(message)
         message["status"] = "SUCCESS"
         logger.trace(
             f"do_retransmit: successfully retransmitted message with id {message['uuid']} "
@@ -243,49 +342,147 @@ async def do_retransmit(message: dict, queue_pos: int):
         )
     except Exception as ex:
         logger.trace(f"do_retransmit: exception {ex}")
-        if queue_pos == -1:
-            nats_retransmit_queue.append(message)
-            logger.trace(f"do_retransmit: queued message for retransmitter()")
-
-        if not max_retries == -1 and message["retransmit_count"] >= max_retries:
-            nats_retransmit_queue.pop(queue_pos)
+        if isinstance(ex, TransmitTargetUnavailableError):
+            # the message was not sent while the target's circuit breaker is open
+            message["retransmit_count"] -= 1
+        if _is_permanent_failure(ex) or (
+            not max_retries == -1 and message["retransmit_count"] >= max_retries
+        ):
+            retransmit_queue.remove(message)
             message["status"] = "FAILED"
             logger.trace(
                 f"do_retransmit: failed retransmit of message with id {message['uuid']} "
                 + f"after {message['retransmit_count']} retries"
             )
+        elif queued:
+            retransmit_queue.retry(message)
+        elif retransmit_queue.put(message):
+            logger.trace(f"do_retransmit: queued message for retransmitter()")
+            _notify_retransmitter()
+        else:
+            message["status"] = "FAILED"
 
     # send outcome to kafka
     if message["status"] == "SUCCESS" or message["status"] == "FAILED":
-        transmit_delta = datetime.now() - datetime.strptime(
-            message["transmit_start"], "%Y-%m-%dT%H:%M:%S.%f"
+        await _send_retransmit_outcome(message)
+        return True
+    return False
+
+
+def _is_permanent_failure(ex: Exception) -> bool:
+    """
+    :return: True if a retransmit failure will not succeed if retried, such as a client error response
+    """
+    if isinstance(ex, httpx.HTTPStatusError):
+        return ex.response.status_code < 500
+    return isinstance(ex, ValueError)
+
+
+async def _send_retransmit_outcome(message: dict):
+    """
+    Sends the outcome of a retransmitted message to the Kafka topic RETRANSMIT.
+
+    :param message: the LFH message, with status SUCCESS or FAILED
+    """
+    transmit_delta = datetime.now() - datetime.strptime(
+        message["transmit_start"], "%Y-%m-%dT%H:%M:%S.%f"
+    )
+    message["elapsed_transmit_time"] = transmit_delta.total_seconds()
+    message["elapsed_total_time"] += transmit_delta.total_seconds()
+    await get_kafka_producer().produce(
+        "RETRANSMIT", encode_json(message), key=str(message["uuid"]).encode()
+    )
+    logger.trace(f"do_retransmit: sent message to kafka topic RETRANSMIT")
+
+
+async def queue_transmit(message: dict) -> bool:
+    """
+    Queues a stored message for transmission by the retransmitter, for asynchronous transmission. The
+    transmission outcome is sent to the Kafka topic RETRANSMIT.
+
+    The message is synced to the retransmit queue log before returning, so that an accepted transmission
+    is recovered on restart. Concurrent transmissions share a sync. Messages are not queued if the queue
+    is not backed by its log.
+
+    :param message: the LFH message containing the data to transmit
+    :return: False if the retransmit queue is not durable, or is full, or cannot be synced, and the message
+        was not queued
+    """
+    retransmit_queue = get_retransmit_queue()
+    if not retransmit_queue.is_durable():
+        logger.warning(
+            "queue_transmit: the retransmit queue is held in memory, unable to queue message "
+            + f"{message['uuid']}"
         )
-        message["elapsed_transmit_time"] = transmit_delta.total_seconds()
-        message["elapsed_total_time"] += transmit_delta.total_seconds()
-        await kafka_producer.produce(
-            "RETRANSMIT", json.dumps(message, cls=ConnectEncoder)
+        return False
+    if not retransmit_queue.put(message):
+        return False
+    try:
+        await retransmit_queue.sync()
+    except OSError as ex:
+        logger.error(
+            f"queue_transmit: unable to sync the retransmit queue, message {message['uuid']} was not queued: {ex}"
         )
-        logger.trace(f"do_retransmit: sent message to kafka topic RETRANSMIT")
+        retransmit_queue.remove(message)
+        return False
+    logger.trace(f"queue_transmit: queued message with id {message['uuid']}")
+    _notify_retransmitter()
+    return True
+
+
+def _notify_retransmitter():
+    """
+    Wakes the retransmit scheduler, if started, once a message is queued.
+    """
+    if retransmit_scheduler is not None:
+        retransmit_scheduler.notify()
+
+
+def get_retransmit_scheduler() -> Optional[RetransmitScheduler]:
+    """
+    :return: the RetransmitScheduler instance, for the retransmit queue
+    """
+    global retransmit_scheduler
+    if retransmit_scheduler is None:
+        settings = get_settings()
+        retransmit_scheduler = RetransmitScheduler(
+            get_retransmit_queue(),
+            functools.partial(do_retransmit, queued=True),
+            lambda target: get_transmit_target(target).breaker,
+            target_concurrency=settings.nats_retransmit_target_concurrency,
+            backoff=settings.nats_retransmit_backoff_secs,
+            max_backoff=settings.nats_retransmit_max_backoff_secs,
+            scan_interval=settings.nats_retransmit_loop_interval_secs,
+        )
+    return retransmit_scheduler
 
 
 async def retransmitter():
     """
-    Process messages in nats_retransmit_queue.
+    Process messages in the retransmit queue. Failed messages are retried with an exponential backoff,
+    and each target endpoint's retransmits are deferred while the target is unavailable.
     """
-    global nats_retransmit_queue
-    settings = get_settings()
     logger.trace("Starting retransmit loop")
+    await get_retransmit_scheduler().run()
 
-    while not nats_retransmit_canceled:
-        # iterate through nats_retransmit_queue
-        for i in range(len(nats_retransmit_queue)):
-            logger.trace(
-                f"retransmitter: retransmitting from nats_retransmit_queue position {i}"
-            )
-            await do_retransmit(nats_retransmit_queue[i], i)
-            if i + 1 < len(nats_retransmit_queue):
-                await asyncio.sleep(2)
-        await asyncio.sleep(settings.nats_retransmit_loop_interval_secs)
+
+async def publish(subject: str, data: bytes, data_format: str = None) -> None:
+    """
+    Publish a message to the local NATS server/cluster, recording the publish latency.
+
+    :param subject: the NATS subject to publish to
+    :param data: the message data
+    :param data_format: the data format of the message, if applicable
+    """
+    nats_client = await get_nats_client()
+    start_time = time.perf_counter()
+    await nats_client.publish(subject, data)
+
+    labels = {"subject": subject}
+    if data_format:
+        labels["data_format"] = data_format
+    publish_time = time.perf_counter() - start_time
+    get_metrics_registry().histogram("nats_publish", **labels).observe(publish_time)
 
 
 async def stop_nats_clients():
@@ -296,8 +493,14 @@ async def stop_nats_clients():
     for client in nats_clients:
         await client.close()
 
-    global nats_retransmit_canceled
-    nats_retransmit_canceled = True
+    global retransmit_scheduler
+    if retransmit_scheduler is not None:
+        await retransmit_scheduler.close()
+        retransmit_scheduler = None
+    close_retransmit_queue()
+
+    global nats_timing_export_canceled
+    nats_timing_export_canceled = True
 
 
 async def get_nats_client() -> Optional[NatsClient]:
@@ -11,7 +11,7 @@ Example:
 """
 from pydantic import BaseSettings
 from functools import lru_cache
-from typing import List
+from typing import Any, Dict, List, Literal
 from datetime import timedelta
 import os
 from os.path import dirname, abspath
@@ -54,21 +54,117 @@ class Settings(BaseSettings):
     connect_external_fhir_server: str = None
     connect_rate_limit: str = "5/second"
     connect_timing_enabled: bool = False
+    # JSON serialization library: json, orjson, msgspec, ujson or auto (the fastest installed library)
+    connect_json_backend: Literal["auto", "json", "orjson", "msgspec", "ujson"] = "json"
+    # stored and synchronized record format: json (base64-encoded data) or binary (raw data bytes)
+    connect_record_format: Literal["json", "binary"] = "json"
+    # maximum total size of the stored records cached for /data reads, 0 disables the cache
+    connect_record_cache_max_bytes: int = 64 * 1024 * 1024
+    # publish timing metrics to NATS for aggregation across LFH instances
+    connect_timing_export_enabled: bool = False
+    connect_timing_export_interval_secs: float = 10.0
+    # maximum number of resources accepted in a single FHIR bundle or NDJSON request
+    connect_fhir_batch_max_entries: int = 1000
+    # maximum number of records returned by a /data range or batch request
+    connect_data_max_records: int = 10000
 
     # kakfa
     kafka_bootstrap_servers: List[str] = ["kafka:9092"]
     kafka_segments_purge_timeout: float = timedelta(minutes=10).total_seconds()
+    # records larger than the chunk size are stored as segments
     kafka_message_chunk_size: int = 900 * 1024  # 900 KB chunk_size
+    # maximum total size of the segmented records being reassembled by listeners
+    kafka_segments_max_bytes: int = 256 * 1024 * 1024
     kafka_producer_acks: str = "all"
+    # librdkafka compression.type: none, gzip, snappy, lz4 or zstd
+    kafka_producer_compression_type: str = "none"
+    # additional librdkafka producer configuration, applied after the settings above
+    # Example: {"linger.ms": 5, "batch.num.messages": 10000, "enable.idempotence": true}
+    kafka_producer_config: Dict[str, Any] = {}
+    # time to wait for producer queue capacity before a record fails
+    kafka_producer_queue_full_timeout_secs: float = 5.0
+    # requests are rejected with a 503 when the producer queue exceeds this ratio of its capacity
+    kafka_producer_queue_saturation_ratio: float = 0.9
+    kafka_producer_retry_after_secs: int = 1
+    # batch records persisted by concurrent workflows, using the producer's linger.ms and batch.num.messages
+    # kafka_producer_config values take precedence
+    kafka_producer_batch_enabled: bool = False
+    kafka_producer_batch_max_size: int = 100
+    kafka_producer_batch_max_linger_secs: float = 0.005
+    # message keys of stored records, so that records with the same key are stored in order in one partition
+    # strategies: none, uuid, resource_id (FHIR resource id) or patient (FHIR patient reference)
+    kafka_producer_key_strategy: Literal[
+        "none", "uuid", "resource_id", "patient"
+    ] = "none"
+    # key strategies by data format
+    # Example: {"FHIR-R4_OBSERVATION": "patient"}
+    kafka_producer_key_strategy_overrides: Dict[
+        str, Literal["none", "uuid", "resource_id", "patient"]
+    ] = {}
     kafka_consumer_default_group_id: str = "lfh_consumer_group"
     kafka_consumer_default_enable_auto_commit: bool = False
     kafka_consumer_default_enable_auto_offset_store: bool = False
     kafka_consumer_default_poll_timeout_secs: float = 1.0
     kafka_consumer_default_auto_offset_reset: str = "error"
+    # long-lived consumers used for /data point reads
+    kafka_consumer_pool_enabled: bool = True
+    kafka_consumer_pool_max_size: int = 8
+    kafka_consumer_pool_min_size: int = 1
+    kafka_consumer_pool_idle_timeout_secs: float = 300.0
+    # maximum number of messages fetched at once by /data range and batch reads
+    kafka_consumer_consume_batch_size: int = 500
     kafka_admin_new_topic_partitions: int = 1
+    # partition counts of topics, such as data format topics, created at startup if they don't exist
+    # Example: {"FHIR-R4_PATIENT": 6, "FHIR-R4_OBSERVATION": 12}
+    kafka_admin_new_topic_partitions_overrides: Dict[str, int] = {}
     kafka_admin_new_topic_replication_factor: int = 1
     kafka_listener_timeout: float = 1.0
-    kafka_topics_timeout: float = 0.5
+    kafka_listener_batch_size: int = 100
+    kafka_listener_max_in_flight: int = 4
+    # handle each assigned partition with its own worker. max in flight should be at least the partition count.
+    kafka_listener_partition_workers: bool = False
+    kafka_listener_restart_backoff_secs: float = 1.0
+    kafka_listener_restart_max_backoff_secs: float = 30.0
+    # /data/stream listeners are paused while this many records are waiting to be sent
+    kafka_topic_stream_max_buffered: int = 100
+    # maximum total size of the segmented records being reassembled by each /data/stream listener
+    kafka_topic_stream_segments_max_bytes: int = 32 * 1024 * 1024
+
+    # http client pool for transmission to external servers
+    http_client_max_connections: int = 100
+    http_client_max_connections_per_host: int = 20
+    http_client_max_keepalive_connections: int = 20
+    http_client_keepalive_expiry_secs: float = 30.0
+    http_client_http2: bool = False
+    # per target circuit breaker, which probes the target once the reset time expires
+    transmit_breaker_failure_threshold: int = 5
+    transmit_breaker_reset_secs: float = 30.0
+    # adaptive transmit timeout: a latency percentile, times the multiplier, within the min and max timeout
+    # the default timeout applies until the target has min samples responses
+    transmit_timeout_secs: float = 10.0
+    transmit_timeout_min_secs: float = 1.0
+    transmit_timeout_max_secs: float = 30.0
+    transmit_timeout_percentile: float = 99.0
+    transmit_timeout_multiplier: float = 3.0
+    transmit_timeout_min_samples: int = 20
+    # sync: requests are answered with the external server's response
+    # async: requests are acknowledged (202) once stored, and transmitted from the durable retransmit queue.
+    # async transmissions are synced to the queue log, group committed with concurrent transmissions, and are
+    # transmitted synchronously if the log is unavailable.
+    # see nats_retransmit_target_concurrency.
+    transmit_mode: Literal["sync", "async"] = "sync"
+    # transmit mode overrides, keyed by route, such as /fhir/Observation
+    transmit_mode_overrides: Dict[str, Literal["sync", "async"]] = {}
+
+    # payload compression, applied to record payloads before storage and synchronization
+    # codecs: none, zlib or zstd (requires the zstandard package)
+    payload_compression_codec: Literal["none", "zlib", "zstd"] = "none"
+    payload_compression_level: int = 3
+    payload_compression_min_size: int = 256
+    # codec overrides, keyed by data format
+    payload_compression_codec_overrides: Dict[str, Literal["none", "zlib", "zstd"]] = {}
+    # zstd dictionary files, keyed by data format, relative to the connect config directory
+    payload_compression_dictionaries: Dict[str, str] = {}
 
     # nats
     nats_servers: List[str] = ["tls://nats-server:4222"]
@@ -79,6 +175,30 @@ class Settings(BaseSettings):
     nats_enable_retransmit: bool = True
     nats_retransmit_loop_interval_secs: int = 10
     nats_retransmit_max_retries: int = 20
+    # durable retransmit queue log, recovered on startup
+    nats_retransmit_queue_path: str = "/home/lfh/connect/data/retransmit_queue.log"
+    nats_retransmit_queue_max_entries: int = 100000
+    # sync the retransmit queue log to disk after each change
+    nats_retransmit_queue_fsync: bool = False
+    # concurrent retransmits per target endpoint. 1 retransmits each target's messages in order.
+    # async transmissions (transmit_mode) are sent by the retransmitter, so the default limits async mode to
+    # one in flight request per target, which is much slower than sync mode under load. Increase for async mode.
+    nats_retransmit_target_concurrency: int = 1
+    # exponential retry backoff, with jitter
+    nats_retransmit_backoff_secs: float = 1.0
+    nats_retransmit_max_backoff_secs: float = 300.0
+    # retransmits are deferred while the target's transmit circuit breaker is open, see transmit_breaker_*
+
+    # fhir
+    # resource types resolved at startup, to avoid first request latency
+    fhir_warmup_resource_types: List[str] = ["Patient", "Encounter", "Observation"]
+    # full, structural or sampled (full validation for a percentage of resources and new resource types)
+    fhir_validation_mode: Literal["full", "structural", "sampled"] = "full"
+    fhir_validation_sample_percent: float = 10.0
+    # validation mode overrides, keyed by resource type
+    fhir_validation_mode_overrides: Dict[
+        str, Literal["full", "structural", "sampled"]
+    ] = {}
 
     # ipfs-cluster
     ipfs_cluster_uri: str = "http://0.0.0.0:9099"
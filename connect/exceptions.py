@@ -9,7 +9,7 @@ from pydantic import BaseModel, constr
 from typing import Any, Optional
 
 
-data_record_regex = "^[A-Za-z0-9_-]*:[0-9]*:[0-9]*$"
+data_record_regex = "^[A-Za-z0-9_-]+:[0-9]+:[0-9]+$"
 
 
 class LFHError(BaseModel):
@@ -54,8 +54,26 @@ class KafkaStorageError(Exception):
         super(KafkaStorageError, self).__init__(msg)
 
 
+class KafkaProducerQueueFullError(Exception):
+    """Raised when the Kafka producer queue remains full for longer than the configured timeout"""
+
+    def __init__(self, msg=None):
+        if msg is None:
+            msg = "Kafka producer queue is full"
+        super(KafkaProducerQueueFullError, self).__init__(msg)
+
+
 class KafkaMessageNotFoundError(Exception):
     """Raised when a message for the specified topic, partition and offset cannot be found"""
 
     def __init__(self, msg):
         super(KafkaMessageNotFoundError, self).__init__(msg)
+
+
+class TransmitTargetUnavailableError(Exception):
+    """Raised when a transmission is deferred because the target server's circuit breaker is open"""
+
+    def __init__(self, target):
+        super(TransmitTargetUnavailableError, self).__init__(
+            f"Transmit target {target} is unavailable"
+        )
@@ -11,12 +11,14 @@ from connect.routes.api import router
 from connect import __version__
 from connect.server_handlers import (
     close_internal_clients,
+    configure_fhir_resources,
     configure_internal_integrations,
     configure_logging,
     log_configuration,
     http_exception_handler,
+    rate_limit_exceeded_handler,
 )
-from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 from slowapi.util import get_remote_address
@@ -39,6 +41,7 @@ def get_app() -> FastAPI:
     app.include_router(router)
     app.add_event_handler("startup", configure_logging)
     app.add_event_handler("startup", log_configuration)
+    app.add_event_handler("startup", configure_fhir_resources)
     app.add_event_handler("startup", configure_internal_integrations)
     app.add_event_handler("shutdown", close_internal_clients)
     app.add_exception_handler(HTTPException, http_exception_handler)
@@ -49,7 +52,7 @@ def get_app() -> FastAPI:
         key_func=get_remote_address, default_limits=[settings.connect_rate_limit]
     )
     app.state.limiter = limiter
-    app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+    app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 
     return app
 
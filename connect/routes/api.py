@@ -4,9 +4,10 @@ api.py
 Configures the API Router for the Fast API application
 """
 from fastapi import APIRouter
-from connect.routes import data, status, fhir
+from connect.routes import data, status, fhir, metrics
 
 router = APIRouter()
 router.include_router(data.router, prefix="/data")
 router.include_router(status.router, prefix="/status")
 router.include_router(fhir.router, prefix="/fhir")
+router.include_router(metrics.router, prefix="/metrics")
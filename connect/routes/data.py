@@ -1,22 +1,35 @@
 """
 data.py
 
-Provides access to LinuxForHealth data records using the /data [GET] endpoint
+Provides access to LinuxForHealth data records using the /data [GET] endpoint.
+Ranges of records, and lists of records, are returned as newline delimited JSON (NDJSON) using the
+/data/range [GET] and /data/batch [POST] endpoints. New records are streamed using the /data/stream [GET]
+endpoint.
 """
+import logging
+from collections import defaultdict
 from pydantic import BaseModel, AnyUrl, constr
+from fastapi import Body, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter, HTTPException
-from typing import Optional
-from connect.clients.kafka import get_kafka_consumer
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from connect.clients.kafka import get_kafka_consumer, get_kafka_topic_stream
+from connect.config import get_settings
 from connect.exceptions import KafkaMessageNotFoundError
-from confluent_kafka import KafkaException
+from connect.support.encoding import (
+    decode_record,
+    decode_record_to_dict,
+    encode_json,
+)
+from confluent_kafka import KafkaException, OFFSET_BEGINNING, OFFSET_END
 
 import uuid
 import datetime
-import json
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 
-data_record_regex = "^[A-Za-z0-9_-]*:[0-9]*:[0-9]*$"
+data_record_regex = "^[A-Za-z0-9_-]+:[0-9]+:[0-9]+$"
 
 
 class LinuxForHealthDataRecordResponse(BaseModel):
@@ -34,6 +47,7 @@ class LinuxForHealthDataRecordResponse(BaseModel):
     consuming_endpoint_url: str
     data: str
     data_format: str
+    data_encoding: Optional[str]
     status: Optional[str]
     data_record_location: Optional[constr(regex=data_record_regex)]
     target_endpoint_url: Optional[AnyUrl]
@@ -44,9 +58,16 @@ class LinuxForHealthDataRecordResponse(BaseModel):
 
 
 @router.get("")
-async def get_data_record(dataformat: str, partition: int, offset: int):
+async def get_data_record(
+    dataformat: str, partition: int, offset: int, request: Request
+):
     """
     Returns a single data record from the LinuxForHealth data store.
+    Records stored in either record format are returned as a LinuxForHealthDataRecordResponse.
+    If the request accepts application/octet-stream, and not application/json, the raw record data is
+    returned with the record's uuid and data format in the LinuxForHealth-MessageId and
+    LinuxForHealth-DataFormat headers.
+
     Raises relevant HTTP exceptions for:
       400 - BAD_REQUEST;
       404 - NOT_FOUND and
@@ -55,11 +76,18 @@ async def get_data_record(dataformat: str, partition: int, offset: int):
     :param dataformat: The record's data format
     :param partition: The record partition
     :param offset: The record offset
+    :param request: The incoming request, used to negotiate the response content type
     :return: LinuxForHealthDataRecordResponse
     """
+    accept = request.headers.get("accept", "")
+    if "application/octet-stream" in accept and "application/json" not in accept:
+        callback = _fetch_data_payload_cb
+    else:
+        callback = _fetch_data_record_cb
+
     try:
         kafka_consumer = get_kafka_consumer(dataformat, partition, offset)
-        return await kafka_consumer.get_message_from_kafka_cb(_fetch_data_record_cb)
+        return await kafka_consumer.get_message_from_kafka_cb(callback)
 
     except KafkaException as ke:
         raise HTTPException(status_code=500, detail=str(ke))
@@ -72,8 +100,260 @@ async def get_data_record(dataformat: str, partition: int, offset: int):
 
 
 async def _fetch_data_record_cb(kafka_consumer_msg):
-    decoded_json_dict = json.loads(
-        kafka_consumer_msg
-    )  # Decode message here if necessary in the future
-
+    decoded_json_dict = decode_record_to_dict(kafka_consumer_msg)
     return decoded_json_dict
+
+
+async def _fetch_data_payload_cb(kafka_consumer_msg):
+    message, payload = decode_record(kafka_consumer_msg)
+    headers = {
+        "LinuxForHealth-MessageId": str(message["uuid"]),
+        "LinuxForHealth-DataFormat": str(message["data_format"]),
+    }
+    # reassembled segmented records are read as a bytearray
+    return Response(
+        content=bytes(payload), media_type="application/octet-stream", headers=headers
+    )
+
+
+@router.get("/range")
+async def get_data_records(
+    dataformat: str,
+    partition: int,
+    start: int,
+    end: int,
+    settings=Depends(get_settings),
+):
+    """
+    Returns the data records from the start offset through the end offset, inclusive, as NDJSON. Each line
+    contains a LinuxForHealthDataRecordResponse, with the record's data_record_location. The range is limited
+    to the records available in the partition.
+
+    Raises relevant HTTP exceptions for:
+      400 - BAD_REQUEST;
+      404 - NOT_FOUND, if no records are available within the range;
+      413 - REQUEST_ENTITY_TOO_LARGE and
+      500 - INTERNAL_SERVER_ERROR
+
+    :param dataformat: The records' data format
+    :param partition: The record partition
+    :param start: The first record offset
+    :param end: The last record offset
+    :param settings: Connect configuration settings
+    :return: a StreamingResponse of NDJSON records
+    """
+    if start < 0 or end < start:
+        raise HTTPException(status_code=400, detail=f"invalid range {start}-{end}")
+
+    if end - start + 1 > settings.connect_data_max_records:
+        msg = f"range contains {end - start + 1} records, the maximum is {settings.connect_data_max_records}"
+        raise HTTPException(status_code=413, detail=msg)
+
+    try:
+        kafka_consumer = get_kafka_consumer(dataformat, partition, start)
+        records = kafka_consumer.get_messages_from_kafka_cb(end, _fetch_data_records_cb)
+        # errors raised prior to the first records are returned as an error response
+        first_records = await records.__anext__()
+
+    except StopAsyncIteration:
+        return StreamingResponse(iter(()), media_type="application/x-ndjson")
+
+    except KafkaException as ke:
+        raise HTTPException(status_code=500, detail=str(ke))
+
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    except KafkaMessageNotFoundError as kmnfe:
+        raise HTTPException(status_code=404, detail=str(kmnfe))
+
+    async def stream_records() -> AsyncIterator[bytes]:
+        yield first_records
+        async for next_records in records:
+            yield next_records
+
+    return StreamingResponse(stream_records(), media_type="application/x-ndjson")
+
+
+@router.post("/batch")
+async def post_data_batch(
+    locations: List[constr(regex=data_record_regex)] = Body(...),
+    settings=Depends(get_settings),
+):
+    """
+    Returns the data records at each location, topic:partition:offset, as NDJSON. Each line contains a
+    LinuxForHealthDataRecordResponse, with the record's data_record_location. Records are returned in
+    partition and offset order. Nearby records in a partition are read together.
+
+    A record which cannot be read is returned as a line containing the data_record_location and an error detail.
+
+    Example request:
+        ["FHIR-R4_PATIENT:0:5", "FHIR-R4_PATIENT:0:7", "FHIR-R4_ENCOUNTER:0:2"]
+
+    :param locations: The record locations
+    :param settings: Connect configuration settings
+    :return: a StreamingResponse of NDJSON records
+    :raise: HTTPException if the number of locations exceeds the configured maximum
+    """
+    if len(locations) > settings.connect_data_max_records:
+        msg = f"request contains {len(locations)} locations, the maximum is {settings.connect_data_max_records}"
+        raise HTTPException(status_code=413, detail=msg)
+
+    ranges = _group_locations(locations, settings.kafka_consumer_consume_batch_size)
+    return StreamingResponse(
+        _read_location_ranges(ranges), media_type="application/x-ndjson"
+    )
+
+
+@router.get("/stream")
+async def get_data_stream(
+    dataformat: str,
+    request: Request,
+    partition: Optional[int] = None,
+    start: str = Query("latest", alias="from"),
+    limit: Optional[int] = None,
+):
+    """
+    Streams the data records stored for a data format, as they are stored. Records are returned as NDJSON,
+    or as server-sent events if the request accepts text/event-stream, where the event id is the record's
+    data_record_location. Each record is a LinuxForHealthDataRecordResponse, with the record's
+    data_record_location.
+
+    Records are read as the client receives them. Records are not read ahead of a slow client beyond
+    KAFKA_TOPIC_STREAM_MAX_BUFFERED records.
+
+    Raises relevant HTTP exceptions for:
+      400 - BAD_REQUEST;
+      404 - NOT_FOUND, if the data format has no stored records and
+      500 - INTERNAL_SERVER_ERROR
+
+    :param dataformat: The records' data format
+    :param request: The incoming request, used to negotiate the response content type
+    :param partition: The record partition, or None to stream records from all partitions
+    :param start: Where to start streaming in each partition: "latest" (new records only), "earliest", or an offset
+    :param limit: The number of records after which the stream ends, or None to stream until the client disconnects
+    :return: a StreamingResponse of NDJSON records or server-sent events
+    """
+    if start == "latest":
+        offset = OFFSET_END
+    elif start == "earliest":
+        offset = OFFSET_BEGINNING
+    elif start.isdigit():
+        offset = int(start)
+    else:
+        msg = f"from must be latest, earliest or an offset, not {start}"
+        raise HTTPException(status_code=400, detail=msg)
+
+    try:
+        stream = await get_kafka_topic_stream(dataformat, partition, offset)
+
+    except KafkaException as ke:
+        raise HTTPException(status_code=500, detail=str(ke))
+
+    except KafkaMessageNotFoundError as kmnfe:
+        raise HTTPException(status_code=404, detail=str(kmnfe))
+
+    is_event_stream = "text/event-stream" in request.headers.get("accept", "")
+
+    async def stream_records() -> AsyncIterator[bytes]:
+        count = 0
+        try:
+            while limit is None or count < limit:
+                location, kafka_consumer_msg = await stream.get()
+                try:
+                    decoded_json_dict = decode_record_to_dict(kafka_consumer_msg)
+                except ValueError as ve:
+                    logger.warning(f"Unable to decode record {location}: {ve}")
+                    continue
+
+                decoded_json_dict["data_record_location"] = location
+                record = encode_json(decoded_json_dict)
+                if is_event_stream:
+                    yield b"id: %s\ndata: %s\n\n" % (location.encode(), record)
+                else:
+                    yield record + b"\n"
+                count += 1
+        finally:
+            await stream.close()
+
+    media_type = "text/event-stream" if is_event_stream else "application/x-ndjson"
+    return StreamingResponse(stream_records(), media_type=media_type)
+
+
+def _group_locations(
+    locations: List[str], max_gap: int
+) -> List[Tuple[str, int, List[int]]]:
+    """
+    Groups record locations into ranges of nearby offsets within each topic partition.
+
+    :param locations: The record locations, topic:partition:offset
+    :param max_gap: The maximum gap between offsets in the same range
+    :return: a list of (topic, partition, offsets) tuples, where offsets are sorted
+    """
+    partition_offsets: Dict[Tuple[str, int], Set[int]] = defaultdict(set)
+    for location in locations:
+        topic, partition, offset = location.rsplit(":", 2)
+        partition_offsets[(topic, int(partition))].add(int(offset))
+
+    ranges = []
+    for (topic, partition), offsets in sorted(partition_offsets.items()):
+        current = []
+        for offset in sorted(offsets):
+            if current and offset - current[-1] > max_gap:
+                ranges.append((topic, partition, current))
+                current = []
+            current.append(offset)
+        ranges.append((topic, partition, current))
+    return ranges
+
+
+async def _read_location_ranges(
+    ranges: List[Tuple[str, int, List[int]]]
+) -> AsyncIterator[bytes]:
+    """
+    Reads each range of record locations, returning the requested records as NDJSON.
+
+    :param ranges: (topic, partition, offsets) tuples
+    :return: an async iterator of NDJSON lines
+    """
+    for topic, partition, offsets in ranges:
+        requested = set(offsets)
+        found = set()
+
+        async def fetch_requested_records(kafka_consumer_msgs):
+            requested_msgs = []
+            for location, kafka_consumer_msg in kafka_consumer_msgs:
+                offset = int(location.rsplit(":", 1)[1])
+                if offset in requested:
+                    found.add(offset)
+                    requested_msgs.append((location, kafka_consumer_msg))
+            return await _fetch_data_records_cb(requested_msgs)
+
+        detail = "Data record not found"
+        try:
+            kafka_consumer = get_kafka_consumer(topic, partition, offsets[0])
+            async for records in kafka_consumer.get_messages_from_kafka_cb(
+                offsets[-1], fetch_requested_records
+            ):
+                if records:
+                    yield records
+        except (KafkaException, KafkaMessageNotFoundError, ValueError) as ex:
+            detail = str(ex)
+
+        for offset in offsets:
+            if offset not in found:
+                error = {
+                    "data_record_location": f"{topic}:{partition}:{offset}",
+                    "detail": detail,
+                }
+                yield encode_json(error) + b"\n"
+
+
+async def _fetch_data_records_cb(kafka_consumer_msgs) -> bytes:
+    lines = []
+    for location, kafka_consumer_msg in kafka_consumer_msgs:
+        decoded_json_dict = decode_record_to_dict(kafka_consumer_msg)
+        decoded_json_dict["data_record_location"] = location
+        lines.append(encode_json(decoded_json_dict))
+        lines.append(b"\n")
+    return b"".join(lines)
@@ -1,21 +1,351 @@
 """
 fhir.py
 
-Receive and store any valid FHIR data record using the /fhir [POST] endpoint.
+Receive and store any valid FHIR data record using the /fhir [POST] endpoints.
+Single resources are posted to /fhir/{resource_type}. Multiple resources may be submitted in one
+request as a FHIR batch/transaction Bundle (/fhir) or as newline delimited JSON (/fhir/bulk).
 """
-from fastapi import Body, Depends, HTTPException, Response
+import asyncio
+from fastapi import Body, Depends, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRouter
-from connect.config import get_settings
+from pydantic import BaseModel
+from typing import Any, List, Optional
+from connect.clients.kafka import is_kafka_producer_saturated
+from connect.config import get_settings, Settings
+from connect.exceptions import KafkaProducerQueueFullError
 from connect.workflows.fhir import FhirWorkflow
-from fhir.resources.fhirtypesvalidators import MODEL_CLASSES as FHIR_RESOURCES
+from connect.support.encoding import decode_json
+from connect.support.fhir_resources import is_fhir_resource_type
 
 
 router = APIRouter()
 
+supported_bundle_types = ("batch", "transaction")
+# selects the transmit mode, sync or async, of a request
+transmit_mode_header = "LinuxForHealth-Transmit-Mode"
+
+
+def _raise_service_unavailable(settings: Settings, detail: str):
+    """
+    Raises a 503 HTTPException with a Retry-After header, used when the Kafka producer queue is saturated.
+
+    :param settings: Connect configuration settings
+    :param detail: The error detail
+    :raise: HTTPException with a 503 status code
+    """
+    raise HTTPException(
+        status_code=503,
+        detail=detail,
+        headers={"Retry-After": str(settings.kafka_producer_retry_after_secs)},
+    )
+
+
+def _check_producer_capacity(settings: Settings):
+    """
+    Rejects requests before any work is performed while the Kafka producer queue is saturated.
+
+    :param settings: Connect configuration settings
+    :raise: HTTPException with a 503 status code if the producer queue is saturated
+    """
+    if is_kafka_producer_saturated():
+        _raise_service_unavailable(settings, "Kafka producer queue is saturated")
+
+
+def _get_transmit_mode(request: Request, settings: Settings, route: str) -> str:
+    """
+    Returns the transmit mode of a request, from the transmit mode header if provided, otherwise from the
+    route's configured transmit mode.
+
+    :param request: The incoming request
+    :param settings: Connect configuration settings
+    :param route: The request route, such as /fhir/Patient
+    :return: the transmit mode, sync or async
+    :raise: HTTPException with a 422 status code if the transmit mode header is invalid
+    """
+    transmit_mode = request.headers.get(transmit_mode_header)
+    if transmit_mode is None:
+        return settings.transmit_mode_overrides.get(route, settings.transmit_mode)
+
+    transmit_mode = transmit_mode.lower()
+    if transmit_mode not in ("sync", "async"):
+        msg = f"{transmit_mode_header} {transmit_mode} is not supported. Supported modes: sync, async"
+        raise HTTPException(status_code=422, detail=msg)
+    return transmit_mode
+
+
+class FhirBatchEntryResult(BaseModel):
+    """
+    The processing result for a single resource submitted within a FHIR bundle or NDJSON request.
+    """
+
+    index: int
+    status_code: int
+    resource_type: Optional[str]
+    uuid: Optional[str]
+    data_record_location: Optional[str]
+    detail: Optional[str]
+
+
+@router.post("")
+async def post_fhir_bundle(
+    request: Request,
+    settings=Depends(get_settings),
+    request_data: dict = Body(...),
+):
+    """
+    Receive and process a FHIR Bundle of type "batch" or "transaction". Each bundle entry resource is
+    processed with its own FhirWorkflow. Entries are processed concurrently so that storage requests
+    are submitted to Kafka together.
+
+    A "batch" bundle processes each entry independently. A "transaction" bundle is validated in full
+    before any entry is stored, and every entry is stored before any entry is transmitted. If an entry fails
+    validation, nothing is stored and a 422 response is returned with the per-entry results. If an entry
+    cannot be stored, no entry is transmitted or synchronized, and a 500 response is returned with the
+    per-entry results. Kafka records cannot be withdrawn, so entries which were stored remain stored and
+    include their data_record_location.
+
+    Example bundle to POST:
+        {
+            "resourceType": "Bundle",
+            "type": "batch",
+            "entry": [
+                {"resource": {"resourceType": "Patient", "id": "001", "active": true}},
+                {"resource": {"resourceType": "Patient", "id": "002", "active": true}}
+            ]
+        }
+
+    Example response:
+        Status code: 200
+        Response:
+            [
+                {
+                    "index": 0,
+                    "status_code": 200,
+                    "resource_type": "Patient",
+                    "uuid": "782e1049-79ba-4899-90ec-5cf8a901261a",
+                    "data_record_location": "FHIR-R4_PATIENT:0:5",
+                    "detail": null
+                },
+                ...
+            ]
+
+    :param request: The incoming request, used to select the transmit mode
+    :param settings: Connect configuration settings
+    :param request_data: The incoming FHIR Bundle
+    :return: a list of FhirBatchEntryResult, one per bundle entry
+    :raise: HTTPException if the request is not a supported Bundle, or if its entries are not objects
+    """
+    if request_data.get("resourceType") != "Bundle":
+        msg = f"request {request_data.get('resourceType')} is not a Bundle"
+        raise HTTPException(status_code=422, detail=msg)
+
+    bundle_type = request_data.get("type")
+    if bundle_type not in supported_bundle_types:
+        msg = f"Bundle type {bundle_type} is not supported. Supported types: {supported_bundle_types}"
+        raise HTTPException(status_code=422, detail=msg)
+
+    entries = request_data.get("entry", [])
+    if not isinstance(entries, list) or not all(
+        isinstance(entry, dict) for entry in entries
+    ):
+        raise HTTPException(
+            status_code=400, detail="Bundle entry must be a list of objects"
+        )
+
+    resources = [entry.get("resource") for entry in entries]
+    return await process_fhir_batch(
+        resources,
+        settings,
+        is_transaction=bundle_type == "transaction",
+        transmit_mode=_get_transmit_mode(request, settings, "/fhir"),
+    )
+
+
+@router.post("/bulk")
+async def post_fhir_ndjson(request: Request, settings=Depends(get_settings)):
+    """
+    Receive and process newline delimited JSON (NDJSON), where each line contains a single FHIR resource.
+    Lines are processed independently, as with a "batch" Bundle. Blank lines are ignored.
+
+    :param request: The incoming request containing the NDJSON body
+    :param settings: Connect configuration settings
+    :return: a list of FhirBatchEntryResult, one per NDJSON line
+    """
+    body = await request.body()
+    resources = []
+    raw_resources = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            resources.append(decode_json(line))
+        except ValueError:
+            resources.append(None)
+        raw_resources.append(line)
+
+    return await process_fhir_batch(
+        resources,
+        settings,
+        raw_resources=raw_resources,
+        transmit_mode=_get_transmit_mode(request, settings, "/fhir/bulk"),
+    )
+
+
+async def process_fhir_batch(
+    resources: List[Any],
+    settings: Settings,
+    is_transaction: bool = False,
+    raw_resources: Optional[List[bytes]] = None,
+    transmit_mode: str = "sync",
+) -> List[FhirBatchEntryResult]:
+    """
+    Processes a list of FHIR resources concurrently, using a FhirWorkflow for each resource.
+
+    :param resources: The FHIR resources to process. Invalid entries are reported in the entry results.
+    :param settings: Connect configuration settings
+    :param is_transaction: True if all resources must be valid before any resource is stored, and stored
+        before any resource is transmitted. Resources stored before a failure remain stored.
+    :param raw_resources: The original bytes for each resource, if available, stored in place of the resource
+    :param transmit_mode: The transmit mode, sync or async
+    :return: a list of FhirBatchEntryResult, one per resource
+    :raise: HTTPException if the number of resources exceeds the configured maximum, or if the
+        Kafka producer queue is saturated
+    """
+    _check_producer_capacity(settings)
+
+    if len(resources) > settings.connect_fhir_batch_max_entries:
+        msg = f"request contains {len(resources)} entries, the maximum is {settings.connect_fhir_batch_max_entries}"
+        raise HTTPException(status_code=413, detail=msg)
+
+    results = [
+        FhirBatchEntryResult(index=i, status_code=200) for i in range(len(resources))
+    ]
+    workflows = {}
+
+    for i, resource in enumerate(resources):
+        if not isinstance(resource, dict):
+            results[i].status_code = 422
+            results[i].detail = "entry does not contain a FHIR resource"
+            continue
+
+        resource_type = resource.get("resourceType")
+        results[i].resource_type = resource_type
+        if not is_fhir_resource_type(resource_type):
+            results[i].status_code = 404
+            results[i].detail = f"/{resource_type} not found"
+            continue
+
+        raw_resource = raw_resources[i] if raw_resources else None
+        workflows[i] = _create_workflow(
+            resource_type, resource, settings, raw_resource, transmit_mode
+        )
+
+    if is_transaction:
+        validations = await asyncio.gather(
+            *[workflow.validate() for workflow in workflows.values()],
+            return_exceptions=True,
+        )
+        for i, validation in zip(workflows.keys(), validations):
+            if isinstance(validation, Exception):
+                results[i].status_code = 422
+                results[i].detail = str(validation)
+
+        if any(result.status_code != 200 for result in results):
+            content = [result.dict() for result in results]
+            return JSONResponse(status_code=422, content=content)
+
+        stores = await asyncio.gather(
+            *[workflow.store() for workflow in workflows.values()],
+            return_exceptions=True,
+        )
+        for (i, workflow), store in zip(workflows.items(), stores):
+            if isinstance(store, KafkaProducerQueueFullError):
+                results[i].status_code = 503
+                results[i].detail = str(store)
+            elif isinstance(store, Exception):
+                results[i].status_code = 500
+                results[i].detail = str(store)
+            else:
+                results[i].uuid = str(workflow.message["uuid"])
+                results[i].data_record_location = workflow.message[
+                    "data_record_location"
+                ]
+
+        if any(result.status_code != 200 for result in results):
+            # no entry is transmitted, while entries which were stored remain stored
+            for i, workflow in workflows.items():
+                if results[i].status_code == 200 and workflow.transmit_server:
+                    results[
+                        i
+                    ].detail = "entry not transmitted as the transaction failed"
+            content = [result.dict() for result in results]
+            return JSONResponse(status_code=500, content=content)
+
+    async def run_workflow(i: int, workflow: FhirWorkflow) -> None:
+        response = Response()
+        try:
+            result = await workflow.run(response)
+            results[i].uuid = str(result["uuid"])
+            results[i].data_record_location = result["data_record_location"]
+            if workflow.use_response or workflow.transmit_queued:
+                results[i].status_code = response.status_code
+        except KafkaProducerQueueFullError as ex:
+            results[i].status_code = 503
+            results[i].detail = str(ex)
+        except Exception as ex:
+            results[i].status_code = 500
+            results[i].detail = str(ex)
+
+    await asyncio.gather(*[run_workflow(i, w) for i, w in workflows.items()])
+
+    if is_transaction and any(result.status_code >= 500 for result in results):
+        # every entry is stored, while an entry could not be transmitted
+        content = [result.dict() for result in results]
+        return JSONResponse(status_code=500, content=content)
+    return results
+
+
+def _create_workflow(
+    resource_type: str,
+    request_data: dict,
+    settings: Settings,
+    raw_data: Optional[bytes] = None,
+    transmit_mode: str = "sync",
+):
+    """
+    Creates a FhirWorkflow for a FHIR resource, enabling the transmit workflow step if an external
+    FHIR server is defined.
+
+    :param resource_type: The FHIR resource type
+    :param request_data: The incoming FHIR resource
+    :param settings: Connect configuration settings
+    :param raw_data: The incoming FHIR resource bytes. If provided, the bytes are stored as received.
+    :param transmit_mode: The transmit mode, sync or async
+    :return: a new FhirWorkflow instance
+    """
+    transmit_server = None
+    if settings.connect_external_fhir_server:
+        transmit_server = settings.connect_external_fhir_server + "/" + resource_type
+
+    return FhirWorkflow(
+        message=request_data,
+        raw_message=raw_data,
+        origin_url="/fhir/" + resource_type,
+        certificate_verify=settings.certificate_verify,
+        lfh_id=settings.connect_lfh_id,
+        transmit_server=transmit_server,
+        do_sync=True,
+        operation="POST",
+        do_retransmit=settings.nats_enable_retransmit,
+        transmit_mode=transmit_mode,
+    )
+
 
 @router.post("/{resource_type}")
 async def post_fhir_data(
     resource_type: str,
+    request: Request,
     response: Response,
     settings=Depends(get_settings),
     request_data: dict = Body(...),
@@ -54,6 +384,10 @@ async def post_fhir_data(
             }
             Note: In the above, the FHIR data posted is base64-encoded in the data field.
 
+    Set TRANSMIT_MODE, TRANSMIT_MODE_OVERRIDES or the LinuxForHealth-Transmit-Mode request header to async
+    to respond once the data is stored, with status code 202 and the LinuxForHealth message, and transmit
+    the data in the background. The transmit outcome is stored in the RETRANSMIT topic.
+
     Example response if fhir_r4_externalserver is set to the default FHIR server in docker-compose.yml:
         Status code: 201
         Response: None
@@ -62,44 +396,31 @@ async def post_fhir_data(
                 'https://localhost:9443/fhir-server/api/v4/Patient/17836b8803d-87ab2979-2255-4a7b-acb8/_history/1'
 
     :param resource_type: Path parameter for the FHIR Resource type (Encounter, Patient, Practitioner, etc)
+    :param request: The incoming request, used to store the FHIR message as received
     :param response: The response object which will be returned to the client
     :param settings: Connect configuration settings
     :param request_data: The incoming FHIR message
     :return: A LinuxForHealth message containing the resulting FHIR message or the
     result of transmitting to an external server, if defined
-    :raise: HTTPException if the /{resource_type} is invalid or does not align with the request's resource type
+    :raise: HTTPException if the /{resource_type} is invalid or does not align with the request's resource type,
+        if the transmit mode header is invalid, or if the Kafka producer queue is saturated
     """
-    if resource_type not in FHIR_RESOURCES.keys():
+    if not is_fhir_resource_type(resource_type):
         raise HTTPException(status_code=404, detail=f"/{resource_type} not found")
 
+    _check_producer_capacity(settings)
+
     if resource_type != request_data.get("resourceType"):
         msg = f"request {request_data.get('resourceType')} does not match /{resource_type}"
         raise HTTPException(status_code=422, detail=msg)
 
-    transmit_server = None
-    if settings.connect_external_fhir_server:
-        resource_type = request_data["resourceType"]
-        transmit_server = settings.connect_external_fhir_server + "/" + resource_type
+    transmit_mode = _get_transmit_mode(request, settings, f"/fhir/{resource_type}")
 
     try:
-        workflow = FhirWorkflow(
-            message=request_data,
-            origin_url="/fhir/" + resource_type,
-            certificate_verify=settings.certificate_verify,
-            lfh_id=settings.connect_lfh_id,
-            transmit_server=transmit_server,
-            do_sync=True,
-            operation="POST",
-            do_retransmit=settings.nats_enable_retransmit,
+        raw_data = await request.body()
+        workflow = _create_workflow(
+            resource_type, request_data, settings, raw_data, transmit_mode
         )
-
-        # enable the transmit workflow step if defined
-        if settings.connect_external_fhir_server:
-            resource_type = request_data["resourceType"]
-            workflow.transmit_server = (
-                settings.connect_external_fhir_server + "/" + resource_type
-            )
-
         result = await workflow.run(response)
 
         if workflow.use_response:
@@ -112,5 +433,7 @@ async def post_fhir_data(
                 return response
         else:
             return result
+    except KafkaProducerQueueFullError as ex:
+        _raise_service_unavailable(settings, str(ex))
     except Exception as ex:
         raise HTTPException(status_code=500, detail=ex)
@@ -0,0 +1,32 @@
+"""
+metrics.py
+
+Implements the /metrics API endpoint, providing connect metrics in the Prometheus text exposition format
+"""
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRouter
+from connect.support.metrics import generate_metrics_text, get_metrics_registry
+
+router = APIRouter()
+
+metrics_content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Returns connect metrics in the Prometheus text exposition format. Metrics include:
+    - workflow state durations (validate, transform, persist, transmit, synchronize, error), by data_format
+    - Kafka producer queue depth and delivery latency, by topic
+    - NATS publish latency, by subject and data_format
+    - retransmit queue length
+    - rate limiter rejections, by path
+    - HTTP client pool statistics
+
+    Workflow state durations are recorded when connect_timing_enabled is set.
+
+    :return: the metrics text
+    """
+    return PlainTextResponse(
+        generate_metrics_text(get_metrics_registry()), media_type=metrics_content_type
+    )
@@ -8,9 +8,10 @@ from fastapi.routing import APIRouter
 from pydantic.main import BaseModel
 from pydantic import constr
 from connect import __version__
-from connect.clients import nats
+from connect.clients import http, nats
 from connect.config import get_settings
 from connect.support.availability import is_service_available
+from connect.support.metrics import get_metrics_registry
 from typing import List
 import time
 
@@ -43,7 +44,16 @@ class StatusResponse(BaseModel):
                 "nats_client_status": "CONNECTED",
                 "kafka_broker_status": "AVAILABLE",
                 "status_response_time": 0.080413915000008,
-                "metrics": {"run": {"total": 0.001, "count": 1, "average": 0.001}},
+                "metrics": {
+                    "run": {
+                        "total": 0.001,
+                        "count": 1,
+                        "average": 0.001,
+                        "p50": 0.00075,
+                        "p95": 0.00098,
+                        "p99": 0.001,
+                    }
+                },
             }
         }
 
@@ -70,7 +80,12 @@ async def get_status(settings=Depends(get_settings)):
         "status_response_time": float(
             "{:.8f}".format(time.perf_counter() - start_time)
         ),
-        "metrics": format_metrics(nats.timing_metrics),
+        "metrics": format_metrics(
+            {
+                **get_metrics_registry().summary(),
+                "http_client_pool": http.get_http_client_metrics(),
+            }
+        ),
     }
     return StatusResponse(**status_fields)
 
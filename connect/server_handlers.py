@@ -6,8 +6,14 @@ import yaml
 from yaml import YAMLError
 from fastapi import HTTPException, Request
 from fastapi.responses import JSONResponse
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from starlette.routing import Match
 from connect.config import get_settings
+from connect.clients.http import close_http_client_pool, get_http_client_pool
 from connect.clients.kafka import (
+    close_kafka_consumer_pool,
+    get_kafka_consumer_pool,
     get_kafka_producer,
     create_kafka_listeners,
     stop_kafka_listeners,
@@ -17,6 +23,12 @@ from connect.clients.nats import (
     get_nats_client,
     stop_nats_clients,
 )
+from connect.support.compression import get_payload_compressor
+from connect.support.fhir_resources import (
+    get_structural_rules,
+    warm_fhir_resource_classes,
+)
+from connect.support.metrics import get_metrics_registry
 
 
 logger = logging.getLogger(__name__)
@@ -102,27 +114,177 @@ def log_configuration() -> None:
     logger.debug(f"CONNECT_CONFIG_DIRECTORY: {settings.connect_config_directory}")
     logger.debug(f"CONNECT_CERT: {settings.connect_cert_name}")
     logger.debug(f"CONNECT_CERT_KEY: {settings.connect_cert_key_name}")
+    logger.debug(f"CONNECT_JSON_BACKEND: {settings.connect_json_backend}")
+    logger.debug(f"CONNECT_RECORD_FORMAT: {settings.connect_record_format}")
+    logger.debug(
+        f"CONNECT_RECORD_CACHE_MAX_BYTES: {settings.connect_record_cache_max_bytes}"
+    )
     logger.debug("=" * header_footer_length)
 
     logger.debug(f"KAFKA_BOOTSTRAP_SERVERS: {settings.kafka_bootstrap_servers}")
     logger.debug(f"KAFKA_PRODUCER_ACKS: {settings.kafka_producer_acks}")
+    logger.debug(
+        f"KAFKA_PRODUCER_COMPRESSION_TYPE: {settings.kafka_producer_compression_type}"
+    )
+    logger.debug(f"KAFKA_PRODUCER_CONFIG: {settings.kafka_producer_config}")
+    logger.debug(
+        f"KAFKA_PRODUCER_QUEUE_FULL_TIMEOUT_SECS: {settings.kafka_producer_queue_full_timeout_secs}"
+    )
+    logger.debug(
+        f"KAFKA_PRODUCER_QUEUE_SATURATION_RATIO: {settings.kafka_producer_queue_saturation_ratio}"
+    )
+    logger.debug(
+        f"KAFKA_PRODUCER_RETRY_AFTER_SECS: {settings.kafka_producer_retry_after_secs}"
+    )
+    logger.debug(
+        f"KAFKA_PRODUCER_BATCH_ENABLED: {settings.kafka_producer_batch_enabled}"
+    )
+    logger.debug(
+        f"KAFKA_PRODUCER_BATCH_MAX_SIZE: {settings.kafka_producer_batch_max_size}"
+    )
+    logger.debug(
+        f"KAFKA_PRODUCER_BATCH_MAX_LINGER_SECS: {settings.kafka_producer_batch_max_linger_secs}"
+    )
+    logger.debug(f"KAFKA_MESSAGE_CHUNK_SIZE: {settings.kafka_message_chunk_size}")
+    logger.debug(f"KAFKA_SEGMENTS_MAX_BYTES: {settings.kafka_segments_max_bytes}")
+    logger.debug(
+        f"KAFKA_SEGMENTS_PURGE_TIMEOUT: {settings.kafka_segments_purge_timeout}"
+    )
+    logger.debug(f"KAFKA_PRODUCER_KEY_STRATEGY: {settings.kafka_producer_key_strategy}")
+    logger.debug(
+        f"KAFKA_PRODUCER_KEY_STRATEGY_OVERRIDES: {settings.kafka_producer_key_strategy_overrides}"
+    )
+    logger.debug(
+        f"KAFKA_ADMIN_NEW_TOPIC_PARTITIONS: {settings.kafka_admin_new_topic_partitions}"
+    )
+    logger.debug(
+        f"KAFKA_ADMIN_NEW_TOPIC_PARTITIONS_OVERRIDES: {settings.kafka_admin_new_topic_partitions_overrides}"
+    )
+    logger.debug(f"KAFKA_CONSUMER_POOL_ENABLED: {settings.kafka_consumer_pool_enabled}")
+    logger.debug(
+        f"KAFKA_CONSUMER_POOL_MAX_SIZE: {settings.kafka_consumer_pool_max_size}"
+    )
+    logger.debug(
+        f"KAFKA_CONSUMER_POOL_MIN_SIZE: {settings.kafka_consumer_pool_min_size}"
+    )
+    logger.debug(
+        f"KAFKA_CONSUMER_POOL_IDLE_TIMEOUT_SECS: {settings.kafka_consumer_pool_idle_timeout_secs}"
+    )
+    logger.debug(
+        f"KAFKA_CONSUMER_CONSUME_BATCH_SIZE: {settings.kafka_consumer_consume_batch_size}"
+    )
+    logger.debug(
+        f"KAFKA_TOPIC_STREAM_MAX_BUFFERED: {settings.kafka_topic_stream_max_buffered}"
+    )
+    logger.debug(
+        f"KAFKA_TOPIC_STREAM_SEGMENTS_MAX_BYTES: {settings.kafka_topic_stream_segments_max_bytes}"
+    )
+    logger.debug("=" * header_footer_length)
+
+    logger.debug(f"HTTP_CLIENT_MAX_CONNECTIONS: {settings.http_client_max_connections}")
+    logger.debug(
+        f"HTTP_CLIENT_MAX_CONNECTIONS_PER_HOST: {settings.http_client_max_connections_per_host}"
+    )
+    logger.debug(
+        f"HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS: {settings.http_client_max_keepalive_connections}"
+    )
+    logger.debug(
+        f"HTTP_CLIENT_KEEPALIVE_EXPIRY_SECS: {settings.http_client_keepalive_expiry_secs}"
+    )
+    logger.debug(f"HTTP_CLIENT_HTTP2: {settings.http_client_http2}")
+    logger.debug(
+        f"TRANSMIT_BREAKER_FAILURE_THRESHOLD: {settings.transmit_breaker_failure_threshold}"
+    )
+    logger.debug(f"TRANSMIT_BREAKER_RESET_SECS: {settings.transmit_breaker_reset_secs}")
+    logger.debug(f"TRANSMIT_TIMEOUT_SECS: {settings.transmit_timeout_secs}")
+    logger.debug(f"TRANSMIT_TIMEOUT_MIN_SECS: {settings.transmit_timeout_min_secs}")
+    logger.debug(f"TRANSMIT_TIMEOUT_MAX_SECS: {settings.transmit_timeout_max_secs}")
+    logger.debug(f"TRANSMIT_TIMEOUT_PERCENTILE: {settings.transmit_timeout_percentile}")
+    logger.debug(f"TRANSMIT_TIMEOUT_MULTIPLIER: {settings.transmit_timeout_multiplier}")
+    logger.debug(
+        f"TRANSMIT_TIMEOUT_MIN_SAMPLES: {settings.transmit_timeout_min_samples}"
+    )
+    logger.debug(f"TRANSMIT_MODE: {settings.transmit_mode}")
+    logger.debug(f"TRANSMIT_MODE_OVERRIDES: {settings.transmit_mode_overrides}")
+    logger.debug("=" * header_footer_length)
+
+    logger.debug(f"PAYLOAD_COMPRESSION_CODEC: {settings.payload_compression_codec}")
+    logger.debug(f"PAYLOAD_COMPRESSION_LEVEL: {settings.payload_compression_level}")
+    logger.debug(
+        f"PAYLOAD_COMPRESSION_MIN_SIZE: {settings.payload_compression_min_size}"
+    )
+    logger.debug(
+        f"PAYLOAD_COMPRESSION_CODEC_OVERRIDES: {settings.payload_compression_codec_overrides}"
+    )
+    logger.debug(
+        f"PAYLOAD_COMPRESSION_DICTIONARIES: {settings.payload_compression_dictionaries}"
+    )
+    logger.debug("=" * header_footer_length)
+
+    logger.debug(f"FHIR_WARMUP_RESOURCE_TYPES: {settings.fhir_warmup_resource_types}")
+    logger.debug(f"FHIR_VALIDATION_MODE: {settings.fhir_validation_mode}")
+    logger.debug(
+        f"FHIR_VALIDATION_SAMPLE_PERCENT: {settings.fhir_validation_sample_percent}"
+    )
+    logger.debug(
+        f"FHIR_VALIDATION_MODE_OVERRIDES: {settings.fhir_validation_mode_overrides}"
+    )
     logger.debug("=" * header_footer_length)
 
     logger.debug(f"NATS_SERVERS: {settings.nats_servers}")
     logger.debug(f"NATS_ALLOW_RECONNECT: {settings.nats_allow_reconnect}")
     logger.debug(f"NATS_MAX_RECONNECT_ATTEMPTS: {settings.nats_max_reconnect_attempts}")
+    logger.debug(f"NATS_RETRANSMIT_QUEUE_PATH: {settings.nats_retransmit_queue_path}")
+    logger.debug(
+        f"NATS_RETRANSMIT_QUEUE_MAX_ENTRIES: {settings.nats_retransmit_queue_max_entries}"
+    )
+    logger.debug(f"NATS_RETRANSMIT_QUEUE_FSYNC: {settings.nats_retransmit_queue_fsync}")
+    logger.debug(
+        f"NATS_RETRANSMIT_TARGET_CONCURRENCY: {settings.nats_retransmit_target_concurrency}"
+    )
+    logger.debug(
+        f"NATS_RETRANSMIT_BACKOFF_SECS: {settings.nats_retransmit_backoff_secs}"
+    )
+    logger.debug(
+        f"NATS_RETRANSMIT_MAX_BACKOFF_SECS: {settings.nats_retransmit_max_backoff_secs}"
+    )
     logger.debug("=" * header_footer_length)
 
     logger.debug("*" * header_footer_length)
 
 
+def configure_fhir_resources() -> None:
+    """
+    Resolves the FHIR resource classes configured in FHIR_WARMUP_RESOURCE_TYPES, and their element classes,
+    prior to processing requests.
+    """
+    settings = get_settings()
+    resolved = warm_fhir_resource_classes(settings.fhir_warmup_resource_types)
+    logger.info(f"Loaded {len(resolved)} FHIR resource and element classes")
+
+    if (
+        settings.fhir_validation_mode != "full"
+        or settings.fhir_validation_mode_overrides
+    ):
+        for resource_type in resolved:
+            get_structural_rules(resource_type)
+        logger.info(f"Loaded structural validation rules for {len(resolved)} types")
+
+
 async def configure_internal_integrations() -> None:
     """
     Configure internal integrations to support:
     - Kafka
+    - Kafka consumer pool
     - NATS Messaging/Jetstream
+    - HTTP client pool
+    - Payload compression
     """
     get_kafka_producer()
+    if get_settings().kafka_consumer_pool_enabled:
+        get_kafka_consumer_pool()
+    get_http_client_pool()
+    get_payload_compressor()
     await get_nats_client()
     await create_nats_subscribers()
     create_kafka_listeners()
@@ -131,14 +293,47 @@ async def configure_internal_integrations() -> None:
 async def close_internal_clients() -> None:
     """
     Closes internal Connect client connections:
+    - NATS, and the retransmitter, which produces retransmit outcomes to Kafka
     - Kafka
-    - NATS
+    - HTTP client pool
     """
+    await stop_nats_clients()
+
     kafka_producer = get_kafka_producer()
     kafka_producer.close()
 
-    await stop_nats_clients()
     stop_kafka_listeners()
+    close_kafka_consumer_pool()
+    await close_http_client_pool()
+
+
+def _get_route_path(request: Request) -> str:
+    """
+    Returns the path template of the route matching a request, such as /fhir/{resource_type}, so that
+    metric labels are bounded by the application's routes rather than by request paths.
+    Rate limits are applied by middleware, before the request is routed, so the route is matched here.
+
+    :param request: The incoming request
+    :return: the matching route's path template, or "unmatched" if no route matches
+    """
+    route = request.scope.get("route")
+    if route is None:
+        for candidate in request.app.router.routes:
+            match, _ = candidate.matches(request.scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+    return route.path if route is not None else "unmatched"
+
+
+def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    """
+    Records rate limiter rejections, by route, prior to returning the slowapi rate limit response.
+    """
+    get_metrics_registry().counter(
+        "rate_limit_rejections", path=_get_route_path(request)
+    ).inc()
+    return _rate_limit_exceeded_handler(request, exc)
 
 
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -146,5 +341,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     Allows HTTPExceptions to be thrown without being parsed against a response model.
     """
     return JSONResponse(
-        status_code=exc.status_code, content={"detail": f"{exc.detail}"}
+        status_code=exc.status_code,
+        content={"detail": f"{exc.detail}"},
+        headers=getattr(exc, "headers", None),
     )
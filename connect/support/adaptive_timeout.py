@@ -0,0 +1,70 @@
+"""
+adaptive_timeout.py
+
+Derives request timeouts for an external server from the server's recent response latencies. The timeout is a
+latency percentile, such as p99, scaled by a multiplier and bounded by a minimum and maximum, so that requests
+to a slow but reachable server fail fast rather than waiting for the server's worst case response.
+"""
+import math
+from collections import deque
+
+
+class AdaptiveTimeout:
+    """
+    Tracks a sliding window of response latencies. The timeout is recalculated every recalculate_interval
+    observations, rather than on each request.
+    """
+
+    def __init__(
+        self,
+        default: float,
+        minimum: float,
+        maximum: float,
+        percentile: float = 99.0,
+        multiplier: float = 2.0,
+        min_samples: int = 20,
+        window_size: int = 200,
+        recalculate_interval: int = 10,
+    ):
+        """
+        :param default: the timeout, in seconds, until min_samples latencies are observed
+        :param minimum: the minimum timeout, in seconds
+        :param maximum: the maximum timeout, in seconds
+        :param percentile: the latency percentile, 0 to 100
+        :param multiplier: scales the latency percentile
+        :param min_samples: the number of latencies observed before the timeout is adapted
+        :param window_size: the number of recent latencies used to calculate the timeout
+        :param recalculate_interval: the number of observations between timeout calculations
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.recalculate_interval = recalculate_interval
+        self.timeout = min(max(default, minimum), maximum)
+        self._latencies = deque(maxlen=window_size)
+        self._observations = 0
+
+    def observe(self, latency: float):
+        """
+        Records a response latency.
+
+        :param latency: the response latency, in seconds
+        """
+        self._latencies.append(latency)
+        self._observations += 1
+        if (
+            len(self._latencies) >= self.min_samples
+            and self._observations % self.recalculate_interval == 0
+        ):
+            self.timeout = self._calculate()
+
+    def _calculate(self) -> float:
+        """
+        :return: the scaled latency percentile, within the minimum and maximum timeout
+        """
+        latencies = sorted(self._latencies)
+        index = max(math.ceil(len(latencies) * self.percentile / 100) - 1, 0)
+        timeout = latencies[index] * self.multiplier
+        return min(max(timeout, self.minimum), self.maximum)
@@ -0,0 +1,93 @@
+"""
+circuit_breaker.py
+
+A circuit breaker for requests to an external server. The breaker opens once consecutive requests fail,
+deferring requests to the server until the breaker's reset timeout expires. A single probe request is then
+allowed, which closes the breaker if it succeeds.
+"""
+import time
+from typing import Callable
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive request failures for an external server.
+
+    - closed: requests are allowed
+    - open: failure_threshold consecutive requests have failed. Requests are deferred until the reset
+      timeout expires.
+    - half_open: the reset timeout has expired. allow_request admits a single probe request, while
+      is_open allows requests. The breaker closes on the next success, and opens again on the next failure.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param failure_threshold: the number of consecutive failures which opens the breaker
+        :param reset_timeout: the time, in seconds, for which requests are deferred once the breaker opens
+        :param clock: returns the current time, in seconds
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.failures = 0
+        # the time after which requests are allowed
+        self.retry_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        """
+        :return: the breaker state, closed, open or half_open
+        """
+        if self.failures < self.failure_threshold:
+            return "closed"
+        return "open" if self.is_open() else "half_open"
+
+    def allow_request(self) -> bool:
+        """
+        Admits a request, allowing a single probe request once an open breaker's reset timeout expires.
+
+        :return: True if the request is allowed
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def is_open(self) -> bool:
+        """
+        :return: True if requests are deferred
+        """
+        return self._clock() < self.retry_at
+
+    def retry_in(self) -> float:
+        """
+        :return: the time, in seconds, until requests are allowed
+        """
+        return max(self.retry_at - self._clock(), 0.0)
+
+    def record_success(self):
+        self.failures = 0
+        self.retry_at = 0.0
+        self._probing = False
+
+    def record_failure(self) -> bool:
+        """
+        Records a failed request.
+
+        :return: True if the breaker opened
+        """
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            self.retry_at = self._clock() + self.reset_timeout
+            return True
+        return False
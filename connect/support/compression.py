@@ -0,0 +1,233 @@
+"""
+compression.py
+
+Payload compression for LinuxForHealth records.
+Record payloads may be compressed with zlib, or with zstd when the zstandard package is installed. zstd
+compression may use a shared dictionary per data format, trained from sample payloads, which considerably
+improves the compression of small and repetitive payloads such as FHIR resources.
+
+The codec used for a record is stored in the record's data_encoding field. zstd frames include the id of
+the dictionary used, so that records remain readable after a data format's dictionary is replaced, provided
+the previous dictionary is still configured.
+"""
+import logging
+import os
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+from connect.config import get_settings
+from connect.support.metrics import get_metrics_registry
+
+
+logger = logging.getLogger(__name__)
+payload_compressor = None
+
+
+class PayloadCompressor:
+    """
+    Compresses and decompresses record payloads using the codec selected for each data format.
+
+    Compression metrics are recorded for each data format and codec:
+    - payload_compression: compression time histogram
+    - payload_decompression: decompression time histogram
+    - payload_compression_input_bytes/payload_compression_output_bytes: payload sizes, before and after
+    - payload_compression_ratio: input bytes / output bytes gauge
+    """
+
+    def __init__(
+        self,
+        codec: str,
+        level: int,
+        min_size: int,
+        codec_overrides: Dict[str, str],
+        dictionaries: Dict[str, bytes],
+    ):
+        """
+        :param codec: the default codec, "none", "zlib" or "zstd"
+        :param level: the compression level
+        :param min_size: payloads smaller than min_size bytes are not compressed
+        :param codec_overrides: codecs keyed by data format
+        :param dictionaries: zstd dictionaries keyed by data format
+        """
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+        self.codec_overrides = codec_overrides
+        self._zstd_compressors = {}
+        self._zstd_decompressors = {}
+        self._zstd_dictionaries = {}
+
+        try:
+            import zstandard
+
+            self._zstd = zstandard
+        except ImportError:
+            self._zstd = None
+            if "zstd" in (codec, *codec_overrides.values()):
+                logger.warning("zstandard is not installed, payloads will use zlib")
+
+        if self._zstd:
+            for data_format, dictionary_data in dictionaries.items():
+                dictionary = self._zstd.ZstdCompressionDict(dictionary_data)
+                self._zstd_dictionaries[data_format] = dictionary
+                self._zstd_decompressors[
+                    dictionary.dict_id()
+                ] = self._zstd.ZstdDecompressor(dict_data=dictionary)
+            self._zstd_decompressors[0] = self._zstd.ZstdDecompressor()
+
+    def get_codec(self, data_format: str) -> str:
+        """
+        :param data_format: the record data format
+        :return: the codec used to compress the data format's payloads
+        """
+        codec = self.codec_overrides.get(data_format, self.codec)
+        if codec == "zstd" and self._zstd is None:
+            return "zlib"
+        return codec
+
+    def _get_zstd_compressor(self, data_format: str):
+        compressor = self._zstd_compressors.get(data_format)
+        if compressor is None:
+            compressor = self._zstd.ZstdCompressor(
+                level=self.level, dict_data=self._zstd_dictionaries.get(data_format)
+            )
+            self._zstd_compressors[data_format] = compressor
+        return compressor
+
+    def compress(self, payload: bytes, data_format: str) -> Tuple[bytes, Optional[str]]:
+        """
+        Compresses a payload using the data format's codec. The payload is returned uncompressed if
+        compression is disabled, the payload is small, or compression does not reduce the payload size.
+
+        :param payload: the payload bytes
+        :param data_format: the record data format
+        :return: tuple of the stored payload and its data encoding, or None if uncompressed
+        """
+        codec = self.get_codec(data_format)
+        if codec == "none" or len(payload) < self.min_size:
+            return payload, None
+
+        start = time.perf_counter()
+        if codec == "zstd":
+            compressed = self._get_zstd_compressor(data_format).compress(payload)
+        else:
+            compressed = zlib.compress(payload, self.level)
+
+        registry = get_metrics_registry()
+        labels = {"data_format": data_format, "codec": codec}
+        registry.histogram("payload_compression", **labels).observe(
+            time.perf_counter() - start
+        )
+        input_bytes = registry.counter("payload_compression_input_bytes", **labels)
+        output_bytes = registry.counter("payload_compression_output_bytes", **labels)
+        if not input_bytes.value:
+            registry.gauge(
+                "payload_compression_ratio",
+                lambda: input_bytes.value / output_bytes.value,
+                **labels,
+            )
+        input_bytes.inc(len(payload))
+
+        if len(compressed) >= len(payload):
+            output_bytes.inc(len(payload))
+            return payload, None
+
+        output_bytes.inc(len(compressed))
+        return compressed, codec
+
+    def decompress(
+        self, payload: bytes, data_encoding: Optional[str], data_format: str
+    ) -> bytes:
+        """
+        Decompresses a stored payload.
+
+        :param payload: the stored payload bytes
+        :param data_encoding: the stored payload's data encoding
+        :param data_format: the record data format
+        :return: the decompressed payload
+        :raise: ValueError if the data encoding, or the zstd dictionary, is not supported, or if the
+            payload cannot be decompressed
+        """
+        if data_encoding is None:
+            return payload
+
+        start = time.perf_counter()
+        if data_encoding == "zlib":
+            try:
+                decompressed = zlib.decompress(payload)
+            except zlib.error as ze:
+                raise ValueError(f"Unable to decompress zlib payload: {ze}")
+        elif data_encoding == "zstd":
+            if self._zstd is None:
+                raise ValueError("zstandard is required to decompress zstd payloads")
+            try:
+                dict_id = self._zstd.get_frame_parameters(payload).dict_id
+                decompressor = self._zstd_decompressors.get(dict_id)
+                if decompressor is None:
+                    raise ValueError(f"zstd dictionary {dict_id} is not configured")
+                decompressed = decompressor.decompress(payload)
+            except self._zstd.ZstdError as ze:
+                raise ValueError(f"Unable to decompress zstd payload: {ze}")
+        else:
+            raise ValueError(f"Unsupported data encoding {data_encoding}")
+
+        get_metrics_registry().histogram(
+            "payload_decompression", data_format=data_format, codec=data_encoding
+        ).observe(time.perf_counter() - start)
+        return decompressed
+
+
+def train_compression_dictionary(
+    samples: List[bytes], dictionary_size: int = 112640
+) -> bytes:
+    """
+    Trains a zstd dictionary from sample payloads of a single data format. At least several hundred
+    samples are recommended. Save the result to a file and configure it in
+    PAYLOAD_COMPRESSION_DICTIONARIES.
+
+    Example:
+        dictionary = train_compression_dictionary(patient_samples)
+        with open("/home/lfh/connect/config/patient.dict", "wb") as f:
+            f.write(dictionary)
+
+    :param samples: the sample payloads
+    :param dictionary_size: the maximum dictionary size, in bytes
+    :return: the dictionary data
+    """
+    import zstandard
+
+    return zstandard.train_dictionary(dictionary_size, samples).as_bytes()
+
+
+def _load_dictionaries(dictionary_files: Dict[str, str], directory: str) -> dict:
+    """
+    :param dictionary_files: dictionary file paths keyed by data format. Relative paths are resolved
+        from the configuration directory.
+    :param directory: the configuration directory
+    :return: dictionary data keyed by data format
+    """
+    dictionaries = {}
+    for data_format, file_name in dictionary_files.items():
+        with open(os.path.join(directory, file_name), "rb") as f:
+            dictionaries[data_format] = f.read()
+    return dictionaries
+
+
+def get_payload_compressor() -> Optional[PayloadCompressor]:
+    """
+    :return: the PayloadCompressor instance
+    """
+    global payload_compressor
+    if not payload_compressor:
+        settings = get_settings()
+        payload_compressor = PayloadCompressor(
+            codec=settings.payload_compression_codec,
+            level=settings.payload_compression_level,
+            min_size=settings.payload_compression_min_size,
+            codec_overrides=settings.payload_compression_codec_overrides,
+            dictionaries=_load_dictionaries(
+                settings.payload_compression_dictionaries,
+                settings.connect_config_directory,
+            ),
+        )
+    return payload_compressor
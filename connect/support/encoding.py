@@ -3,14 +3,68 @@ encoding.py
 
  Connect convenience functions for encoding/decoding data payloads in
  LinuxForHealth messages.
+
+ JSON serialization uses the backend configured with CONNECT_JSON_BACKEND. The orjson, msgspec and ujson
+ backends are used if the package is installed, otherwise the standard library json module is used.
 """
 import base64
 import decimal
 import json
+import logging
 from json import JSONEncoder
 import datetime
-from typing import Any
+from typing import Any, Callable, Optional, Tuple, Union
 import uuid
+from connect.config import get_settings
+from connect.support.compression import get_payload_compressor
+
+
+logger = logging.getLogger(__name__)
+json_backend = None
+
+# backends tried, in order, when CONNECT_JSON_BACKEND is "auto"
+auto_json_backends = ("orjson", "msgspec", "ujson", "json")
+
+# binary records are framed as: magic, envelope length (4 bytes, big endian), JSON envelope, raw payload
+binary_record_magic = b"LFH\x01"
+binary_record_header_length = len(binary_record_magic) + 4
+
+
+def encode_default(o: Any) -> Any:
+    """
+    Encodes the types which are not natively supported by JSON:
+    - UUID fields
+    - date, datetime, and time fields
+    - byte fields
+    - Decimal fields
+
+    :param o: The current object to encode
+    :return: the JSON compatible representation of the object
+    :raise: TypeError if the object type is not supported
+    """
+    if isinstance(o, (datetime.date, datetime.datetime, datetime.time)):
+        return o.isoformat()
+    elif isinstance(o, uuid.UUID):
+        return str(o)
+    elif isinstance(o, bytes):
+        return base64.b64encode(o).decode()
+    elif isinstance(o, decimal.Decimal):
+        return float(o)
+    raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
+
+
+def _encode_bytes(o: Any) -> Any:
+    """
+    :param o: The object to encode
+    :return: the object, with bytes values within dicts, lists and tuples base64 encoded as encode_default does
+    """
+    if isinstance(o, bytes):
+        return encode_default(o)
+    elif isinstance(o, dict):
+        return {k: _encode_bytes(v) for k, v in o.items()}
+    elif isinstance(o, (list, tuple)):
+        return [_encode_bytes(v) for v in o]
+    return o
 
 
 class ConnectEncoder(JSONEncoder):
@@ -27,26 +81,142 @@ class ConnectEncoder(JSONEncoder):
         Overridden to customize the encoding process.
         :param o: The current object to encode
         """
-        if isinstance(o, (datetime.date, datetime.datetime, datetime.time)):
-            return o.isoformat()
-        elif isinstance(o, uuid.UUID):
-            return str(o)
-        elif isinstance(o, bytes):
-            return base64.b64encode(o).decode()
-        elif isinstance(o, decimal.Decimal):
-            return float(o)
-        else:
+        try:
+            return encode_default(o)
+        except TypeError:
             return super().default(o)
 
 
+class JsonBackend:
+    """
+    Serializes objects to JSON bytes, and deserializes JSON, using a specific JSON library.
+    All backends encode UUID, date, datetime, time, bytes and Decimal values as ConnectEncoder does.
+    Decoding errors are raised as ValueError.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        dumps: Callable[[Any], bytes],
+        loads: Callable[[Union[bytes, str]], Any],
+    ):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+def _create_json_backend(name: str) -> JsonBackend:
+    """
+    Creates a JsonBackend for a JSON library.
+
+    :param name: The backend name, one of json, orjson, msgspec or ujson
+    :return: the JsonBackend
+    :raise: ImportError if the backend's library is not installed
+    :raise: ValueError if the backend is not supported
+    """
+    if name == "json":
+        encoder = ConnectEncoder()
+        return JsonBackend(
+            name, lambda o: encoder.encode(o).encode("utf-8"), json.loads
+        )
+    elif name == "orjson":
+        import orjson
+
+        option = orjson.OPT_NON_STR_KEYS
+        return JsonBackend(
+            name,
+            lambda o: orjson.dumps(o, default=encode_default, option=option),
+            orjson.loads,
+        )
+    elif name == "msgspec":
+        import msgspec
+
+        try:
+            encoder = msgspec.json.Encoder(
+                enc_hook=encode_default, decimal_format="number"
+            )
+        except TypeError:
+            encoder = msgspec.json.Encoder(enc_hook=encode_default)
+        decoder = msgspec.json.Decoder()
+
+        def loads(data: Union[bytes, str]) -> Any:
+            try:
+                return decoder.decode(data)
+            except msgspec.DecodeError as de:
+                raise ValueError(str(de))
+
+        return JsonBackend(name, encoder.encode, loads)
+    elif name == "ujson":
+        import ujson
+
+        def dumps(o: Any) -> bytes:
+            try:
+                data_str = ujson.dumps(
+                    o,
+                    default=encode_default,
+                    escape_forward_slashes=False,
+                    reject_bytes=True,
+                )
+            except TypeError:
+                # ujson rejects bytes values before calling default, so they are encoded first
+                data_str = ujson.dumps(
+                    _encode_bytes(o),
+                    default=encode_default,
+                    escape_forward_slashes=False,
+                )
+            return data_str.encode("utf-8")
+
+        return JsonBackend(name, dumps, ujson.loads)
+
+    raise ValueError(f"Unsupported JSON backend {name}")
+
+
+def get_json_backend() -> Optional[JsonBackend]:
+    """
+    Returns the configured JsonBackend. If the configured backend's library is not installed, the
+    standard library json backend is used.
+
+    :return: the JsonBackend instance
+    """
+    global json_backend
+    if not json_backend:
+        name = get_settings().connect_json_backend
+        for backend_name in auto_json_backends if name == "auto" else (name, "json"):
+            try:
+                json_backend = _create_json_backend(backend_name)
+                break
+            except ImportError:
+                logger.warning(f"JSON backend {backend_name} is not installed")
+        logger.info(f"Using JSON backend {json_backend.name}")
+    return json_backend
+
+
+def encode_json(data: Any) -> bytes:
+    """
+    Serializes an object to JSON bytes using the configured JSON backend.
+    :param data: The object to encode
+    :return: the JSON bytes
+    """
+    return get_json_backend().dumps(data)
+
+
+def decode_json(data: Union[bytes, str]) -> Any:
+    """
+    Deserializes JSON using the configured JSON backend.
+    :param data: The JSON bytes or string to decode
+    :return: the decoded object
+    :raise: ValueError if the data is not valid JSON
+    """
+    return get_json_backend().loads(data)
+
+
 def encode_from_dict(data: dict) -> str:
     """
     Base64-encodes an object for transmission and storage.
     :param data: The dict for an object to encode
     :return: string representation of base64-encoded object
     """
-    data_str = json.dumps(data, cls=ConnectEncoder)
-    data_bytes = bytes(data_str, "utf-8")
+    data_bytes = encode_json(data)
     data_encoded_bytes = base64.b64encode(data_bytes)
     data_encoded_str = str(data_encoded_bytes, "utf-8")
     return data_encoded_str
@@ -106,6 +276,100 @@ def decode_to_dict(data: str) -> dict:
     """
     data_bytes = bytes(data, "utf-8")
     data_decoded_bytes = base64.b64decode(data_bytes)
-    data_decoded_str = str(data_decoded_bytes, "utf-8")
-    data_obj = json.loads(data_decoded_str)
+    data_obj = decode_json(data_decoded_bytes)
     return data_obj
+
+
+def is_binary_record(record: bytes) -> bool:
+    """
+    :param record: The stored LinuxForHealth record
+    :return: True if the record uses the binary record format
+    """
+    return record[: len(binary_record_magic)] == binary_record_magic
+
+
+def encode_record(message: dict, payload: bytes, record_format: str) -> bytes:
+    """
+    Encodes a LinuxForHealth record for storage and synchronization.
+
+    The "json" format encodes the message, including the base64-encoded data field, as JSON.
+    The "binary" format frames the message envelope, excluding the data field, and the raw payload bytes.
+
+    :param message: The LinuxForHealth message
+    :param payload: The message data bytes
+    :param record_format: The record format, "json" or "binary"
+    :return: the encoded record
+    """
+    if record_format != "binary":
+        return encode_json(message)
+
+    envelope = encode_json({k: v for k, v in message.items() if k != "data"})
+    return b"".join(
+        (
+            binary_record_magic,
+            len(envelope).to_bytes(4, "big"),
+            envelope,
+            payload,
+        )
+    )
+
+
+def decode_record(record: bytes) -> Tuple[dict, bytes]:
+    """
+    Decodes a LinuxForHealth record in either record format. Compressed payloads are decompressed.
+
+    :param record: The stored LinuxForHealth record
+    :return: tuple of the message envelope and the data payload bytes. The envelope of a "json"
+        format record includes the stored base64-encoded data field.
+    :raise: ValueError if the record cannot be decoded
+    """
+    if not is_binary_record(record):
+        message = decode_json(record)
+        payload = None
+    else:
+        envelope_end = binary_record_header_length + int.from_bytes(
+            record[len(binary_record_magic) : binary_record_header_length], "big"
+        )
+        if envelope_end > len(record):
+            raise ValueError("Binary record envelope exceeds the record length")
+
+        message = decode_json(record[binary_record_header_length:envelope_end])
+        payload = record[envelope_end:]
+
+    if not isinstance(message, dict):
+        raise ValueError("Record envelope is not a JSON object")
+    if payload is None:
+        try:
+            payload = decode_to_bytes(message["data"])
+        except (KeyError, TypeError) as ex:
+            raise ValueError(f"Record does not contain base64-encoded data: {ex}")
+
+    if message.get("data_encoding"):
+        payload = get_payload_compressor().decompress(
+            payload, message["data_encoding"], message.get("data_format")
+        )
+    return message, payload
+
+
+def decode_record_to_dict(record: bytes) -> dict:
+    """
+    Decodes a LinuxForHealth record, in either record format, to a message dict with a base64-encoded,
+    uncompressed, data field.
+
+    :param record: The stored LinuxForHealth record
+    :return: the LinuxForHealth message
+    :raise: ValueError if the record cannot be decoded
+    """
+    if not is_binary_record(record):
+        message = decode_json(record)
+        if not isinstance(message, dict):
+            raise ValueError("Record is not a JSON object")
+        # uncompressed records, including error records, are returned as stored
+        if not message.get("data_encoding"):
+            return message
+
+    message, payload = decode_record(record)
+    message["data"] = encode_from_bytes(payload)
+    if "data_encoding" in message:
+        message["data_encoding"] = None
+    return message
@@ -0,0 +1,263 @@
+"""
+fhir_resources.py
+
+Connect convenience functions for resolving fhir.resources model classes.
+Model classes, and the element classes they reference, are resolved once and cached so that module
+imports and pydantic validator setup do not occur while processing requests.
+
+Structural validation checks element names, cardinality, required elements and JSON value types using
+rules precomputed from the model classes, without constructing fhir.resources instances.
+"""
+import decimal
+import logging
+from pydantic.fields import SHAPE_SINGLETON
+from typing import Any, Dict, List, NamedTuple, Optional, Type
+from fhir.resources import FHIRAbstractModel
+from fhir.resources.fhirtypesvalidators import (
+    MODEL_CLASSES,
+    get_fhir_model_class,
+)
+
+
+logger = logging.getLogger(__name__)
+_resource_classes: Dict[str, Type[FHIRAbstractModel]] = {}
+_structural_rules: Dict[str, "StructuralRules"] = {}
+
+# JSON value types accepted for each structural field kind
+_json_types = {
+    "boolean": (bool,),
+    "integer": (int,),
+    "decimal": (int, float),
+    "string": (str,),
+    "element": (dict,),
+    "resource": (dict,),
+}
+
+
+class FieldRule(NamedTuple):
+    """
+    Structural rule for a single FHIR element
+    """
+
+    is_list: bool
+    kind: str
+    element_type: Optional[str]
+
+
+class StructuralRules(NamedTuple):
+    """
+    Structural rules for a FHIR resource or element type, keyed by JSON element name
+    """
+
+    fields: Dict[str, FieldRule]
+    required: List[str]
+    element_required: List[str]
+    choices: Dict[str, List[str]]
+    required_choices: List[str]
+
+
+def is_fhir_resource_type(resource_type: str) -> bool:
+    """
+    :param resource_type: The FHIR resource type, or element type, name
+    :return: True if the name is a supported FHIR model
+    """
+    return resource_type in MODEL_CLASSES
+
+
+def get_fhir_resource_class(resource_type: str) -> Type[FHIRAbstractModel]:
+    """
+    Returns the cached fhir.resources model class for a FHIR resource or element type.
+
+    :param resource_type: The FHIR resource type, or element type, name
+    :return: the model class
+    :raise: LookupError if the resource type is not a supported FHIR model
+    """
+    klass = _resource_classes.get(resource_type)
+    if klass is None:
+        try:
+            klass = get_fhir_model_class(resource_type)
+        except KeyError:
+            raise LookupError(
+                f"'{resource_type}' is not valid FHIRModel (element type) name!"
+            )
+        _resource_classes[resource_type] = klass
+    return klass
+
+
+def construct_fhir_resource(resource_type: str, data: dict) -> FHIRAbstractModel:
+    """
+    Validates and instantiates a FHIR resource using the cached model class.
+
+    :param resource_type: The FHIR resource type
+    :param data: The FHIR resource data
+    :return: the validated FHIR resource instance
+    :raise: LookupError if the resource type is not a supported FHIR model
+    """
+    return get_fhir_resource_class(resource_type).parse_obj(data)
+
+
+def warm_fhir_resource_classes(resource_types: List[str]) -> List[str]:
+    """
+    Resolves the model classes for the specified resource types, and each element type referenced by their
+    fields, so that first requests for a resource type do not incur import and validator setup costs.
+
+    :param resource_types: The FHIR resource types to resolve
+    :return: the names of all resolved model classes
+    """
+    pending = list(resource_types)
+    resolved = set()
+
+    while pending:
+        resource_type = pending.pop()
+        if resource_type in resolved:
+            continue
+
+        try:
+            klass = get_fhir_resource_class(resource_type)
+        except LookupError as le:
+            logger.warning(f"Unable to warm FHIR resource class: {le}")
+            continue
+        resolved.add(resource_type)
+
+        for field in klass.__fields__.values():
+            element_type = getattr(field.type_, "__resource_type__", None)
+            if element_type and element_type not in resolved:
+                pending.append(element_type)
+
+    logger.debug(f"Resolved {len(resolved)} FHIR model classes")
+    return sorted(resolved)
+
+
+def _get_field_kind(field_type: Any) -> str:
+    """
+    :param field_type: the pydantic field type
+    :return: the structural kind of the field
+    """
+    if not isinstance(field_type, type):
+        return "any"
+
+    element_type = getattr(field_type, "__resource_type__", None)
+    if element_type == "Resource":
+        return "resource"
+    elif element_type:
+        return "element"
+    elif issubclass(field_type, bool):
+        return "boolean"
+    elif issubclass(field_type, int):
+        return "integer"
+    elif issubclass(field_type, (float, decimal.Decimal)):
+        return "decimal"
+    return "string"
+
+
+def get_structural_rules(resource_type: str) -> StructuralRules:
+    """
+    Returns the cached structural rules for a FHIR resource or element type.
+
+    :param resource_type: The FHIR resource type, or element type, name
+    :return: the structural rules
+    :raise: LookupError if the resource type is not a supported FHIR model
+    """
+    rules = _structural_rules.get(resource_type)
+    if rules is not None:
+        return rules
+
+    rules = StructuralRules(
+        {"resourceType": FieldRule(False, "any", None)}, [], [], {}, []
+    )
+    for field in get_fhir_resource_class(resource_type).__fields__.values():
+        extra = field.field_info.extra
+        rules.fields[field.alias] = FieldRule(
+            is_list=field.shape != SHAPE_SINGLETON,
+            kind=_get_field_kind(field.type_),
+            element_type=getattr(field.type_, "__resource_type__", None),
+        )
+
+        if field.required:
+            rules.required.append(field.alias)
+        if extra.get("element_required"):
+            rules.element_required.append(field.alias)
+
+        choice = extra.get("one_of_many")
+        if choice:
+            rules.choices.setdefault(choice, []).append(field.alias)
+            if (
+                extra.get("one_of_many_required")
+                and choice not in rules.required_choices
+            ):
+                rules.required_choices.append(choice)
+
+    _structural_rules[resource_type] = rules
+    return rules
+
+
+def _validate_structure(resource_type: str, data: dict, path: str) -> None:
+    """
+    Validates a FHIR resource or element dictionary, and its children, against structural rules.
+
+    :raise: ValueError if the data is not structurally valid
+    """
+    rules = get_structural_rules(resource_type)
+
+    for name, value in data.items():
+        rule = rules.fields.get(name)
+        if rule is None:
+            raise ValueError(f"{path}.{name}: extra fields not permitted")
+        if value is None or rule.kind == "any":
+            continue
+
+        if rule.is_list:
+            if not isinstance(value, list):
+                raise ValueError(f"{path}.{name}: value is not a valid list")
+            values = value
+        else:
+            values = (value,)
+
+        expected_types = _json_types[rule.kind]
+        for i, item in enumerate(values):
+            item_path = f"{path}.{name}[{i}]" if rule.is_list else f"{path}.{name}"
+            if not isinstance(item, expected_types) or (
+                isinstance(item, bool) and rule.kind in ("integer", "decimal")
+            ):
+                raise ValueError(f"{item_path}: value is not a valid {rule.kind}")
+
+            if rule.kind == "resource":
+                contained_type = item.get("resourceType")
+                if not isinstance(contained_type, str) or not is_fhir_resource_type(
+                    contained_type
+                ):
+                    raise ValueError(f"{item_path}: invalid resourceType")
+                _validate_structure(contained_type, item, item_path)
+            elif rule.kind == "element":
+                _validate_structure(rule.element_type, item, item_path)
+
+    for name in rules.required:
+        if data.get(name) is None:
+            raise ValueError(f"{path}.{name}: field required")
+
+    for name in rules.element_required:
+        if data.get(name) is None and data.get(f"_{name}") is None:
+            raise ValueError(f"{path}.{name}: field required")
+
+    for choice, names in rules.choices.items():
+        present = [name for name in names if data.get(name) is not None]
+        if len(present) > 1:
+            raise ValueError(
+                f"{path}: only one of {choice}[x] is permitted, found {present}"
+            )
+        if not present and choice in rules.required_choices:
+            raise ValueError(f"{path}: {choice}[x] is required")
+
+
+def validate_fhir_structure(resource_type: str, data: dict) -> None:
+    """
+    Validates a FHIR resource dictionary using precomputed structural rules. Element names, cardinality,
+    required elements, choice elements and JSON value types are checked, while value formats and
+    invariants are left to full validation.
+
+    :param resource_type: The FHIR resource type
+    :param data: The FHIR resource data
+    :raise: LookupError if the resource type is not a supported FHIR model
+    :raise: ValueError if the data is not structurally valid
+    """
+    _validate_structure(resource_type, data, resource_type)
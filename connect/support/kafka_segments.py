@@ -2,13 +2,20 @@
 kafka_segments.py
 
 Connect convenience functions to handle Kafka message segmentation
+
+Records larger than the Kafka message chunk size are produced as segments, identified by message headers,
+and reassembled when read. Segments are reassembled into a buffer preallocated to the message size, so
+that segments are copied once and are not retained once they are added.
 """
 
 import uuid
 import math
 import time
 import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 from connect.config import get_settings
+from connect.support.metrics import get_metrics_registry
 
 logger = logging.getLogger(__name__)
 
@@ -24,13 +31,17 @@ def segment_message(msg, chunk_size=settings.kafka_message_chunk_size):
         Allows for the creation of headers that uniquely identify segments by their id(uuid), msg_segment_count
         and a 1-index based counter.
 
+        Segments are evenly sized, no larger than chunk_size, and are memoryview slices of the message
+        rather than copies.
+
         Example usage of `segment_message`:
     ```
             for segment, identifier, count, index in segment_message(msg, self.segment_size):
                     segment_headers = {
                         ID: identifier,
                         COUNT: count,
-                        INDEX: index
+                        INDEX: index,
+                        SIZE: str(len(msg)).encode("utf-8"),
                     }
                     future = loop.create_future()
                     final_headers = {**headers, **segment_headers}
@@ -51,72 +62,267 @@ def segment_message(msg, chunk_size=settings.kafka_message_chunk_size):
         raise ValueError(msg)
     msg_size = len(msg_bytes)
     msg_segment_count = math.ceil(msg_size / chunk_size)
-    start = 0
-    counter = 1
+    if not msg_segment_count:
+        return
+    segment_size = math.ceil(msg_size / msg_segment_count)
+    msg_view = memoryview(msg_bytes)
     identifier = str(uuid.uuid4()).encode("utf-8")
-    while start < msg_size:
-        end = start + chunk_size if start + chunk_size < msg_size else msg_size
-        msg_segment = msg_bytes[start:end]
-        start = end
+    for counter in range(1, msg_segment_count + 1):
         yield (
-            msg_segment,
+            msg_view[(counter - 1) * segment_size : counter * segment_size],
             identifier,
             str(msg_segment_count).encode("utf-8"),
             str(counter).encode("utf-8"),
         )
-        counter += 1
 
 
 ID = "fragment.identifier"
 COUNT = "fragment.count"
 INDEX = "fragment.index"
+SIZE = "fragment.size"
 
-_message_store = {}
+segment_store = None
 
 
-def combine_segments(value, headers):
+def get_segment_headers(
+    identifier: bytes, count: bytes, index: bytes, size: int
+) -> List[Tuple[str, bytes]]:
     """
-    Util method to re-combine chunked messages that were produced by the segment_message util function above.
-    Additionally check example usage on segment_message function above to get a sense of how we could use custom
-    {key: value} header dicts in order to uniquely identify semgents and recombine them.
+    :param identifier: the segment identifier, from segment_message
+    :param count: the segment count, from segment_message
+    :param index: the segment index, from segment_message
+    :param size: the size of the segmented message
+    :return: the Kafka message headers of a segment
+    """
+    return [
+        (ID, identifier),
+        (COUNT, count),
+        (INDEX, index),
+        (SIZE, str(size).encode("utf-8")),
+    ]
 
-    This function accesses and updates a common cache in `_message_store`. We purge unused semgents
-    in this cache with a configurable eviction time.
+
+def parse_segment_headers(headers) -> Optional[Tuple[str, int, int, int]]:
     """
-    identifier = headers[ID].decode("utf-8")
-    count = int(headers[COUNT].decode("utf-8"))
-    index = int(headers[INDEX].decode("utf-8"))
-
-    message_segments = None
-    if identifier in _message_store:
-        message_segments = _message_store[identifier]
-        message_segments["last_accessed"] = time.time()
-    else:
-        message_segments = {
-            "bitset": [0 for _ in range(count)],
-            "segments": [None for _ in range(count)],
-            "last_accessed": time.time(),
-        }
-        _message_store[identifier] = message_segments
+    :param headers: Kafka message headers, as a list of (key, value) tuples or a dict
+    :return: tuple of the segment identifier, count, index and message size, or None if the message is
+        not a segment
+    :raise: ValueError if the segment headers are invalid
+    """
+    if not headers:
+        return None
+    headers = dict(headers)
+    if ID not in headers:
+        return None
+
+    try:
+        identifier = headers[ID].decode("utf-8")
+        count = int(headers[COUNT])
+        index = int(headers[INDEX])
+        size = int(headers[SIZE])
+    except (KeyError, TypeError, ValueError) as ex:
+        raise ValueError(f"Invalid message segment headers: {ex}")
+
+    if not 0 < index <= count or size < count:
+        raise ValueError(
+            f"Invalid message segment {index} of {count} for a message of {size} bytes"
+        )
+    return identifier, count, index, size
+
+
+class SegmentedMessage:
+    """
+    A message being reassembled from its segments. Segments may be added in any order, and duplicate
+    segments are ignored.
+    """
+
+    def __init__(self, identifier: str, count: int, size: int):
+        """
+        :param identifier: the segment identifier
+        :param count: the number of segments
+        :param size: the size of the message
+        """
+        self.identifier = identifier
+        self.count = count
+        self.size = size
+        self.segment_size = math.ceil(size / count)
+        self.buffer = bytearray(size)
+        # the location of the first stored segment, topic:partition:offset, if known
+        self.location = None
+        self.last_accessed = time.monotonic()
+        self._received = bytearray(count)
+        self._received_count = 0
+
+    def add(self, index: int, value: bytes) -> bool:
+        """
+        Copies a segment into the message buffer.
+
+        :param index: the 1-based segment index
+        :param value: the segment
+        :return: True if all segments have been received
+        :raise: ValueError if the segment does not fit the message
+        """
+        start = (index - 1) * self.segment_size
+        end = min(start + self.segment_size, self.size)
+        if len(value) != end - start:
+            raise ValueError(
+                f"Message segment {index} of {self.identifier} is {len(value)} bytes, expected {end - start}"
+            )
+
+        if not self._received[index - 1]:
+            self.buffer[start:end] = value
+            self._received[index - 1] = 1
+            self._received_count += 1
+        return self.is_complete()
+
+    def has_segment(self, index: int) -> bool:
+        return bool(self._received[index - 1])
+
+    def is_complete(self) -> bool:
+        return self._received_count == self.count
+
+
+class SegmentStore:
+    """
+    A memory-budgeted store of messages being reassembled. Messages are ordered by last access, so that
+    messages which have not received a segment within the purge timeout are purged, and the least recently
+    accessed messages are evicted when the store's budget is exceeded, without scanning the store.
+
+    Store metrics:
+    - kafka_segments_evicted/kafka_segments_purged/kafka_segments_rejected: counters of discarded messages
+    - kafka_segments_bytes/kafka_segments_messages: the size of the message buffers, and the number of messages
+    """
+
+    def __init__(self, max_bytes: int, purge_timeout: float):
+        """
+        :param max_bytes: the maximum total size of the messages being reassembled
+        :param purge_timeout: the time, in seconds, after which an incomplete message is purged
+        """
+        self.max_bytes = max_bytes
+        self.purge_timeout = purge_timeout
+        self.size = 0
+        self._messages = OrderedDict()
+
+        registry = get_metrics_registry()
+        self._evicted = registry.counter("kafka_segments_evicted")
+        self._purged = registry.counter("kafka_segments_purged")
+        self._rejected = registry.counter("kafka_segments_rejected")
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def add(
+        self, value: bytes, headers, location: Optional[str] = None
+    ) -> Optional[SegmentedMessage]:
+        """
+        Adds a segment to its message.
 
-    message_segments["segments"][index - 1] = value
-    message_segments["bitset"][index - 1] = 1
+        :param value: the segment
+        :param headers: the segment's Kafka message headers
+        :param location: the segment location, topic:partition:offset. The first location added is
+            recorded as the message location.
+        :return: the SegmentedMessage once all segments are added, otherwise None
+        :raise: ValueError if the message is not a segment, or the segment is invalid
+        """
+        segment = parse_segment_headers(headers)
+        if segment is None:
+            raise ValueError("Message is not a segment")
+        identifier, count, index, size = segment
 
-    message = None
-    if message_segments["bitset"] == [1 for _ in range(count)]:
-        del _message_store[identifier]
-        message = b"".join(message_segments["segments"])
+        now = time.monotonic()
+        self._purge(now)
 
-    _purge_segments()
+        message = self._messages.get(identifier)
+        if message is None:
+            if not self._reserve(size):
+                logger.warning(
+                    f"Unable to reassemble message {identifier} of {size} bytes, the maximum is {self.max_bytes}"
+                )
+                self._rejected.inc()
+                return None
+            message = self._messages[identifier] = SegmentedMessage(
+                identifier, count, size
+            )
+            message.location = location
+            self.size += size
+        else:
+            self._messages.move_to_end(identifier)
+            message.last_accessed = now
 
-    return message
+        try:
+            complete = message.add(index, value)
+        except ValueError:
+            self._remove(identifier)
+            raise
+        if complete:
+            self._remove(identifier)
+            return message
+        return None
 
+    def _reserve(self, size: int) -> bool:
+        """
+        Evicts the least recently accessed messages until the store has capacity for a new message.
 
-def _purge_segments():
-    for identifier in list(_message_store.keys()):
-        last_accessed = _message_store[identifier]["last_accessed"]
-        current_time = time.time() - settings.kafka_segments_purge_timeout
-        # trace log
-        if last_accessed < current_time:
+        :return: False if the message is larger than the store
+        """
+        if size > self.max_bytes:
+            return False
+        while self.size + size > self.max_bytes:
+            identifier = next(iter(self._messages))
+            logger.trace(f"Evicting message segments with identifier: {identifier}")
+            self._remove(identifier)
+            self._evicted.inc()
+        return True
+
+    def _purge(self, now: float):
+        """
+        Purges messages which have not been accessed within the purge timeout, oldest first.
+        """
+        expired = now - self.purge_timeout
+        while self._messages:
+            identifier, message = next(iter(self._messages.items()))
+            if message.last_accessed >= expired:
+                break
             logger.trace(f"Purging message segments with identifier: {identifier}")
-            del _message_store[identifier]
+            self._remove(identifier)
+            self._purged.inc()
+
+    def _remove(self, identifier: str):
+        message = self._messages.pop(identifier)
+        self.size -= message.size
+
+    def clear(self):
+        self._messages.clear()
+        self.size = 0
+
+
+def get_segment_store() -> Optional[SegmentStore]:
+    """
+    :return: the SegmentStore instance
+    """
+    global segment_store
+    if segment_store is None:
+        store = SegmentStore(
+            get_settings().kafka_segments_max_bytes,
+            get_settings().kafka_segments_purge_timeout,
+        )
+        registry = get_metrics_registry()
+        registry.gauge("kafka_segments_bytes", lambda: store.size)
+        registry.gauge("kafka_segments_messages", lambda: len(store))
+        segment_store = store
+    return segment_store
+
+
+def combine_segments(value, headers):
+    """
+    Util method to re-combine chunked messages that were produced by the segment_message util function above.
+    Additionally check example usage on segment_message function above to get a sense of how we could use custom
+    {key: value} header dicts in order to uniquely identify semgents and recombine them.
+
+    This function accesses and updates the common SegmentStore. Unused segments are purged from the store
+    with a configurable eviction time.
+
+    :return: the combined message, once all segments are received, otherwise None
+    """
+    message = get_segment_store().add(value, headers)
+    return message.buffer if message else None
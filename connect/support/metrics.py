@@ -0,0 +1,285 @@
+"""
+metrics.py
+
+In-process metrics for LinuxForHealth connect.
+Counters and fixed-bucket latency histograms are updated in place on the event loop thread, without locks
+or network round trips. Snapshots may be exported to, and merged from, other LFH instances, and rendered
+in the Prometheus text exposition format.
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Optional, Sequence
+
+
+# latency bucket upper bounds, in seconds
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+metrics_registry = None
+
+
+class Counter:
+    """
+    A monotonically increasing counter
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram used to record latencies.
+    Quantiles are estimated by linear interpolation within the bucket containing the quantile.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # the final count tracks observations greater than the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def merge(self, counts: Sequence[int], total: float, count: int) -> None:
+        """
+        Adds the observations of a histogram with the same buckets to this histogram
+        """
+        for i, bucket_count in enumerate(counts):
+            self.counts[i] += bucket_count
+        self.total += total
+        self.count += count
+
+    def quantile(self, q: float) -> float:
+        """
+        :param q: the quantile to estimate, between 0.0 and 1.0
+        :return: the estimated value at the quantile
+        """
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def summary(self) -> dict:
+        """
+        :return: a dict containing the total, count, average and p50, p95 and p99 quantiles
+        """
+        return {
+            "total": self.total,
+            "count": self.count,
+            "average": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+    def export(self) -> dict:
+        return {"counts": list(self.counts), "total": self.total, "count": self.count}
+
+
+class MetricsRegistry:
+    """
+    Maintains counters, histograms and gauges for the local LFH instance, and the most recent
+    exported metrics received from remote LFH instances.
+
+    Metrics are identified by a name and an optional set of labels, such as data_format.
+    Gauges are callbacks which are evaluated when metrics are collected.
+    """
+
+    def __init__(self):
+        self.counters: Dict[tuple, Counter] = {}
+        self.histograms: Dict[tuple, Histogram] = {}
+        self.gauges: Dict[tuple, Callable[[], float]] = {}
+        self.remote: Dict[str, dict] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def counter(self, name: str, **labels) -> Counter:
+        """
+        :return: the labeled counter, created if it does not exist
+        """
+        key = self._key(name, labels)
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = Counter()
+        return counter
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        """
+        :return: the labeled histogram, created if it does not exist
+        """
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        return histogram
+
+    def gauge(self, name: str, callback: Callable[[], float], **labels) -> None:
+        """
+        Registers, or replaces, a labeled gauge.
+
+        :param callback: returns the current gauge value when metrics are collected
+        """
+        self.gauges[self._key(name, labels)] = callback
+
+    def collect_gauges(self) -> Dict[tuple, float]:
+        """
+        :return: the current value of each gauge. Gauges which raise an error are skipped.
+        """
+        values = {}
+        for key, callback in self.gauges.items():
+            try:
+                values[key] = callback()
+            except Exception:
+                continue
+        return values
+
+    def export(self) -> dict:
+        """
+        :return: the local metrics in a form that can be published to, and merged by, other instances
+        """
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": c.value}
+                for (name, labels), c in self.counters.items()
+            ],
+            "histograms": [
+                {"name": name, "labels": dict(labels), **h.export()}
+                for (name, labels), h in self.histograms.items()
+            ],
+        }
+
+    def update_remote(self, lfh_id: str, exported: dict) -> None:
+        """
+        Stores the exported metrics of a remote LFH instance, replacing any previous export.
+        """
+        self.remote[lfh_id] = exported
+
+    def summary(self, include_remote: bool = True) -> dict:
+        """
+        Summarizes histograms by name, aggregating across labels, for display.
+
+        :param include_remote: True to aggregate metrics exported by remote LFH instances
+        :return: dict of histogram summaries, keyed by histogram name
+        """
+        histograms = {}
+
+        def merge(name: str, data: dict):
+            if name not in histograms:
+                histograms[name] = Histogram()
+            histograms[name].merge(data["counts"], data["total"], data["count"])
+
+        for (name, _), histogram in self.histograms.items():
+            merge(name, histogram.export())
+
+        if include_remote:
+            for exported in self.remote.values():
+                for data in exported.get("histograms", []):
+                    merge(data["name"], data)
+
+        return {name: h.summary() for name, h in histograms.items()}
+
+
+def _format_labels(labels: Iterable[tuple], **extra_labels) -> str:
+    """
+    Formats labels for the Prometheus text exposition format
+    """
+    pairs = list(labels) + list(extra_labels.items())
+    if not pairs:
+        return ""
+
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    formatted = ",".join(f'{k}="{escape(str(v))}"' for k, v in pairs)
+    return "{" + formatted + "}"
+
+
+def generate_metrics_text(registry: MetricsRegistry, prefix: str = "lfh") -> str:
+    """
+    Renders the local metrics using the Prometheus text exposition format.
+    Counters are suffixed with _total and histograms, which record durations, with _seconds.
+
+    :param registry: the metrics registry
+    :param prefix: the prefix applied to each metric name
+    :return: the metrics text
+    """
+    lines = []
+
+    def families(metrics: dict) -> Dict[str, list]:
+        grouped = {}
+        for (name, labels), metric in sorted(metrics.items()):
+            grouped.setdefault(name, []).append((labels, metric))
+        return grouped
+
+    for name, metrics in families(registry.counters).items():
+        metric_name = f"{prefix}_{name}_total"
+        lines.append(f"# TYPE {metric_name} counter")
+        for labels, counter in metrics:
+            lines.append(f"{metric_name}{_format_labels(labels)} {counter.value}")
+
+    for name, metrics in families(registry.collect_gauges()).items():
+        metric_name = f"{prefix}_{name}"
+        lines.append(f"# TYPE {metric_name} gauge")
+        for labels, value in metrics:
+            lines.append(f"{metric_name}{_format_labels(labels)} {value}")
+
+    for name, metrics in families(registry.histograms).items():
+        metric_name = f"{prefix}_{name}_seconds"
+        lines.append(f"# TYPE {metric_name} histogram")
+        for labels, histogram in metrics:
+            cumulative = 0
+            for bucket, bucket_count in zip(histogram.buckets, histogram.counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(labels, le=bucket)
+                lines.append(f"{metric_name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(labels, le="+Inf")
+            lines.append(f"{metric_name}_bucket{bucket_labels} {histogram.count}")
+            lines.append(f"{metric_name}_sum{_format_labels(labels)} {histogram.total}")
+            lines.append(
+                f"{metric_name}_count{_format_labels(labels)} {histogram.count}"
+            )
+
+    return "\n".join(lines) + "\n"
+
+
+def get_metrics_registry() -> Optional[MetricsRegistry]:
+    """
+    :return: the MetricsRegistry instance
+    """
+    global metrics_registry
+    if not metrics_registry:
+        metrics_registry = MetricsRegistry()
+    return metrics_registry
@@ -0,0 +1,93 @@
+"""
+record_cache.py
+
+An in-process cache of stored LinuxForHealth records, keyed by record location (topic:partition:offset).
+Stored records are immutable, so cached records never need to be invalidated. The cache is bounded by the
+total size of the cached records, evicting the least recently used records first.
+
+Records are cached when read from Kafka, and when stored by a workflow, as clients commonly read a
+record immediately after storing it.
+"""
+from collections import OrderedDict
+from typing import Optional
+from connect.config import get_settings
+from connect.support.metrics import get_metrics_registry
+
+
+record_cache = None
+
+
+class RecordCache:
+    """
+    A byte-budgeted LRU cache of stored records.
+
+    Cache metrics:
+    - record_cache_hits/record_cache_misses/record_cache_evictions: counters
+    - record_cache_bytes/record_cache_records: the size of the cached records, and the number of records
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        :param max_bytes: the maximum total size of the cached records. 0 disables the cache.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._records = OrderedDict()
+
+        registry = get_metrics_registry()
+        self._hits = registry.counter("record_cache_hits")
+        self._misses = registry.counter("record_cache_misses")
+        self._evictions = registry.counter("record_cache_evictions")
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, location: str) -> Optional[bytes]:
+        """
+        :param location: the record location, topic:partition:offset
+        :return: the cached record, or None if the record is not cached
+        """
+        record = self._records.get(location)
+        if record is None:
+            self._misses.inc()
+            return None
+
+        self._records.move_to_end(location)
+        self._hits.inc()
+        return record
+
+    def put(self, location: str, record: bytes) -> None:
+        """
+        Caches a record, evicting the least recently used records as required. Records larger than the
+        cache are not cached.
+
+        :param location: the record location, topic:partition:offset
+        :param record: the stored record
+        """
+        if len(record) > self.max_bytes or location in self._records:
+            return
+
+        self._records[location] = record
+        self.size += len(record)
+        while self.size > self.max_bytes:
+            _, evicted = self._records.popitem(last=False)
+            self.size -= len(evicted)
+            self._evictions.inc()
+
+    def clear(self) -> None:
+        self._records.clear()
+        self.size = 0
+
+
+def get_record_cache() -> Optional[RecordCache]:
+    """
+    :return: the RecordCache instance
+    """
+    global record_cache
+    if record_cache is None:
+        cache = RecordCache(get_settings().connect_record_cache_max_bytes)
+        registry = get_metrics_registry()
+        registry.gauge("record_cache_bytes", lambda: cache.size)
+        registry.gauge("record_cache_records", lambda: len(cache))
+        record_cache = cache
+    return record_cache
@@ -0,0 +1,87 @@
+"""
+record_keys.py
+
+Derives the Kafka message keys of stored LinuxForHealth records. Records with the same key are stored in
+the same topic partition, so their order is preserved, while records with different keys are spread
+across the topic's partitions.
+
+Key strategies, configured by data format with KAFKA_PRODUCER_KEY_STRATEGY:
+- none: records are not keyed, and are spread across partitions by the producer
+- uuid: the record uuid
+- resource_id: the FHIR resource id, "<resourceType>/<id>"
+- patient: the FHIR patient reference, "Patient/<id>", so that the records of a patient are stored in order
+
+Records which do not contain the key field, such as a resource without an id, are not keyed.
+Keys are derived from parsed messages, so that a record is not parsed again to derive its key.
+"""
+from typing import Any, Optional
+from connect.config import get_settings
+
+
+# FHIR elements which reference the patient a resource belongs to, in order of precedence
+patient_reference_elements = ("subject", "patient", "beneficiary")
+# key strategies which derive the key from the record's resource
+resource_key_strategies = ("resource_id", "patient")
+
+
+def get_key_strategy(data_format: Optional[str]) -> str:
+    """
+    :param data_format: the record data format
+    :return: the configured key strategy for the data format
+    """
+    settings = get_settings()
+    return settings.kafka_producer_key_strategy_overrides.get(
+        data_format, settings.kafka_producer_key_strategy
+    )
+
+
+def _get_element(resource: Any, name: str) -> Any:
+    """
+    :return: a resource element from a dict or a fhir.resources instance, or None if not present
+    """
+    if isinstance(resource, dict):
+        return resource.get(name)
+    if name == "resourceType":
+        name = "resource_type"
+    return getattr(resource, name, None)
+
+
+def _get_patient_reference(resource: Any) -> Optional[str]:
+    """
+    :return: the patient reference of a FHIR resource, or None if the resource does not reference a patient
+    """
+    if _get_element(resource, "resourceType") == "Patient":
+        resource_id = _get_element(resource, "id")
+        return f"Patient/{resource_id}" if resource_id else None
+
+    for name in patient_reference_elements:
+        reference = _get_element(_get_element(resource, name), "reference")
+        if isinstance(reference, str) and reference.startswith("Patient/"):
+            return reference
+    return None
+
+
+def get_record_key(strategy: str, record_uuid: str, message: Any) -> Optional[bytes]:
+    """
+    Derives a record's message key using a key strategy.
+
+    :param strategy: the key strategy, one of none, uuid, resource_id or patient
+    :param record_uuid: the record uuid
+    :param message: the record's parsed message, as a dict or a fhir.resources instance. Messages which
+        are not parsed are not keyed by the resource_id or patient strategies.
+    :return: the message key, or None if the record is not keyed
+    """
+    if strategy == "uuid":
+        return str(record_uuid).encode()
+    if strategy not in resource_key_strategies:
+        return None
+
+    if strategy == "resource_id":
+        resource_type = _get_element(message, "resourceType")
+        resource_id = _get_element(message, "id")
+        key = (
+            f"{resource_type}/{resource_id}" if resource_type and resource_id else None
+        )
+    else:
+        key = _get_patient_reference(message)
+    return key.encode() if key else None
@@ -0,0 +1,512 @@
+"""
+retransmit_queue.py
+
+A durable queue of messages which could not be transmitted to an external server, pending retransmission.
+Queue changes are appended to a local log file, which is replayed on startup to recover the queue. Messages
+are queued by target endpoint, and each target's messages are retransmitted in order.
+
+Queued messages are read from the log when retransmitted, so that the queue's memory footprint is a small,
+fixed size entry per message, rather than the message itself. The log is compacted once most of its records
+are for messages which are no longer queued. When the queue is used from an event loop, the compacted log is
+written in an executor, and records appended meanwhile are copied to it before it replaces the log.
+
+sync() syncs appended records to disk in an executor. Concurrent callers share a single fsync, so that callers
+which require durability, such as async transmissions, are group committed without blocking the event loop.
+
+Log records are JSON lines:
+- {"op": "put", "id": <message uuid>, "message": <message>}
+- {"op": "retry", "id": <message uuid>, "retransmit_count": <count>}
+- {"op": "remove", "id": <message uuid>}
+"""
+import asyncio
+import itertools
+import logging
+import os
+from collections import deque, OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+from connect.config import get_settings
+from connect.support.encoding import decode_json, encode_json
+
+
+logger = logging.getLogger(__name__)
+retransmit_queue = None
+
+
+class _QueueEntry:
+    """
+    A queued message's target, log offset and retransmit count
+    """
+
+    __slots__ = ("target", "offset", "retransmit_count")
+
+    def __init__(self, target: str, offset: int, retransmit_count: int):
+        self.target = target
+        self.offset = offset
+        self.retransmit_count = retransmit_count
+
+
+class RetransmitQueue:
+    """
+    A durable, per-target FIFO queue of messages pending retransmission. Messages are identified by
+    their uuid. Enqueue, dequeue and retry updates are O(1).
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        max_entries: int,
+        compact_min_records: int = 1000,
+        fsync: bool = False,
+    ):
+        """
+        :param path: the log file path. If None, messages are held in memory and are not recovered.
+        :param max_entries: the maximum number of queued messages
+        :param compact_min_records: the minimum number of log records before the log is compacted
+        :param fsync: True to sync the log to disk after each change
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.compact_min_records = compact_min_records
+        self.fsync = fsync
+        self._entries = {}
+        # queued message ids by target endpoint, in retransmit order
+        self._targets = OrderedDict()
+        # messages, by id, if the queue is not backed by a log
+        self._messages = {}
+        self._log = None
+        self._log_records = 0
+        # the number of records appended, and synced to disk by sync()
+        self._appended = 0
+        self._synced = 0
+        self._sync_task = None
+        self._compacting = False
+        if path:
+            self._open_log()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _open_log(self):
+        """
+        Opens the log, and recovers the queued messages from the log records.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._log = open(self.path, "a+b")
+        self._log.seek(0)
+
+        offset = 0
+        for line in self._log:
+            if not line.endswith(b"\n"):
+                # a partially written record, at the end of the log
+                logger.warning(
+                    f"RetransmitQueue: discarding a partial log record at {offset}"
+                )
+                self._log.truncate(offset)
+                break
+            try:
+                record = decode_json(line)
+                self._replay(record, offset)
+                self._log_records += 1
+            except (ValueError, KeyError) as ex:
+                logger.warning(
+                    f"RetransmitQueue: ignoring invalid log record at {offset}: {ex}"
+                )
+            offset += len(line)
+
+        # discard removed messages from the per target queues. A requeued message is queued at the
+        # position of its last put, which is the put its entry refers to.
+        recovered = set()
+        for target in list(self._targets):
+            ids = deque()
+            for message_id in reversed(self._targets[target]):
+                entry = self._entries.get(message_id)
+                if (
+                    entry is not None
+                    and entry.target == target
+                    and message_id not in recovered
+                ):
+                    recovered.add(message_id)
+                    ids.appendleft(message_id)
+            if ids:
+                self._targets[target] = ids
+            else:
+                del self._targets[target]
+
+        if self._entries:
+            logger.info(
+                f"RetransmitQueue: recovered {len(self._entries)} messages from {self.path}"
+            )
+
+    def _replay(self, record: dict, offset: int):
+        """
+        Applies a log record to the queue, while recovering the queue.
+        """
+        op = record["op"]
+        message_id = record["id"]
+        if op == "put":
+            message = record["message"]
+            target = message["target_endpoint_url"]
+            self._entries[message_id] = _QueueEntry(
+                target, offset, message.get("retransmit_count", 0)
+            )
+            self._targets.setdefault(target, deque()).append(message_id)
+        elif op == "retry" and message_id in self._entries:
+            self._entries[message_id].retransmit_count = record["retransmit_count"]
+        elif op == "remove":
+            self._entries.pop(message_id, None)
+
+    def _append(self, record: dict) -> Optional[int]:
+        """
+        Appends a record to the log.
+
+        :return: the record's log offset, or None if the queue is not backed by a log
+        """
+        if self._log is None:
+            return None
+        self._log.seek(0, os.SEEK_END)
+        offset = self._log.tell()
+        self._log.write(encode_json(record) + b"\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self._log_records += 1
+        self._appended += 1
+        return offset
+
+    async def sync(self):
+        """
+        Syncs the log records appended so far to disk. If a sync is in progress, the caller waits for it,
+        and for a following sync if records were appended after it started.
+        """
+        if self._log is None:
+            return
+        appended = self._appended
+        while self._synced < appended:
+            if self._sync_task is None:
+                self._sync_task = asyncio.get_running_loop().create_task(
+                    self._sync_log()
+                )
+            await asyncio.shield(self._sync_task)
+
+    async def _sync_log(self):
+        """
+        Syncs the log to disk in an executor. The log's file descriptor is duplicated, so that the log may
+        be compacted, or closed, while the sync is in progress.
+        """
+        appended = self._appended
+        fd = os.dup(self._log.fileno())
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, fd)
+            self._synced = max(self._synced, appended)
+        finally:
+            os.close(fd)
+            self._sync_task = None
+
+    def _read(self, message_id: str) -> dict:
+        """
+        :return: a queued message, with its current retransmit count
+        """
+        entry = self._entries[message_id]
+        if self._log is None:
+            message = dict(self._messages[message_id])
+        else:
+            self._log.seek(entry.offset)
+            message = decode_json(self._log.readline())["message"]
+        message["retransmit_count"] = entry.retransmit_count
+        return message
+
+    def is_durable(self) -> bool:
+        """
+        :return: True if queued messages are recovered from the log on restart
+        """
+        return self._log is not None
+
+    def has_target(self, target: str) -> bool:
+        """
+        :return: True if messages are queued for the target endpoint
+        """
+        return target in self._targets
+
+    def targets(self) -> List[str]:
+        """
+        :return: the target endpoints with queued messages
+        """
+        return list(self._targets)
+
+    def put(self, message: dict) -> bool:
+        """
+        Queues a message for retransmission, after the messages queued for its target endpoint.
+
+        :param message: the LFH message, with uuid and target_endpoint_url
+        :return: False if the queue is full, and the message was not queued
+        """
+        message_id = str(message["uuid"])
+        if message_id in self._entries:
+            return True
+        if len(self._entries) >= self.max_entries:
+            logger.warning(
+                f"RetransmitQueue: queue is full, unable to queue message {message_id}"
+            )
+            return False
+
+        target = message["target_endpoint_url"]
+        offset = self._append({"op": "put", "id": message_id, "message": message})
+        if offset is None:
+            self._messages[message_id] = dict(message)
+        self._entries[message_id] = _QueueEntry(
+            target, offset, message.get("retransmit_count", 0)
+        )
+        self._targets.setdefault(target, deque()).append(message_id)
+        return True
+
+    def target_length(self, target: str) -> int:
+        """
+        :return: the number of messages queued for a target endpoint
+        """
+        return len(self._targets.get(target, ()))
+
+    def peek_ids(self, target: str, count: int) -> List[str]:
+        """
+        :return: the ids of the next count messages queued for a target endpoint
+        """
+        return list(itertools.islice(self._targets.get(target, ()), count))
+
+    def get(self, message_id: str) -> Optional[dict]:
+        """
+        :return: a queued message, or None if the message is not queued
+        """
+        return self._read(message_id) if message_id in self._entries else None
+
+    def peek(self, target: str) -> Optional[dict]:
+        """
+        :return: the next message queued for a target endpoint, or None if no messages are queued
+        """
+        ids = self._targets.get(target)
+        return self._read(ids[0]) if ids else None
+
+    def retry(self, message: dict):
+        """
+        Records a failed retransmission of a queued message.
+
+        :param message: the queued message, with its updated retransmit_count
+        """
+        message_id = str(message["uuid"])
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return
+        entry.retransmit_count = message["retransmit_count"]
+        self._append(
+            {
+                "op": "retry",
+                "id": message_id,
+                "retransmit_count": entry.retransmit_count,
+            }
+        )
+
+    def remove(self, message: dict):
+        """
+        Removes a message, once it has been retransmitted or has failed permanently.
+
+        :param message: the queued message
+        """
+        message_id = str(message["uuid"])
+        entry = self._entries.pop(message_id, None)
+        if entry is None:
+            return
+        self._messages.pop(message_id, None)
+        self._append({"op": "remove", "id": message_id})
+
+        ids = self._targets[entry.target]
+        if ids[0] == message_id:
+            ids.popleft()
+        else:
+            ids.remove(message_id)
+        if not ids:
+            del self._targets[entry.target]
+        self._compact_if_required()
+
+    def __iter__(self) -> Iterator[dict]:
+        """
+        :return: an iterator of the queued messages, by target endpoint
+        """
+        for ids in list(self._targets.values()):
+            for message_id in list(ids):
+                if message_id in self._entries:
+                    yield self._read(message_id)
+
+    def _compact_if_required(self):
+        """
+        Rewrites the log with the queued messages, once most log records are no longer required. Within an
+        event loop, the log is compacted by a task, so that its disk I/O runs in an executor.
+        """
+        if self._log is None or self._compacting:
+            return
+        if self._log_records < self.compact_min_records:
+            return
+        if self._log_records <= 2 * len(self._entries):
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            compact_path = self.path + ".compact"
+            entries, log_end = self._snapshot()
+            offsets = self._write_compact_log(compact_path, entries)
+            self._replace_log(compact_path, offsets, log_end, 0, len(offsets))
+            return
+
+        self._compacting = True
+        loop.create_task(self._compact())
+
+    def _snapshot(self) -> Tuple[List[tuple], int]:
+        """
+        :return: the queued messages' ids, log offsets and retransmit counts, in queue order, and the
+            log's end offset
+        """
+        entries = [
+            (
+                message_id,
+                self._entries[message_id].offset,
+                self._entries[message_id].retransmit_count,
+            )
+            for ids in self._targets.values()
+            for message_id in ids
+        ]
+        return entries, self._log.seek(0, os.SEEK_END)
+
+    def _write_compact_log(
+        self, compact_path: str, entries: List[tuple]
+    ) -> Dict[str, int]:
+        """
+        Writes put records for the queued messages, with their retransmit counts, to the compacted log.
+        The log is read with its own file handle, so that records may be appended meanwhile.
+
+        :param compact_path: the compacted log file path
+        :param entries: the queued messages' ids, log offsets and retransmit counts
+        :return: the compacted log offsets of the queued messages, by id
+        """
+        offsets = {}
+        with open(self.path, "rb") as log, open(compact_path, "wb") as f:
+            for message_id, offset, retransmit_count in entries:
+                log.seek(offset)
+                record = decode_json(log.readline())
+                record["message"]["retransmit_count"] = retransmit_count
+                offsets[message_id] = f.tell()
+                f.write(encode_json(record) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return offsets
+
+    async def _compact(self):
+        """
+        Compacts the log, writing the queued messages to the compacted log in an executor. Records appended
+        meanwhile are copied to the compacted log, and synced, until no records remain to be copied.
+        """
+        loop = asyncio.get_running_loop()
+        compact_path = self.path + ".compact"
+        try:
+            entries, log_end = self._snapshot()
+            offsets = await loop.run_in_executor(
+                None, self._write_compact_log, compact_path, entries
+            )
+
+            records = len(offsets)
+            tail_offset = log_end
+            with open(compact_path, "ab") as f:
+                compacted_end = f.seek(0, os.SEEK_END)
+                while self._log is not None:
+                    self._log.seek(tail_offset)
+                    tail = self._log.read()
+                    if not tail:
+                        break
+                    f.write(tail)
+                    f.flush()
+                    tail_offset += len(tail)
+                    records += tail.count(b"\n")
+                    await loop.run_in_executor(None, os.fsync, f.fileno())
+
+            if self._log is None:
+                os.remove(compact_path)
+                return
+            self._replace_log(compact_path, offsets, log_end, compacted_end, records)
+        except (OSError, ValueError) as ex:
+            logger.error(f"RetransmitQueue: unable to compact {self.path}: {ex}")
+            if os.path.exists(compact_path):
+                os.remove(compact_path)
+        finally:
+            self._compacting = False
+
+    def _replace_log(
+        self,
+        compact_path: str,
+        offsets: Dict[str, int],
+        log_end: int,
+        compacted_end: int,
+        records: int,
+    ):
+        """
+        Replaces the log with the compacted log, and updates the queued messages' log offsets.
+
+        :param compact_path: the compacted log file path
+        :param offsets: the compacted log offsets of the compacted messages, by id
+        :param log_end: the log's end offset when the compacted log was written
+        :param compacted_end: the compacted log's end offset, before records appended meanwhile were copied
+        :param records: the number of records in the compacted log
+        """
+        self._log.close()
+        os.replace(compact_path, self.path)
+        self._log = open(self.path, "a+b")
+        for message_id, entry in self._entries.items():
+            if entry.offset >= log_end:
+                # a record appended while the log was compacted
+                entry.offset += compacted_end - log_end
+            else:
+                entry.offset = offsets[message_id]
+        # the compacted log is synced once written
+        self._synced = self._appended
+        logger.debug(
+            f"RetransmitQueue: compacted {self._log_records} log records to {records}"
+        )
+        self._log_records = records
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+def get_retransmit_queue() -> Optional[RetransmitQueue]:
+    """
+    :return: the RetransmitQueue instance, recovered from its log. If the log cannot be opened, the
+        queue is held in memory.
+    """
+    global retransmit_queue
+    if retransmit_queue is None:
+        settings = get_settings()
+        try:
+            retransmit_queue = RetransmitQueue(
+                settings.nats_retransmit_queue_path,
+                settings.nats_retransmit_queue_max_entries,
+                fsync=settings.nats_retransmit_queue_fsync,
+            )
+        except OSError as ex:
+            logger.error(
+                f"Unable to open retransmit queue log {settings.nats_retransmit_queue_path}, "
+                + f"queued messages will not be recovered: {ex}"
+            )
+            retransmit_queue = RetransmitQueue(
+                None, settings.nats_retransmit_queue_max_entries
+            )
+    return retransmit_queue
+
+
+def close_retransmit_queue():
+    """
+    Closes the RetransmitQueue instance, if created
+    """
+    global retransmit_queue
+    if retransmit_queue is not None:
+        retransmit_queue.close()
+        retransmit_queue = None
@@ -0,0 +1,255 @@
+"""
+retransmit_scheduler.py
+
+Schedules the retransmission of messages in the RetransmitQueue. Messages are held in a priority queue keyed
+by their next attempt time. Failed attempts are retried after an exponential backoff, with jitter, and each
+target endpoint's requests are deferred while its circuit breaker is open. The breaker is shared with the
+target's other transmissions, and records the outcome of each retransmit.
+
+Up to target_concurrency of each target endpoint's next queued messages are retransmitted concurrently.
+A target concurrency of 1 retransmits each target's messages in order.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from collections import deque
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit
+from connect.support.circuit_breaker import CircuitBreaker
+from connect.support.metrics import get_metrics_registry
+from connect.support.retransmit_queue import RetransmitQueue
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_target_label(target: str) -> str:
+    """
+    :param target: a target endpoint url
+    :return: the target endpoint url, without credentials, for use as a metric label
+    """
+    url = urlsplit(target)
+    host = url.hostname or ""
+    if url.port:
+        host += f":{url.port}"
+    return f"{url.scheme}://{host}{url.path}"
+
+
+def _is_client_error(message: dict) -> bool:
+    """
+    :return: True if the target responded to the message with a client error status code
+    """
+    return 400 <= message.get("transmit_status_code", 0) < 500
+
+
+class RetransmitScheduler:
+    """
+    Retransmits queued messages with bounded per target concurrency.
+
+    Scheduler metrics, by target endpoint:
+    - retransmit_attempts/retransmit_successes/retransmit_failures: counters of retransmit attempts
+    - retransmit_target_queue_length: the target's queued messages
+    Overall:
+    - retransmit_scheduled/retransmit_in_flight: the messages waiting for their next attempt, and being retransmitted
+    - retransmit_drain_rate: the messages removed from the queue per second, over the last minute
+    """
+
+    def __init__(
+        self,
+        queue: RetransmitQueue,
+        retransmit: Callable[[dict], Awaitable[bool]],
+        get_breaker: Callable[[str], CircuitBreaker],
+        target_concurrency: int = 1,
+        backoff: float = 1.0,
+        max_backoff: float = 300.0,
+        scan_interval: float = 10.0,
+    ):
+        """
+        :param queue: the RetransmitQueue
+        :param retransmit: retransmits a queued message, returning True if the message was removed from the
+            queue. The message status is SUCCESS if the message was retransmitted, and its
+            transmit_status_code is the target's response status code, if the target responded.
+            The retransmit records its outcome in the target's circuit breaker.
+        :param get_breaker: returns the circuit breaker of a target endpoint
+        :param target_concurrency: the maximum number of concurrent retransmits for each target endpoint
+        :param backoff: the initial time, in seconds, to wait before retrying a failed message
+        :param max_backoff: the maximum time, in seconds, to wait before retrying a failed message
+        :param scan_interval: the maximum time, in seconds, between checks for newly queued messages
+        """
+        self.queue = queue
+        self.retransmit = retransmit
+        self.get_breaker = get_breaker
+        self.target_concurrency = target_concurrency
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.scan_interval = scan_interval
+        # (next attempt time, sequence, target, message id)
+        self._heap = []
+        self._sequence = itertools.count()
+        # ids of messages which are scheduled or in flight
+        self._scheduled = set()
+        self._in_flight = 0
+        # targets whose queue length gauge is registered
+        self._targets = set()
+        self._tasks = set()
+        self._drained = deque()
+        self._wakeup = None
+        self._cancelled = False
+        self._loop = None
+
+        registry = get_metrics_registry()
+        registry.gauge("retransmit_scheduled", lambda: len(self._heap))
+        registry.gauge("retransmit_in_flight", lambda: self._in_flight)
+        registry.gauge("retransmit_drain_rate", self.drain_rate)
+
+    def drain_rate(self) -> float:
+        """
+        :return: the messages removed from the queue per second, over the last minute
+        """
+        if self._loop is None:
+            return 0.0
+        expired = self._loop.time() - 60.0
+        while self._drained and self._drained[0] < expired:
+            self._drained.popleft()
+        return len(self._drained) / 60.0
+
+    def _register_target(self, target: str):
+        if target not in self._targets:
+            self._targets.add(target)
+            get_metrics_registry().gauge(
+                "retransmit_target_queue_length",
+                lambda: self.queue.target_length(target),
+                target=get_target_label(target),
+            )
+
+    def _get_backoff(self, retransmit_count: int) -> float:
+        """
+        :return: the time, in seconds, to wait before the next attempt, an exponential backoff with jitter
+        """
+        backoff = min(
+            self.backoff * 2 ** max(retransmit_count - 1, 0), self.max_backoff
+        )
+        return random.uniform(backoff / 2, backoff)
+
+    def _push(self, attempt_time: float, target: str, message_id: str):
+        heapq.heappush(
+            self._heap, (attempt_time, next(self._sequence), target, message_id)
+        )
+
+    def notify(self):
+        """
+        Wakes the scheduler, once messages are queued.
+        """
+        if self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _schedule_targets(self, now: float):
+        """
+        Schedules each target's next messages, up to the target concurrency, which are not scheduled.
+        """
+        for target in self.queue.targets():
+            self._register_target(target)
+            for message_id in self.queue.peek_ids(target, self.target_concurrency):
+                if message_id not in self._scheduled:
+                    self._scheduled.add(message_id)
+                    self._push(now, target, message_id)
+
+    def _start_due(self, now: float):
+        """
+        Starts retransmitting the messages whose next attempt time has passed.
+        """
+        while self._heap and self._heap[0][0] <= now:
+            _, _, target, message_id = heapq.heappop(self._heap)
+            breaker = self.get_breaker(target)
+            if breaker.is_open():
+                # the breaker's retry time is on its own clock
+                self._push(now + breaker.retry_in(), target, message_id)
+                continue
+            task = self._loop.create_task(self._attempt(target, message_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        """
+        Retransmits queued messages until the scheduler is closed.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        logger.trace("Starting retransmit scheduler")
+
+        while not self._cancelled:
+            now = self._loop.time()
+            self._schedule_targets(now)
+            self._start_due(now)
+
+            timeout = self.scan_interval
+            if self._heap:
+                timeout = min(max(self._heap[0][0] - now, 0), timeout)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _attempt(self, target: str, message_id: str):
+        """
+        Retransmits a queued message, and schedules its next attempt if the message was not removed from
+        the queue.
+        """
+        message = self.queue.get(message_id)
+        if message is None:
+            self._scheduled.discard(message_id)
+            return
+
+        labels = {"target": get_target_label(target)}
+        registry = get_metrics_registry()
+        registry.counter("retransmit_attempts", **labels).inc()
+        self._in_flight += 1
+        try:
+            removed = await self.retransmit(message)
+        except Exception as ex:
+            logger.error(
+                f"Retransmit scheduler: unable to retransmit {message_id}: {ex}"
+            )
+            removed = False
+        finally:
+            self._in_flight -= 1
+
+        # client error responses fail the message, but show that the target is available
+        if message.get("status") == "SUCCESS" or _is_client_error(message):
+            registry.counter("retransmit_successes", **labels).inc()
+        else:
+            registry.counter("retransmit_failures", **labels).inc()
+
+        now = self._loop.time()
+        if removed:
+            self._scheduled.discard(message_id)
+            self._drained.append(now)
+        else:
+            retransmit_count = message.get("retransmit_count", 1)
+            self._push(now + self._get_backoff(retransmit_count), target, message_id)
+        self._wakeup.set()
+
+    async def close(self, timeout: float = 5.0):
+        """
+        Stops the scheduler, and waits for in flight retransmits. Retransmits which do not complete within
+        the timeout are cancelled, and their messages remain queued.
+
+        :param timeout: the maximum time, in seconds, to wait for in flight retransmits
+        """
+        self._cancelled = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if not self._tasks:
+            return
+
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(
+                f"Retransmit scheduler: cancelling {len(pending)} in flight retransmits"
+            )
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
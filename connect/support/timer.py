@@ -5,11 +5,10 @@ Timer functions for timing LinuxForHealth connect functions.
 """
 import functools
 import inspect
-import json
 import logging
 import time
-from connect.clients import nats
-from connect.support.encoding import ConnectEncoder
+from connect.config import get_settings
+from connect.support.metrics import get_metrics_registry
 
 
 logger = logging.getLogger(__name__)
@@ -17,7 +16,9 @@ logger = logging.getLogger(__name__)
 
 def timer(func):
     """
-    @timer decorator to print the elapsed run time of the decorated function.
+    @timer decorator to record the elapsed run time of the decorated function.
+    Run times are recorded in the in-process metrics registry when connect_timing_enabled is set.
+    Methods of objects with a data_format attribute, such as workflows, are labeled by data_format.
 
     Whether the function you are decorating is sync or async, you need to await
     the function when you use the @timer decorator.
@@ -25,20 +26,22 @@ def timer(func):
 
     @functools.wraps(func)
     async def timer_wrapper(*args, **kwargs):
-        start_time = time.time()
-
-        if inspect.iscoroutinefunction(func):
-            result = await func(*args, **kwargs)
-        else:
-            result = func(*args, **kwargs)
-
-        run_time = time.time() - start_time
-
-        nats_client = await nats.get_nats_client()
-        message = {"function": func.__name__, "elapsed_time": run_time}
-        msg_str = json.dumps(message, cls=ConnectEncoder)
-        await nats_client.publish("TIMING", bytearray(msg_str, "utf-8"))
-
-        return result
+        if not get_settings().connect_timing_enabled:
+            if inspect.iscoroutinefunction(func):
+                return await func(*args, **kwargs)
+            return func(*args, **kwargs)
+
+        start_time = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(func):
+                return await func(*args, **kwargs)
+            return func(*args, **kwargs)
+        finally:
+            run_time = time.perf_counter() - start_time
+            labels = {}
+            data_format = getattr(args[0], "data_format", None) if args else None
+            if data_format:
+                labels["data_format"] = data_format
+            get_metrics_registry().histogram(func.__name__, **labels).observe(run_time)
 
     return timer_wrapper
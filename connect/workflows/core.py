@@ -4,24 +4,34 @@ core.py
 Provides the base LinuxForHealth workflow definition.
 """
 import httpx
-import json
 import logging
 import connect.clients.nats as nats
+import time
 import uuid
 import xworkflows
-from datetime import datetime
+from datetime import datetime, timezone
 from fastapi import Response
-from httpx import AsyncClient
-from connect.clients.kafka import get_kafka_producer, KafkaCallback
-from connect.config import nats_sync_subject, nats_retransmit_subject
-from connect.exceptions import LFHError
-from connect.routes.data import LinuxForHealthDataRecordResponse
+from connect.clients.http import get_http_client_pool, get_transmit_target
+from connect.clients.kafka import (
+    get_kafka_producer,
+    KafkaCallback,
+)
+from connect.config import get_settings, nats_sync_subject, nats_retransmit_subject
+from connect.exceptions import (
+    KafkaProducerQueueFullError,
+    LFHError,
+    TransmitTargetUnavailableError,
+)
+from connect.support.compression import get_payload_compressor
 from connect.support.encoding import (
-    encode_from_dict,
-    encode_from_str,
-    decode_to_str,
-    ConnectEncoder,
+    encode_from_bytes,
+    encode_json,
+    encode_record,
+    decode_json,
 )
+from connect.support.metrics import get_metrics_registry
+from connect.support.record_cache import get_record_cache
+from connect.support.record_keys import get_key_strategy, get_record_key
 from connect.support.timer import timer
 
 
@@ -66,7 +76,14 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
 
     def __init__(self, **kwargs):
         self.message = kwargs["message"]
+        # the original message bytes, stored as-is unless the message is transformed
+        self.raw_message = kwargs.get("raw_message", None)
+        # the stored, and possibly compressed, message bytes and their data encoding
+        self.stored_payload = None
+        self.data_encoding = None
         self.data_format = kwargs.get("data_format", None)
+        # the Kafka message key of the stored record, derived using the key strategy if not provided
+        self.record_key = kwargs.get("record_key", None)
         self.origin_url = kwargs["origin_url"]
         self.start_time = None
         self.use_response = False
@@ -78,6 +95,9 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
         self.uuid = str(uuid.uuid4())
         self.operation = kwargs["operation"]
         self.do_retransmit = kwargs.get("do_retransmit", True)
+        # sync or async. async transmissions are queued for the retransmitter once the message is stored.
+        self.transmit_mode = kwargs.get("transmit_mode", "sync")
+        self.transmit_queued = False
 
     state = CoreWorkflowDef()
 
@@ -94,7 +114,8 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
     def transform(self):
         """
         Override to transform from one form or protocol to another (e.g. HL7v2 to FHIR
-        or FHIR R3 to R4).
+        or FHIR R3 to R4). Implementations which modify self.message must set self.raw_message
+        to None so that the transformed message is stored.
         """
         pass
 
@@ -107,45 +128,87 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
 
         Input:
         self.message: The object to be stored in Kafka
+        self.raw_message: The original message bytes, stored in place of self.message if provided
         self.origin_url: The originating endpoint url
         self.data_format: The data_format of the data being stored
         self.start_time: The transaction start time
+        self.record_key: The message key of the stored record, if provided
 
         Output:
         self.message: The python dict for LinuxForHealthDataRecordResponse instance with
             the original object instance in the data field as a byte string
+        self.raw_message: The message bytes
+        self.stored_payload: The stored message bytes, compressed per the payload compression settings
+        self.data_encoding: The stored message compression codec, or None
+        self.record_key: The message key of the stored record, per the data format's key strategy
+
+        Records larger than KAFKA_MESSAGE_CHUNK_SIZE are stored as segments, located at the first stored segment.
         """
 
         logger.trace(
             f"{self.__class__.__name__}: incoming message type = {type(self.message)}",
         )
+        # the key is derived from the parsed message, before it is replaced by the stored record
+        if self.record_key is None:
+            self.record_key = get_record_key(
+                get_key_strategy(self.data_format), self.uuid, self.message
+            )
 
-        if hasattr(self.message, "dict"):
-            encoded_data = encode_from_dict(self.message.dict())
+        if self.raw_message is not None:
+            payload = self.raw_message
+        elif hasattr(self.message, "dict"):
+            payload = encode_json(self.message.dict())
         elif isinstance(self.message, dict):
-            encoded_data = encode_from_dict(self.message)
+            payload = encode_json(self.message)
         else:
-            encoded_data = encode_from_str(self.message)
+            payload = bytes(self.message, "utf-8")
+        encoded_data = encode_from_bytes(payload)
+        self.stored_payload, self.data_encoding = get_payload_compressor().compress(
+            payload, self.data_format
+        )
 
+        # dates are formatted as LinuxForHealthDataRecordResponse.json() formats them
+        record_date = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
         message = {
             "uuid": self.uuid,
             "lfh_id": self.lfh_id,
-            "creation_date": str(datetime.utcnow().replace(microsecond=0)) + "Z",
-            "store_date": str(datetime.utcnow().replace(microsecond=0)) + "Z",
+            "operation": self.operation,
+            "creation_date": record_date,
+            "store_date": record_date,
             "consuming_endpoint_url": self.origin_url,
-            "data_format": self.data_format,
             "data": encoded_data,
+            "data_format": self.data_format,
+            "data_encoding": None,
+            "status": None,
+            "data_record_location": None,
             "target_endpoint_url": self.transmit_server,
-            "operation": self.operation,
+            "elapsed_storage_time": None,
+            "transmit_date": None,
+            "elapsed_transmit_time": None,
+            "elapsed_total_time": None,
         }
-        response = LinuxForHealthDataRecordResponse(**message)
+        # the record is encoded once, directly to bytes, rather than via a response model
+        self.message = message
+        record = self._encode_record()
 
-        kafka_producer = get_kafka_producer()
+        settings = get_settings()
         kafka_cb = KafkaCallback()
         storage_start = datetime.now()
-        await kafka_producer.produce_with_callback(
-            self.data_format, response.json(), on_delivery=kafka_cb.get_kafka_result
-        )
+        if len(record) > settings.kafka_message_chunk_size:
+            # large records are stored as segments
+            await get_kafka_producer().produce_segments(
+                self.data_format,
+                record,
+                on_delivery=kafka_cb.get_kafka_result,
+                key=self.record_key,
+            )
+        else:
+            await get_kafka_producer().produce_with_callback(
+                self.data_format,
+                record,
+                on_delivery=kafka_cb.get_kafka_result,
+                key=self.record_key,
+            )
 
         storage_delta = datetime.now() - storage_start
         logger.trace(
@@ -156,9 +219,24 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
         message["elapsed_total_time"] = total_time.total_seconds()
         message["data_record_location"] = kafka_cb.kafka_result
         message["status"] = kafka_cb.kafka_status
+        self.raw_message = payload
+        if kafka_cb.kafka_result:
+            # write through, as the stored record is commonly read back after it is stored
+            get_record_cache().put(kafka_cb.kafka_result, record)
+
+    def _encode_record(self) -> bytes:
+        """
+        Encodes self.message, with the stored message bytes, using the configured record format.
 
-        response = LinuxForHealthDataRecordResponse(**message).dict()
-        self.message = response
+        :return: the encoded record
+        """
+        message = self.message
+        record_format = get_settings().connect_record_format
+        if self.data_encoding:
+            message = {**message, "data_encoding": self.data_encoding}
+            if record_format == "json":
+                message["data"] = encode_from_bytes(self.stored_payload)
+        return encode_record(message, self.stored_payload, record_format)
 
     @xworkflows.transition("do_transmit")
     @timer
@@ -167,9 +245,16 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
         Transmit the message to an external service via HTTP,
         if self.transmit_server is defined by the workflow.
 
+        Requests time out using the target's adaptive timeout. Timeouts, connection errors and requests
+        deferred by the target's open circuit breaker are sent for retransmission.
+
+        In async transmit mode, the message is queued for transmission by the retransmitter, and the
+        response status is 202 (Accepted). If the message cannot be durably queued, the message is transmitted.
+
         Input:
         self.message: The python dict for a LinuxForHealthDataRecordResponse instance
             containing the data to be transmitted
+        self.raw_message: The stored message bytes, sent to the external server
         response: The FastAPI Response object
         self.verify_certs: Whether to verify certs, True/False, set at the application level in config.py
         self.transmit_server: The url of external server to transmit the data to
@@ -178,34 +263,74 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
         The updated Response object
         """
         if self.transmit_server and response:
-            resource_str = decode_to_str(self.message["data"])
-            resource = json.loads(resource_str)
-
             transmit_start = datetime.now()
+            if self.transmit_mode == "async" and await self._queue_transmit(
+                transmit_start
+            ):
+                self.transmit_queued = True
+                response.status_code = 202
+                response.headers["LinuxForHealth-MessageId"] = str(self.message["uuid"])
+                return
+
             self.message["transmit_date"] = (
                 str(transmit_start.replace(microsecond=0)) + "Z"
             )
+            # requests are deferred to the retransmit path while the target is failing
+            target = get_transmit_target(self.transmit_server)
             try:
-                async with AsyncClient(verify=self.verify_certs) as client:
-                    result = await client.post(self.transmit_server, json=resource)
+                if not target.allow_request():
+                    raise TransmitTargetUnavailableError(target.origin)
+
+                client = get_http_client_pool()
+                request_start = time.perf_counter()
+                try:
+                    result = await client.post(
+                        self.transmit_server,
+                        verify=self.verify_certs,
+                        content=self.raw_message,
+                        headers={"Content-Type": "application/json"},
+                        timeout=target.get_timeout(),
+                    )
+                except BaseException:
+                    # including cancellation, so that a half open breaker's probe is not left outstanding
+                    target.record_failure()
+                    raise
+                target.record_response(
+                    result.status_code, time.perf_counter() - request_start
+                )
             except Exception as ex:
-                if isinstance(ex, httpx.ConnectTimeout) or isinstance(
-                    ex, httpx.ConnectError
+                if isinstance(
+                    ex,
+                    (
+                        httpx.TimeoutException,
+                        httpx.ConnectError,
+                        TransmitTargetUnavailableError,
+                    ),
                 ):
                     if self.do_retransmit:
-                        # send retransmit message to to Kafka to record
+                        # send retransmit message to to Kafka to record, keyed by record so that
+                        # the retransmit outcome is stored after the retransmit message
                         kafka_producer = get_kafka_producer()
-                        await kafka_producer.produce(
-                            "RETRANSMIT", json.dumps(self.message, cls=ConnectEncoder)
-                        )
+                        try:
+                            await kafka_producer.produce(
+                                "RETRANSMIT",
+                                encode_json(self.message),
+                                key=self.uuid.encode(),
+                            )
+                        except KafkaProducerQueueFullError as queue_full:
+                            # the record is stored, and is still retransmitted
+                            logger.warning(
+                                f"{self.__class__.__name__} transmit: unable to store retransmit message "
+                                + f"{self.uuid}: {queue_full}"
+                            )
 
                         # publish retransmit message to NATS
                         self.message["status"] = "ERROR"
                         self.message["transmit_start"] = transmit_start
-                        nats_client = await nats.get_nats_client()
-                        msg_str = json.dumps(self.message, cls=ConnectEncoder)
-                        await nats_client.publish(
-                            nats_retransmit_subject, bytearray(msg_str, "utf-8")
+                        await nats.publish(
+                            nats_retransmit_subject,
+                            encode_json(self.message),
+                            self.data_format,
                         )
 
                 transmit_delta = datetime.now() - transmit_start
@@ -229,16 +354,48 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
 
             self.use_response = True
 
+    async def _queue_transmit(self, transmit_start: datetime) -> bool:
+        """
+        Queues the message for asynchronous transmission.
+
+        :param transmit_start: the transmission start time
+        :return: False if the message could not be queued, as the retransmit queue is full or is not durable
+        """
+        message = {
+            **self.message,
+            "status": "QUEUED",
+            "target_endpoint_url": self.transmit_server,
+            "transmit_start": transmit_start.isoformat(timespec="microseconds"),
+        }
+        if await nats.queue_transmit(message):
+            return True
+        logger.warning(
+            f"{self.__class__.__name__}: unable to queue {self.uuid} for async transmission, transmitting"
+        )
+        return False
+
     @xworkflows.transition("do_sync")
     @timer
     async def synchronize(self):
         """
         Send the message to NATS subscribers for synchronization across LFH instances.
+        The message is encoded using the configured record format.
+
+        Records larger than KAFKA_MESSAGE_CHUNK_SIZE, which are stored as segments, exceed the NATS
+        maximum payload and are not synchronized.
         """
         if self.do_sync:
-            nats_client = await nats.get_nats_client()
-            msg_str = json.dumps(self.message, cls=ConnectEncoder)
-            await nats_client.publish(nats_sync_subject, bytearray(msg_str, "utf-8"))
+            record = self._encode_record()
+            if len(record) > get_settings().kafka_message_chunk_size:
+                logger.warning(
+                    f"{self.__class__.__name__}: record {self.uuid} of {len(record)} bytes "
+                    + "exceeds the message chunk size, and is not synchronized"
+                )
+                get_metrics_registry().counter(
+                    "nats_sync_skipped", data_format=self.data_format
+                ).inc()
+                return
+            await nats.publish(nats_sync_subject, record, self.data_format)
 
     @xworkflows.transition("handle_error")
     @timer
@@ -254,8 +411,7 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
         :return: The json string for the error message stored in Kafka
         """
         logger.trace(f"{self.__class__.__name__} error: incoming error = {error}")
-        data_str = json.dumps(self.message, cls=ConnectEncoder)
-        data = json.loads(data_str)
+        data = decode_json(encode_json(self.message))
 
         message = {
             "uuid": uuid.uuid4(),
@@ -271,6 +427,7 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
             self.lfh_exception_topic,
             error.json(),
             on_delivery=kafka_cb.get_kafka_result,
+            key=self.record_key,
         )
         # trace log
         logger.trace(
@@ -280,6 +437,59 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
         error = LFHError(**message).json()
         return error
 
+    @timer
+    async def store(self):
+        """
+        Validate, transform and persist the message ahead of run(), so that a group of workflows, such as
+        the entries of a FHIR transaction bundle, are stored before any is transmitted. run() then transmits
+        and synchronizes the stored message.
+
+        :raise: KafkaProducerQueueFullError if the record is not stored as the Kafka producer queue is full,
+            or an Exception containing the stored error record
+        """
+        self.start_time = datetime.utcnow()
+
+        try:
+            logger.trace(f"Storing {self.__class__.__name__}")
+            await self._store()
+        except KafkaProducerQueueFullError:
+            # the record was not stored, so the request is rejected and may be retried
+            raise
+        except Exception as ex:
+            await self._raise_error(ex, persisted=False)
+
+    async def _store(self):
+        """
+        Validates, if not validated ahead of time, transforms and persists the message.
+        """
+        # workflows may be validated ahead of time, e.g. FHIR transaction bundles
+        if self.state.name == "parse":
+            await self.validate()
+        await self.transform()
+        await self.persist()
+
+    async def _raise_error(self, ex: Exception, persisted: bool):
+        """
+        Stores the error record for a failed workflow and raises an Exception containing it.
+
+        :param ex: The workflow error
+        :param persisted: True if the message was stored before the error occurred
+        :raise: KafkaProducerQueueFullError if the error record cannot be stored and the message was not
+            stored, otherwise an Exception containing the error record, or the original error if the
+            error record cannot be stored
+        """
+        try:
+            msg = await self.error(ex)
+        except KafkaProducerQueueFullError as queue_full:
+            if not persisted:
+                raise
+            # the record is stored, so the request fails with its original error
+            logger.error(
+                f"{self.__class__.__name__} run: unable to store error record: {queue_full}"
+            )
+            msg = str(ex)
+        raise Exception(msg)
+
     @timer
     async def run(self, response: Response):
         """
@@ -288,17 +498,22 @@ class CoreWorkflow(xworkflows.WorkflowEnabled):
 
         :return: the response instance, with updated body and status_code
         """
-        self.start_time = datetime.utcnow()
+        # workflows may be stored ahead of time, e.g. FHIR transaction bundles
+        persisted = self.state.name == "persist"
+        if not persisted:
+            self.start_time = datetime.utcnow()
 
         try:
             # trace log
             logger.trace(f"Running {self.__class__.__name__}")
-            await self.validate()
-            await self.transform()
-            await self.persist()
+            if not persisted:
+                await self._store()
+                persisted = True
             await self.transmit(response)
             await self.synchronize()
             return self.message
+        except KafkaProducerQueueFullError:
+            # the record was not stored, so the request is rejected and may be retried
+            raise
         except Exception as ex:
-            msg = await self.error(ex)
-            raise Exception(msg)
+            await self._raise_error(ex, persisted)
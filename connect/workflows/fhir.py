@@ -4,14 +4,48 @@ fhir.py
 Customizes the base LinuxForHealth workflow definition for FHIR resources.
 """
 import logging
+import random
 import xworkflows
-from fhir.resources import construct_fhir_element
+from connect.config import get_settings
 from connect.exceptions import FhirValidationError, MissingFhirResourceType
+from connect.support.fhir_resources import (
+    construct_fhir_resource,
+    validate_fhir_structure,
+)
+from connect.support.metrics import get_metrics_registry
 from connect.support.timer import timer
 from connect.workflows.core import CoreWorkflow
 
 
 logger = logging.getLogger(__name__)
+# resource types which have received full validation, used by the sampled validation mode
+full_validation_resource_types = set()
+
+
+def get_validation_level(resource_type: str) -> tuple:
+    """
+    Determines the validation applied to a FHIR resource using the configured validation mode.
+    The sampled mode applies full validation to the first resource of each type, and to the configured
+    percentage of subsequent resources. Other resources receive structural validation.
+
+    :param resource_type: The FHIR resource type
+    :return: tuple of the configured validation mode and the validation level, "full" or "structural"
+    """
+    settings = get_settings()
+    mode = settings.fhir_validation_mode_overrides.get(
+        resource_type, settings.fhir_validation_mode
+    )
+
+    if mode != "sampled":
+        return mode, mode
+
+    if resource_type not in full_validation_resource_types:
+        full_validation_resource_types.add(resource_type)
+        return mode, "full"
+
+    if random.random() * 100 < settings.fhir_validation_sample_percent:
+        return mode, "full"
+    return mode, "structural"
 
 
 class FhirWorkflow(CoreWorkflow):
@@ -25,9 +59,15 @@ class FhirWorkflow(CoreWorkflow):
         """
         Overridden to validate the incoming FHIR message by instantiating a fhir.resources
         class from the input data dictionary.  Adapted from fhir.resources fhirtypesvalidators.py
+        Resource classes are resolved using the cached lookup in connect.support.fhir_resources.
+
+        When structural validation is applied, per FHIR_VALIDATION_MODE, the input data is checked
+        against precomputed structural rules and is not instantiated.
 
         input: self.message as a dict for FHIR-R4 json (e.g. Patient resource type)
-        output: self.message as an instantiated and validated fhir.resources resource class.
+        output: self.message as an instantiated and validated fhir.resources resource class,
+            or the input dict if structural validation is applied.
+            self.raw_message is cleared once full validation is applied.
         raises: MissingFhirResourceType, FhirValidationTypeError
         """
         resource_type = self.message.get("resourceType")
@@ -35,9 +75,25 @@ class FhirWorkflow(CoreWorkflow):
         if resource_type is None:
             raise MissingFhirResourceType()
 
+        mode, level = get_validation_level(resource_type)
+        result = "invalid"
         try:
-            self.message = construct_fhir_element(resource_type, self.message)
+            if level == "structural":
+                validate_fhir_structure(resource_type, self.message)
+            else:
+                self.message = construct_fhir_resource(resource_type, self.message)
+                # validation may coerce values, so the validated resource is stored rather than the request bytes
+                self.raw_message = None
             self.data_format = f"FHIR-R4_{resource_type.upper()}"
+            result = "valid"
         except LookupError as le:
             logging.exception(le)
             raise FhirValidationError(str(le))
+        except ValueError as ve:
+            if level == "full":
+                raise
+            raise FhirValidationError(str(ve))
+        finally:
+            get_metrics_registry().counter(
+                "fhir_validations", mode=mode, level=level, result=result
+            ).inc()
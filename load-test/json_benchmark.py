@@ -0,0 +1,82 @@
+"""
+json_benchmark.py
+
+Compares the serialization throughput of the LinuxForHealth connect JSON backends using the FHIR resources
+in load-test/messages. Each resource is decoded and re-encoded, and wrapped in a LinuxForHealth data record
+as persist does, to approximate the JSON work performed for each request.
+
+Usage:
+    cd connect/load-test
+    python json_benchmark.py
+    ITERATIONS=5000 python json_benchmark.py
+"""
+import datetime
+import glob
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connect.support.encoding import _create_json_backend, encode_from_bytes
+
+
+backend_names = ("json", "orjson", "msgspec", "ujson")
+iterations = int(os.getenv("ITERATIONS", 2000))
+
+
+def load_messages() -> list:
+    """
+    :return: the bytes of each message file in load-test/messages
+    """
+    message_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "messages")
+    messages = []
+    for file_name in sorted(glob.glob(os.path.join(message_dir, "*.json"))):
+        with open(file_name, "rb") as f:
+            messages.append(f.read())
+    return messages
+
+
+def run_benchmark(backend, messages: list) -> float:
+    """
+    Decodes, encodes and wraps each message in a data record for the configured number of iterations.
+
+    :param backend: the JsonBackend to benchmark
+    :param messages: the message bytes
+    :return: the number of messages processed per second
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in messages:
+            resource = backend.loads(message)
+            record = {
+                "uuid": uuid.uuid4(),
+                "creation_date": datetime.datetime.utcnow(),
+                "data_format": resource["resourceType"],
+                "data": encode_from_bytes(backend.dumps(resource)),
+            }
+            backend.loads(backend.dumps(record))
+    elapsed = time.perf_counter() - start
+    return iterations * len(messages) / elapsed
+
+
+def main():
+    messages = load_messages()
+    print(f"Benchmarking {len(messages)} messages, {iterations} iterations")
+
+    baseline = None
+    for name in backend_names:
+        try:
+            backend = _create_json_backend(name)
+        except ImportError:
+            print(f"{name:>8}: not installed")
+            continue
+
+        rate = run_benchmark(backend, messages)
+        baseline = baseline or rate
+        print(f"{name:>8}: {rate:10.0f} messages/sec ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
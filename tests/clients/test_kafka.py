@@ -0,0 +1,862 @@
+"""
+test_kafka.py
+
+Tests the Kafka client wrappers defined in connect.clients.kafka
+"""
+import asyncio
+import pytest
+import time
+from typing import Callable
+from unittest.mock import Mock
+from confluent_kafka import KafkaException, TopicPartition
+from connect.clients import kafka
+from connect.clients.kafka import (
+    ConfluentAsyncKafkaConsumer,
+    ConfluentAsyncKafkaListener,
+    ConfluentAsyncKafkaProducer,
+    KafkaCallback,
+    KafkaConsumerPool,
+    KafkaTopicStream,
+)
+from connect.support.kafka_segments import get_segment_headers, segment_message
+from connect.support.metrics import MetricsRegistry
+from connect.support.record_cache import RecordCache
+
+
+@pytest.fixture
+def mock_confluent_producer():
+    """
+    A fake confluent_kafka.Producer which acknowledges records when polled.
+    Records produced to the topic "FAIL" are acknowledged with an error. BufferError is raised when
+    queue.buffering.max.messages records are pending.
+    """
+
+    class MockMessage:
+        def __init__(self, topic, offset, key, value=None, headers=None):
+            self._topic = topic
+            self._offset = offset
+            self._key = key
+            self._value = value
+            self._headers = headers
+
+        def topic(self):
+            return self._topic
+
+        def partition(self):
+            return 0
+
+        def offset(self):
+            return self._offset
+
+        def key(self):
+            return self._key
+
+        def value(self):
+            return self._value
+
+        def headers(self):
+            return self._headers
+
+    class MockProducer:
+        def __init__(self, configs):
+            self.pending = []
+            self.produced = []
+            self.offset = 0
+            self.capacity = configs.get("queue.buffering.max.messages", 100000)
+
+        def __len__(self):
+            return len(self.pending)
+
+        def produce(self, topic, value, key=None, headers=None, on_delivery=None):
+            if len(self.pending) >= self.capacity:
+                raise BufferError("Local: Queue full")
+            msg = MockMessage(topic, self.offset, key, value, headers)
+            self.pending.append((msg, on_delivery))
+            self.produced.append(msg)
+            self.offset += 1
+
+        def poll(self, timeout):
+            pending, self.pending = self.pending, []
+            for msg, on_delivery in pending:
+                err = "delivery failed" if msg.topic() == "FAIL" else None
+                on_delivery(err, msg)
+
+    return MockProducer
+
+
+@pytest.mark.asyncio
+async def test_produce_delivery_dispatch(mock_confluent_producer, monkeypatch):
+    """
+    Tests that the delivery reports received during a poll are handed to the event loop together.
+    """
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Producer", mock_confluent_producer)
+        producer = ConfluentAsyncKafkaProducer({})
+        # stop the poll thread so that the poll can be run manually
+        producer.close()
+
+        loop = asyncio.get_running_loop()
+        call_soon_threadsafe = Mock(wraps=loop.call_soon_threadsafe)
+        m.setattr(loop, "call_soon_threadsafe", call_soon_threadsafe)
+
+        futures = [producer.produce("TOPIC", str(i)) for i in range(5)]
+        producer._producer.poll(0)
+        producer._dispatch_deliveries()
+        results = await asyncio.gather(*futures)
+
+    assert [msg.offset() for msg in results] == [0, 1, 2, 3, 4]
+    assert call_soon_threadsafe.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_produce_delivery_callback_error(mock_confluent_producer, monkeypatch):
+    """
+    Tests that a delivery callback error does not prevent the other deliveries in the poll from resolving.
+    """
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Producer", mock_confluent_producer)
+        producer = ConfluentAsyncKafkaProducer({})
+        producer.close()
+
+        failed_cb = KafkaCallback()
+        stored_cb = KafkaCallback()
+        failed = producer.produce_with_callback(
+            "FAIL", "a", on_delivery=failed_cb.get_kafka_result
+        )
+        stored = producer.produce_with_callback(
+            "TOPIC", "b", on_delivery=stored_cb.get_kafka_result
+        )
+        producer._capacity_available.clear()
+        producer._producer.poll(0)
+        producer._dispatch_deliveries()
+
+        with pytest.raises(KafkaException):
+            await asyncio.wait_for(failed, timeout=1.0)
+        assert (await asyncio.wait_for(stored, timeout=1.0)).offset() == 1
+        assert stored_cb.kafka_result == "TOPIC:0:1"
+        assert producer._capacity_available.is_set()
+
+
+@pytest.mark.asyncio
+async def test_produce_queue_full(mock_confluent_producer, monkeypatch):
+    """
+    Tests that a record produced while the producer queue is full is produced once capacity is
+    available, and fails with KafkaProducerQueueFullError if the queue full timeout expires.
+    """
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Producer", mock_confluent_producer)
+        producer = ConfluentAsyncKafkaProducer(
+            {"queue.buffering.max.messages": 1},
+            queue_full_timeout=1.0,
+            saturation_ratio=1.0,
+        )
+        producer.close()
+
+        first = producer.produce("TOPIC", "a")
+        assert producer.is_saturated()
+        second = producer.produce("TOPIC", "b")
+        await asyncio.sleep(0)
+
+        producer._producer.poll(0)
+        producer._dispatch_deliveries()
+        assert (await first).offset() == 0
+        # the waiting record is produced once the delivery reports free queue capacity
+        while not producer._producer.pending:
+            await asyncio.sleep(0)
+
+        producer._producer.poll(0)
+        producer._dispatch_deliveries()
+        assert (await second).offset() == 1
+
+        producer.produce("TOPIC", "c")
+        with pytest.raises(kafka.KafkaProducerQueueFullError):
+            await producer.produce("TOPIC", "d")
+
+
+def test_get_kafka_producer_config(settings, monkeypatch):
+    """
+    Tests that Kafka producer configuration settings are passed through to the producer.
+    """
+    settings.kafka_producer_config = {"linger.ms": 5, "acks": "1"}
+    mock_producer = Mock()
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "get_settings", lambda: settings)
+        m.setattr(kafka, "kafka_producer", None)
+        m.setattr(kafka, "get_running_loop", Mock())
+        m.setattr(kafka, "ConfluentAsyncKafkaProducer", mock_producer)
+        kafka.get_kafka_producer()
+
+    configs = mock_producer.call_args.kwargs["configs"]
+    assert configs["linger.ms"] == 5
+    assert configs["acks"] == "1"
+    assert configs["compression.type"] == "none"
+    assert "batch.num.messages" not in configs
+
+
+def test_get_kafka_producer_batch_config(settings, monkeypatch):
+    """
+    Tests that the batch settings configure the producer's linger.ms and batch.num.messages, unless
+    they are set in the Kafka producer configuration.
+    """
+    settings.kafka_producer_batch_enabled = True
+    settings.kafka_producer_batch_max_size = 50
+    settings.kafka_producer_batch_max_linger_secs = 0.01
+    settings.kafka_producer_config = {"batch.num.messages": 200}
+    mock_producer = Mock()
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "get_settings", lambda: settings)
+        m.setattr(kafka, "kafka_producer", None)
+        m.setattr(kafka, "get_running_loop", Mock())
+        m.setattr(kafka, "ConfluentAsyncKafkaProducer", mock_producer)
+        kafka.get_kafka_producer()
+
+    configs = mock_producer.call_args.kwargs["configs"]
+    assert configs["linger.ms"] == 10
+    assert configs["batch.num.messages"] == 200
+
+
+@pytest.fixture
+def mock_confluent_consumer():
+    """
+    A fake confluent_kafka.Consumer which returns the offset of the assigned partition as the message value.
+    Polling the topic "FAIL" times out. Partitions contain offsets 0 through 9, or the (value, headers)
+    messages in MockConsumer.messages, if set.
+    """
+
+    class MockMessage:
+        def __init__(self, value, offset=0, headers=None):
+            self._value = value
+            self._offset = offset
+            self._headers = headers
+
+        def error(self):
+            return None
+
+        def headers(self):
+            return self._headers
+
+        def offset(self):
+            return self._offset
+
+        def value(self):
+            return self._value
+
+    class MockConsumer:
+        messages = None
+
+        def __init__(self, configs):
+            self.assignment = None
+            self.closed = False
+
+        def assign(self, partitions):
+            self.assignment = partitions[0]
+
+        def unassign(self):
+            self.assignment = None
+
+        def _message(self, offset):
+            if self.messages is None:
+                return MockMessage(str(offset).encode(), offset)
+            return MockMessage(
+                *self.messages[offset][:1], offset, self.messages[offset][1]
+            )
+
+        def _high(self):
+            return 10 if self.messages is None else len(self.messages)
+
+        def poll(self, timeout):
+            if self.assignment.topic == "FAIL":
+                return None
+            msg = self._message(self.assignment.offset)
+            self.assignment.offset += 1
+            return msg
+
+        def get_watermark_offsets(self, partition, timeout=None):
+            return 0, self._high()
+
+        def consume(self, num_messages=1, timeout=-1):
+            start = self.assignment.offset
+            self.assignment.offset = min(start + num_messages, self._high())
+            return [
+                self._message(offset) for offset in range(start, self.assignment.offset)
+            ]
+
+        def close(self):
+            self.closed = True
+
+    return MockConsumer
+
+
+@pytest.mark.asyncio
+async def test_produce_segments(
+    mock_confluent_producer, mock_confluent_consumer, monkeypatch
+):
+    """
+    Tests that a record produced as segments is located at its first segment, and is reassembled when
+    read by offset or by range.
+    """
+    record = b"0123456789"
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Producer", mock_confluent_producer)
+        producer = ConfluentAsyncKafkaProducer({})
+        try:
+            first = await producer.produce_segments(
+                "TOPIC", record, key=b"Patient/001", chunk_size=4
+            )
+        finally:
+            producer.close()
+
+    segments = producer._producer.produced
+    assert first.offset() == 0
+    assert [bytes(msg.value()) for msg in segments] == [b"0123", b"4567", b"89"]
+    assert all(msg.key() == b"Patient/001" for msg in segments)
+
+    # segments are interleaved with other records, and a duplicate segment is ignored
+    messages = [(bytes(msg.value()), msg.headers()) for msg in segments]
+    mock_confluent_consumer.messages = [
+        (b"before", None),
+        messages[0],
+        (b"other", None),
+        messages[1],
+        messages[1],
+        messages[2],
+        (b"after", None),
+    ]
+
+    async def callback(message):
+        return message
+
+    async def range_callback(messages):
+        return [(location, bytes(message)) for location, message in messages]
+
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_confluent_consumer)
+        m.setattr(kafka, "get_record_cache", lambda: RecordCache(0))
+        m.setattr(
+            kafka, "get_settings", lambda: Mock(kafka_consumer_consume_batch_size=2)
+        )
+
+        consumer = ConfluentAsyncKafkaConsumer("TOPIC", 0, {}, 1)
+        assert await consumer.get_message_from_kafka_cb(callback) == record
+
+        # a location of a segment other than the first is not a record location
+        consumer = ConfluentAsyncKafkaConsumer("TOPIC", 0, {}, 3)
+        with pytest.raises(kafka.KafkaMessageNotFoundError):
+            await consumer.get_message_from_kafka_cb(callback)
+
+        # records which start within the range are read in full
+        consumer = ConfluentAsyncKafkaConsumer("TOPIC", 0, {}, 0)
+        results = [
+            result
+            async for batch in consumer.get_messages_from_kafka_cb(2, range_callback)
+            for result in batch
+        ]
+        assert results == [
+            ("TOPIC:0:0", b"before"),
+            ("TOPIC:0:2", b"other"),
+            ("TOPIC:0:1", record),
+        ]
+
+        # records which start before the range are not read
+        consumer = ConfluentAsyncKafkaConsumer("TOPIC", 0, {}, 2)
+        results = [
+            result
+            async for batch in consumer.get_messages_from_kafka_cb(6, range_callback)
+            for result in batch
+        ]
+        assert results == [("TOPIC:0:2", b"other"), ("TOPIC:0:6", b"after")]
+
+
+@pytest.mark.asyncio
+async def test_consumer_pool(mock_confluent_consumer, monkeypatch):
+    """
+    Tests that pooled consumers are reused across reads, and that consumers which fail a read are discarded.
+    """
+
+    async def callback(message):
+        return message
+
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_confluent_consumer)
+        m.setattr(kafka, "get_record_cache", lambda: RecordCache(0))
+        pool = KafkaConsumerPool({}, max_size=2, min_size=1)
+        pool.warm()
+        assert pool.size() == 1
+
+        results = await asyncio.gather(
+            *[
+                ConfluentAsyncKafkaConsumer(
+                    "TOPIC", 0, {}, offset, pool=pool
+                ).get_message_from_kafka_cb(callback)
+                for offset in range(4)
+            ]
+        )
+        assert results == [b"0", b"1", b"2", b"3"]
+        assert pool.size() == 2
+        assert pool.idle_count() == 2
+        assert all(consumer.assignment is None for consumer, _ in pool._idle)
+
+        with pytest.raises(KafkaException):
+            await ConfluentAsyncKafkaConsumer(
+                "FAIL", 0, {}, 0, pool=pool
+            ).get_message_from_kafka_cb(callback)
+        assert pool.size() == 1
+
+
+@pytest.mark.asyncio
+async def test_consumer_pool_idle_eviction(mock_confluent_consumer, monkeypatch):
+    """
+    Tests that consumers idle for longer than the idle timeout are closed, down to the minimum size.
+    """
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_confluent_consumer)
+        pool = KafkaConsumerPool({}, max_size=3, min_size=1, idle_timeout=-1)
+        consumers = [await pool.acquire() for _ in range(3)]
+        for consumer in consumers:
+            pool.release(consumer)
+
+        assert pool.size() == 1
+        assert [consumer.closed for consumer in consumers] == [True, True, False]
+
+
+@pytest.mark.asyncio
+async def test_consumer_record_cache(mock_confluent_consumer, monkeypatch):
+    """
+    Tests that records read from a specific offset are cached, and that cached records are read without polling.
+    """
+
+    async def callback(message):
+        return message
+
+    cache = RecordCache(1024)
+    cache.put("TOPIC:0:1", b"cached")
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_confluent_consumer)
+        m.setattr(kafka, "get_record_cache", lambda: cache)
+        pool = KafkaConsumerPool({}, max_size=1)
+
+        consumer = ConfluentAsyncKafkaConsumer("TOPIC", 0, {}, 0, pool=pool)
+        assert await consumer.get_message_from_kafka_cb(callback) == b"0"
+        assert cache.get("TOPIC:0:0") == b"0"
+
+        consumer = ConfluentAsyncKafkaConsumer("TOPIC", 0, {}, 1, pool=pool)
+        assert await consumer.get_message_from_kafka_cb(callback) == b"cached"
+        assert pool.size() == 1
+
+
+@pytest.mark.asyncio
+async def test_consumer_range(mock_confluent_consumer, settings, monkeypatch):
+    """
+    Tests that a range of messages is read in batches, limited to the messages available in the partition.
+    """
+
+    async def callback(messages):
+        return messages
+
+    settings.kafka_consumer_consume_batch_size = 4
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_confluent_consumer)
+        m.setattr(kafka, "get_settings", lambda: settings)
+        pool = KafkaConsumerPool({}, max_size=1)
+
+        consumer = ConfluentAsyncKafkaConsumer("TOPIC", 0, {}, 3, pool=pool)
+        batches = [
+            batch async for batch in consumer.get_messages_from_kafka_cb(20, callback)
+        ]
+        assert [len(batch) for batch in batches] == [4, 3]
+        assert batches[0][0] == ("TOPIC:0:3", b"3")
+        assert batches[1][-1] == ("TOPIC:0:9", b"9")
+
+        consumer = ConfluentAsyncKafkaConsumer("TOPIC", 0, {}, 10, pool=pool)
+        with pytest.raises(kafka.KafkaMessageNotFoundError):
+            async for _ in consumer.get_messages_from_kafka_cb(20, callback):
+                pass
+        assert pool.size() == 1
+
+
+@pytest.fixture
+def mock_listener_consumer():
+    """
+    A fake confluent_kafka.Consumer for listener tests. Each topic partition contains offsets 0 through 9.
+    Messages are consumed from the assigned partitions in turn. Committed offsets are shared by consumer
+    instances, so that a recreated consumer resumes from the committed offsets.
+    """
+
+    class MockMessage:
+        def __init__(self, topic, partition, offset):
+            self._topic = topic
+            self._partition = partition
+            self._offset = offset
+
+        def error(self):
+            return None
+
+        def topic(self):
+            return self._topic
+
+        def partition(self):
+            return self._partition
+
+        def offset(self):
+            return self._offset
+
+        def value(self):
+            return str(self._offset).encode()
+
+        def headers(self):
+            return None
+
+    class MockConsumer:
+        partition_count = 1
+        committed = {}
+        instances = []
+
+        def __init__(self, configs):
+            self.topic = None
+            self.positions = {}
+            self.paused = False
+            self.closed = False
+            self.on_assign = None
+            self.on_revoke = None
+            self.revoke = []
+            MockConsumer.instances.append(self)
+
+        def subscribe(self, topics, on_assign=None, on_revoke=None):
+            self.topic = topics[0]
+            self.on_assign = on_assign
+            self.on_revoke = on_revoke
+
+        def assign(self, partitions):
+            self.topic = partitions[0].topic
+            for p in partitions:
+                self.positions[p.partition] = max(p.offset, 0)
+
+        def assignment(self):
+            return [TopicPartition(self.topic, p) for p in self.positions]
+
+        def pause(self, partitions):
+            self.paused = True
+
+        def resume(self, partitions):
+            self.paused = False
+
+        def get_watermark_offsets(self, partition, timeout=None, cached=False):
+            return 0, 10
+
+        def consume(self, num_messages=1, timeout=-1):
+            if self.on_assign:
+                partitions = [
+                    TopicPartition(self.topic, p)
+                    for p in range(MockConsumer.partition_count)
+                ]
+                self.on_assign(self, partitions)
+                self.on_assign = None
+                for p in range(MockConsumer.partition_count):
+                    self.positions[p] = MockConsumer.committed.get((self.topic, p), 0)
+            if self.revoke:
+                self.on_revoke(
+                    self, [TopicPartition(self.topic, p) for p in self.revoke]
+                )
+                for p in self.revoke:
+                    del self.positions[p]
+                self.revoke = []
+
+            msgs = []
+            while not self.paused and len(msgs) < num_messages:
+                available = [p for p, o in self.positions.items() if o < 10]
+                if not available:
+                    break
+                for p in available[: num_messages - len(msgs)]:
+                    msgs.append(MockMessage(self.topic, p, self.positions[p]))
+                    self.positions[p] += 1
+            if not msgs:
+                time.sleep(min(timeout, 0.01))
+            return msgs
+
+        def commit(self, offsets=None, asynchronous=True):
+            for tp in offsets:
+                MockConsumer.committed[(tp.topic, tp.partition)] = tp.offset
+
+        def close(self):
+            self.closed = True
+
+    return MockConsumer
+
+
+async def wait_until(condition: Callable[[], bool], timeout: float = 2.0):
+    """
+    Waits until a condition is met, failing if the condition is not met within the timeout.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition not met"
+        await asyncio.sleep(0.01)
+
+
+def create_listener(**params) -> ConfluentAsyncKafkaListener:
+    """
+    :return: a ConfluentAsyncKafkaListener with short timeouts
+    """
+    return ConfluentAsyncKafkaListener(
+        {}, {"poll_timeout": 0.01, "restart_backoff": 0.01, **params}
+    )
+
+
+@pytest.mark.asyncio
+async def test_listener(mock_listener_consumer, monkeypatch):
+    """
+    Tests that a listener hands batches of messages to its handler, and commits handled offsets.
+    """
+    handled = []
+
+    async def handler(messages):
+        handled.append([msg.offset() for msg in messages])
+
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_listener_consumer)
+        listener = create_listener(batch_size=4, max_in_flight=2)
+        listener.listen(["TOPIC"], handler)
+        try:
+            await wait_until(
+                lambda: mock_listener_consumer.committed.get(("TOPIC", 0)) == 10
+            )
+        finally:
+            listener.close()
+
+    assert sorted(sum(handled, [])) == list(range(10))
+    assert max(len(batch) for batch in handled) <= 4
+    assert mock_listener_consumer.instances[0].closed
+
+
+@pytest.mark.asyncio
+async def test_listener_restart(mock_listener_consumer, monkeypatch):
+    """
+    Tests that a listener recreates its consumer when a handler fails, and that unhandled messages are
+    delivered again.
+    """
+    handled = []
+
+    async def handler(messages):
+        offsets = [msg.offset() for msg in messages]
+        if 4 in offsets and 4 not in sum(handled, []) and len(handled) < 3:
+            handled.append([])
+            raise ValueError("handler failed")
+        handled.append(offsets)
+
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_listener_consumer)
+        listener = create_listener(batch_size=2)
+        listener.listen(["TOPIC"], handler)
+        try:
+            await wait_until(
+                lambda: mock_listener_consumer.committed.get(("TOPIC", 0)) == 10
+            )
+        finally:
+            listener.close()
+
+    assert len(mock_listener_consumer.instances) == 2
+    assert sorted(set(sum(handled, []))) == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_listener_backpressure(mock_listener_consumer, monkeypatch):
+    """
+    Tests that a listener pauses fetching while its handlers are saturated.
+    """
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(messages):
+        await release.wait()
+        handled.extend(msg.offset() for msg in messages)
+
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_listener_consumer)
+        listener = create_listener(batch_size=2, max_in_flight=1)
+        listener.assign([TopicPartition("TOPIC", 0, 0)], handler)
+        try:
+            consumer = mock_listener_consumer.instances[0]
+            await wait_until(lambda: consumer.paused)
+            assert consumer.positions[0] == 4
+
+            release.set()
+            await wait_until(lambda: len(handled) == 10)
+            assert not consumer.paused
+        finally:
+            listener.close()
+
+    assert handled == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_listener_partition_workers(mock_listener_consumer, monkeypatch):
+    """
+    Tests that partitions are handled concurrently and in order by partition workers, and that the workers
+    of revoked partitions complete their current batch before the partition is released.
+    """
+    release = asyncio.Event()
+    handled = {0: [], 1: []}
+
+    async def handler(messages):
+        partition = messages[0].partition()
+        assert all(msg.partition() == partition for msg in messages)
+        if partition == 0:
+            await release.wait()
+        handled[partition].extend(msg.offset() for msg in messages)
+
+    mock_listener_consumer.partition_count = 2
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_listener_consumer)
+        listener = create_listener(
+            batch_size=4, max_in_flight=8, partition_workers=True
+        )
+        listener.listen(["TOPIC"], handler)
+        try:
+            # partition 1 is handled while partition 0 is blocked
+            await wait_until(
+                lambda: mock_listener_consumer.committed.get(("TOPIC", 1)) == 10
+            )
+            assert len(handled[1]) == 10
+            assert handled[0] == []
+            lag_key = ("kafka_listener_lag", (("partition", "1"), ("topic", "TOPIC")))
+            await wait_until(
+                lambda: kafka.get_metrics_registry().collect_gauges().get(lag_key) == 0,
+                timeout=3.0,
+            )
+
+            consumer = mock_listener_consumer.instances[0]
+            consumer.revoke = [0]
+            asyncio.get_running_loop().call_later(0.05, release.set)
+            await wait_until(lambda: ("TOPIC", 0) in mock_listener_consumer.committed)
+        finally:
+            listener.close()
+
+    # the current batch of partition 0 is handled and committed, and queued batches are dropped
+    assert handled[1] == list(range(10))
+    assert handled[0] == [0, 1]
+    assert mock_listener_consumer.committed[("TOPIC", 0)] == 2
+    assert (
+        kafka.get_metrics_registry().collect_gauges()[
+            ("kafka_listener_lag", (("partition", "1"), ("topic", "TOPIC")))
+        ]
+        == 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_listener_without_lag_gauges(mock_listener_consumer, monkeypatch):
+    """
+    Tests that a listener with lag gauges disabled does not register kafka_listener_lag gauges.
+    """
+    handled = []
+
+    async def handler(messages):
+        handled.extend(msg.offset() for msg in messages)
+
+    registry = MetricsRegistry()
+    with monkeypatch.context() as m:
+        m.setattr(kafka, "Consumer", mock_listener_consumer)
+        m.setattr(kafka, "get_metrics_registry", lambda: registry)
+        listener = create_listener(commit_offsets=False, lag_gauges=False)
+        listener.assign([TopicPartition("TOPIC", 0, 0)], handler)
+        try:
+            await wait_until(lambda: len(handled) == 10)
+        finally:
+            listener.close()
+
+    assert registry.gauges == {}
+
+
+@pytest.mark.asyncio
+async def test_topic_stream():
+    """
+    Tests that a topic stream handler waits while the stream buffer is full.
+    """
+
+    class MockMessage:
+        def __init__(self, offset):
+            self._offset = offset
+
+        def topic(self):
+            return "TOPIC"
+
+        def partition(self):
+            return 0
+
+        def offset(self):
+            return self._offset
+
+        def value(self):
+            return str(self._offset).encode()
+
+        def headers(self):
+            return None
+
+    listener = Mock()
+    listener._loop = asyncio.get_running_loop()
+    stream = KafkaTopicStream(listener, max_buffered=2, max_segment_bytes=1024)
+    handle = asyncio.ensure_future(stream._handle([MockMessage(i) for i in range(3)]))
+    await asyncio.sleep(0.01)
+    assert not handle.done()
+
+    assert await stream.get() == ("TOPIC:0:0", b"0")
+    await asyncio.sleep(0)
+    assert handle.done()
+
+
+@pytest.mark.asyncio
+async def test_topic_stream_segments():
+    """
+    Tests that streams of the same topic each reassemble segmented records, and that invalid segments
+    are skipped.
+    """
+
+    class MockMessage:
+        def __init__(self, offset, value, headers):
+            self._offset = offset
+            self._value = value
+            self._headers = headers
+
+        def topic(self):
+            return "TOPIC"
+
+        def partition(self):
+            return 0
+
+        def offset(self):
+            return self._offset
+
+        def value(self):
+            return self._value
+
+        def headers(self):
+            return self._headers
+
+    record = b"0123456789"
+    messages = [
+        MockMessage(
+            offset,
+            bytes(segment),
+            get_segment_headers(identifier, count, index, len(record)),
+        )
+        for offset, (segment, identifier, count, index) in enumerate(
+            segment_message(record, 4)
+        )
+    ]
+    # a segment which does not fit its record
+    invalid = MockMessage(3, b"01", get_segment_headers(b"other", b"2", b"2", 10))
+
+    listener = Mock()
+    listener._loop = asyncio.get_running_loop()
+    first = KafkaTopicStream(listener, max_buffered=2, max_segment_bytes=1024)
+    second = KafkaTopicStream(listener, max_buffered=2, max_segment_bytes=1024)
+    # the streams' handlers are interleaved, as when both streams tail the topic
+    for msg in messages:
+        await first._handle([msg])
+        await second._handle([msg])
+    await first._handle([invalid])
+
+    assert await first.get() == ("TOPIC:0:0", record)
+    assert await second.get() == ("TOPIC:0:0", record)
+    assert first._queue.empty()
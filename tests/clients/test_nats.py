@@ -0,0 +1,185 @@
+"""
+test_nats.py
+
+Tests the NATS message handlers defined in connect.clients.nats
+"""
+import base64
+import httpx
+import pytest
+from unittest.mock import AsyncMock, Mock
+from connect.clients import nats
+from connect.support import record_keys
+from connect.support.encoding import encode_json
+from connect.support.retransmit_queue import RetransmitQueue
+
+
+def create_message(number: int) -> dict:
+    return {
+        "uuid": f"00000000-0000-0000-0000-00000000000{number}",
+        "operation": "POST",
+        "target_endpoint_url": "https://fhir/Patient",
+        "data": "eyJpZCI6ICIwMDEifQ==",
+        "status": "ERROR",
+        "transmit_start": "2021-02-12T18:15:17.000000",
+        "elapsed_total_time": 0.0,
+    }
+
+
+def create_response(status_code: int) -> httpx.Response:
+    return httpx.Response(
+        status_code, request=httpx.Request("POST", "https://fhir/Patient")
+    )
+
+
+@pytest.mark.asyncio
+async def test_do_retransmit(settings, monkeypatch):
+    """
+    Tests that messages which cannot be retransmitted are queued, and that queued messages are
+    retransmitted in order for their target endpoint.
+    """
+    queue = RetransmitQueue(None, max_entries=10)
+    client = Mock(post=AsyncMock(side_effect=Exception("Connection refused")))
+    kafka_producer = AsyncMock()
+
+    with monkeypatch.context() as m:
+        m.setattr(nats, "get_settings", lambda: settings)
+        m.setattr(nats, "get_retransmit_queue", lambda: queue)
+        m.setattr(nats, "get_http_client_pool", lambda: client)
+        m.setattr(nats, "get_kafka_producer", lambda: kafka_producer)
+        m.setattr(nats, "get_transmit_target", Mock(return_value=Mock()))
+
+        assert not await nats.do_retransmit(create_message(1))
+        # a new message is queued behind the target's queued messages, without retransmitting
+        assert not await nats.do_retransmit(create_message(2))
+        assert client.post.call_count == 1
+        assert [m["uuid"] for m in queue] == [
+            create_message(1)["uuid"],
+            create_message(2)["uuid"],
+        ]
+
+        message = queue.peek("https://fhir/Patient")
+        assert not await nats.do_retransmit(message, queued=True)
+        assert queue.peek("https://fhir/Patient")["retransmit_count"] == 2
+
+        client.post.side_effect = None
+        client.post.return_value = create_response(201)
+        for _ in range(2):
+            message = queue.peek("https://fhir/Patient")
+            assert await nats.do_retransmit(message, queued=True)
+        assert len(queue) == 0
+        assert kafka_producer.produce.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_do_retransmit_breaker_open(settings, monkeypatch):
+    """
+    Tests that messages are deferred, without sending or counting a retry, while the target's circuit
+    breaker is open.
+    """
+    queue = RetransmitQueue(None, max_entries=10)
+    client = Mock(post=AsyncMock(return_value=create_response(201)))
+    kafka_producer = AsyncMock()
+    target = Mock(allow_request=Mock(return_value=False))
+
+    with monkeypatch.context() as m:
+        m.setattr(nats, "get_settings", lambda: settings)
+        m.setattr(nats, "get_retransmit_queue", lambda: queue)
+        m.setattr(nats, "get_http_client_pool", lambda: client)
+        m.setattr(nats, "get_kafka_producer", lambda: kafka_producer)
+        m.setattr(nats, "get_transmit_target", Mock(return_value=target))
+
+        assert not await nats.do_retransmit(create_message(1))
+        message = queue.peek("https://fhir/Patient")
+        assert not await nats.do_retransmit(message, queued=True)
+        assert message["retransmit_count"] == 0
+        assert client.post.call_count == 0
+
+        target.allow_request.return_value = True
+        assert await nats.do_retransmit(message, queued=True)
+        assert message["retransmit_count"] == 1
+        assert len(queue) == 0
+
+
+@pytest.mark.asyncio
+async def test_do_retransmit_error_response(settings, monkeypatch):
+    """
+    Tests that server error responses are retried, and that client error responses fail permanently.
+    """
+    queue = RetransmitQueue(None, max_entries=10)
+    client = Mock(post=AsyncMock(return_value=create_response(503)))
+    kafka_producer = AsyncMock()
+    target = Mock()
+
+    with monkeypatch.context() as m:
+        m.setattr(nats, "get_settings", lambda: settings)
+        m.setattr(nats, "get_retransmit_queue", lambda: queue)
+        m.setattr(nats, "get_http_client_pool", lambda: client)
+        m.setattr(nats, "get_kafka_producer", lambda: kafka_producer)
+        m.setattr(nats, "get_transmit_target", Mock(return_value=target))
+
+        message = create_message(1)
+        assert not await nats.do_retransmit(message)
+        assert message["transmit_status_code"] == 503
+        assert len(queue) == 1
+        assert target.record_response.call_args[0][0] == 503
+
+        client.post.return_value = create_response(400)
+        message = queue.peek("https://fhir/Patient")
+        assert await nats.do_retransmit(message, queued=True)
+        assert message["status"] == "FAILED"
+        assert len(queue) == 0
+        assert kafka_producer.produce.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_queue_transmit(monkeypatch, tmp_path):
+    """
+    Tests that async transmissions are only queued in a durable retransmit queue
+    """
+    with monkeypatch.context() as m:
+        queue = RetransmitQueue(None, max_entries=10)
+        m.setattr(nats, "get_retransmit_queue", lambda: queue)
+        assert not await nats.queue_transmit(create_message(1))
+        assert len(queue) == 0
+
+        queue = RetransmitQueue(str(tmp_path / "retransmit.log"), max_entries=10)
+        assert await nats.queue_transmit(create_message(1))
+        queue.close()
+        assert len(RetransmitQueue(str(tmp_path / "retransmit.log"), 10)) == 1
+
+
+@pytest.mark.asyncio
+async def test_nats_sync_event_handler(settings, monkeypatch):
+    """
+    Tests that synchronized records are keyed by their parsed resource, and that payloads which are not
+    JSON are stored without a key
+    """
+    settings.kafka_producer_key_strategy = "patient"
+    kafka_producer = AsyncMock()
+    workflow = Mock(
+        run=AsyncMock(return_value={"data_record_location": "FHIR-R4_OBSERVATION:0:0"})
+    )
+    data = b'{"resourceType": "Observation", "subject": {"reference": "Patient/001"}}'
+    message = {
+        "uuid": create_message(1)["uuid"],
+        "lfh_id": "remote-lfh",
+        "data_format": "FHIR-R4_OBSERVATION",
+        "consuming_endpoint_url": "/fhir/Observation",
+        "data": base64.b64encode(data).decode(),
+    }
+
+    with monkeypatch.context() as m:
+        m.setattr(nats, "get_settings", lambda: settings)
+        m.setattr(record_keys, "get_settings", lambda: settings)
+        m.setattr(nats, "get_kafka_producer", lambda: kafka_producer)
+        m.setattr(nats.core, "CoreWorkflow", Mock(return_value=workflow))
+
+        await nats.nats_sync_event_handler(Mock(data=encode_json(message)))
+        assert (
+            kafka_producer.produce_with_callback.call_args[1]["key"] == b"Patient/001"
+        )
+        assert nats.core.CoreWorkflow.call_args[1]["record_key"] == b"Patient/001"
+
+        message["data"] = base64.b64encode(b"MSH|^~\\&|").decode()
+        await nats.nats_sync_event_handler(Mock(data=encode_json(message)))
+        assert kafka_producer.produce_with_callback.call_args[1]["key"] is None
@@ -87,16 +87,19 @@ def mock_async_kafka_producer() -> Callable:
     """
 
     class MockKafkaProducer:
-        def __init__(self, configs, loop=None):
+        def __init__(self, configs, loop=None, **kwargs):
             self._producer = Producer(configs)
 
         def _poll_loop(self):
             pass
 
+        def is_saturated(self):
+            return False
+
         def close(self):
             pass
 
-        async def produce_with_callback(self, topic, value, on_delivery):
+        async def produce_with_callback(self, topic, value, on_delivery, key=None):
             """
             Implements a producer with a callback
             """
@@ -136,7 +139,8 @@ def mock_async_kafka_consumer(lfh_data_record):
 @pytest.fixture
 def mock_httpx_client():
     """
-    Returns a mock HTTPX Client instance which supports use as a context manager
+    Returns a mock HTTPX Client instance which supports use as a context manager.
+    The mock may also be used in place of the HttpClientPool.
     """
 
     class MockHttpxClient:
@@ -2,11 +2,13 @@
 test_data.py
 Tests /data endpoints
 """
+import json
 import pytest
 
 from connect.exceptions import KafkaMessageNotFoundError
 from connect.routes import data
-from unittest.mock import Mock
+from connect.support.encoding import decode_to_bytes, encode_record
+from unittest.mock import AsyncMock, Mock
 
 
 @pytest.fixture
@@ -84,3 +86,233 @@ async def test_get_data_not_found(
             assert actual_response.status_code == 404
             actual_json = actual_response.json()
             assert actual_json["detail"] == "Data record not found"
+
+
+@pytest.mark.asyncio
+async def test_get_data_binary_record(
+    mock_async_kafka_consumer,
+    async_test_client,
+    endpoint_parameters,
+    lfh_data_record,
+    monkeypatch,
+):
+    """
+    Tests /data where the record is stored in the binary record format
+    :param mock_async_kafka_consumer: The mock kafka consumer
+    :param async_test_client: The httpx async test client used to submit requests
+    :param endpoint_parameters: The endpoint parameters fixture
+    :param lfh_data_record: The LFH data record fixture
+    :param monkeypatch: pyTest monkeypatch fixture
+    """
+    payload = decode_to_bytes(lfh_data_record["data"])
+    record = encode_record(lfh_data_record, payload, "binary")
+
+    async def get_message(callback):
+        return await callback(record)
+
+    mock_async_kafka_consumer.get_message_from_kafka_cb.side_effect = get_message
+    with monkeypatch.context() as m:
+        m.setattr(
+            data, "get_kafka_consumer", Mock(return_value=mock_async_kafka_consumer)
+        )
+        async with async_test_client as atc:
+            actual_response = await atc.get("/data", params=endpoint_parameters)
+            assert actual_response.status_code == 200
+            assert actual_response.json()["data"] == lfh_data_record["data"]
+
+        async with async_test_client as atc:
+            actual_response = await atc.get(
+                "/data",
+                params=endpoint_parameters,
+                headers={"Accept": "application/octet-stream"},
+            )
+            assert actual_response.status_code == 200
+            assert actual_response.content == payload
+            assert (
+                actual_response.headers["LinuxForHealth-MessageId"]
+                == lfh_data_record["uuid"]
+            )
+
+
+@pytest.fixture
+def mock_range_kafka_consumer(lfh_data_record):
+    """
+    A mock Kafka consumer which returns LFH Data Records for offsets 0 through 9, two records per batch.
+    """
+    from connect.support.encoding import encode_json
+
+    class MockRangeKafkaConsumer:
+        def __init__(self, topic_name, partition, offset):
+            self.topic_name = topic_name
+            self.partition = partition
+            self.offset = offset
+
+        async def get_messages_from_kafka_cb(self, end_offset, callback_method):
+            if self.offset > 9:
+                raise KafkaMessageNotFoundError("Data records not found")
+            offsets = list(range(self.offset, min(end_offset, 9) + 1))
+            for i in range(0, len(offsets), 2):
+                yield await callback_method(
+                    [
+                        (
+                            f"{self.topic_name}:{self.partition}:{offset}",
+                            encode_json(lfh_data_record),
+                        )
+                        for offset in offsets[i : i + 2]
+                    ]
+                )
+
+    return MockRangeKafkaConsumer
+
+
+@pytest.mark.asyncio
+async def test_get_data_range(
+    mock_range_kafka_consumer, async_test_client, monkeypatch
+):
+    """
+    Tests /data/range where records are returned as NDJSON
+    :param mock_range_kafka_consumer: The mock range kafka consumer
+    :param async_test_client: The httpx async test client used to submit requests
+    :param monkeypatch: pyTest monkeypatch fixture
+    """
+    params = {"dataformat": "EXAMPLE", "partition": 0, "start": 5, "end": 20}
+    with monkeypatch.context() as m:
+        m.setattr(data, "get_kafka_consumer", mock_range_kafka_consumer)
+        async with async_test_client as atc:
+            actual_response = await atc.get("/data/range", params=params)
+            assert actual_response.status_code == 200
+            assert actual_response.headers["content-type"] == "application/x-ndjson"
+            records = [json.loads(line) for line in actual_response.text.splitlines()]
+            assert [r["data_record_location"] for r in records] == [
+                f"EXAMPLE:0:{offset}" for offset in range(5, 10)
+            ]
+
+            params["start"] = 10
+            actual_response = await atc.get("/data/range", params=params)
+            assert actual_response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_post_data_batch(
+    mock_range_kafka_consumer, async_test_client, monkeypatch
+):
+    """
+    Tests /data/batch where requested records, and errors for missing records, are returned as NDJSON
+    :param mock_range_kafka_consumer: The mock range kafka consumer
+    :param async_test_client: The httpx async test client used to submit requests
+    :param monkeypatch: pyTest monkeypatch fixture
+    """
+    locations = ["EXAMPLE:0:7", "EXAMPLE:0:1", "EXAMPLE:0:12", "OTHER:1:3"]
+    with monkeypatch.context() as m:
+        m.setattr(data, "get_kafka_consumer", mock_range_kafka_consumer)
+        async with async_test_client as atc:
+            actual_response = await atc.post("/data/batch", json=locations)
+            assert actual_response.status_code == 200
+            records = [json.loads(line) for line in actual_response.text.splitlines()]
+            assert [r["data_record_location"] for r in records] == [
+                "EXAMPLE:0:1",
+                "EXAMPLE:0:7",
+                "EXAMPLE:0:12",
+                "OTHER:1:3",
+            ]
+            assert "detail" not in records[0]
+            assert records[2]["detail"] == "Data record not found"
+
+            actual_response = await atc.post("/data/batch", json=["invalid"])
+            assert actual_response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_post_data_batch_incomplete_location(async_test_client):
+    """
+    Tests /data/batch where a location without a partition or offset is rejected
+    :param async_test_client: The httpx async test client used to submit requests
+    """
+    async with async_test_client as atc:
+        actual_response = await atc.post("/data/batch", json=["EXAMPLE:0:"])
+        assert actual_response.status_code == 422
+
+        actual_response = await atc.post("/data/batch", json=["EXAMPLE::1"])
+        assert actual_response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_get_data_stream(async_test_client, lfh_data_record, monkeypatch):
+    """
+    Tests /data/stream where records are streamed as NDJSON and as server-sent events
+    :param async_test_client: The httpx async test client used to submit requests
+    :param lfh_data_record: The LFH data record fixture
+    :param monkeypatch: pyTest monkeypatch fixture
+    """
+    from connect.support.encoding import encode_json
+
+    class MockTopicStream:
+        def __init__(self):
+            self.offset = 0
+            self.close = AsyncMock()
+
+        async def get(self):
+            self.offset += 1
+            return f"EXAMPLE:0:{self.offset}", encode_json(lfh_data_record)
+
+    mock_stream = MockTopicStream()
+    params = {"dataformat": "EXAMPLE", "from": "earliest", "limit": 2}
+    with monkeypatch.context() as m:
+        m.setattr(data, "get_kafka_topic_stream", AsyncMock(return_value=mock_stream))
+        async with async_test_client as atc:
+            actual_response = await atc.get("/data/stream", params=params)
+            assert actual_response.status_code == 200
+            records = [json.loads(line) for line in actual_response.text.splitlines()]
+            assert [r["data_record_location"] for r in records] == [
+                "EXAMPLE:0:1",
+                "EXAMPLE:0:2",
+            ]
+            mock_stream.close.assert_awaited_once()
+
+            actual_response = await atc.get(
+                "/data/stream",
+                params=params,
+                headers={"Accept": "text/event-stream"},
+            )
+            assert actual_response.status_code == 200
+            assert actual_response.text.startswith("id: EXAMPLE:0:3\ndata: {")
+
+
+@pytest.mark.asyncio
+async def test_get_data_stream_invalid_record(
+    async_test_client, lfh_data_record, monkeypatch
+):
+    """
+    Tests /data/stream where records which cannot be decoded are skipped
+    :param async_test_client: The httpx async test client used to submit requests
+    :param lfh_data_record: The LFH data record fixture
+    :param monkeypatch: pyTest monkeypatch fixture
+    """
+    from connect.support.encoding import encode_json
+
+    invalid_records = [
+        b'["not", "a", "record"]',
+        encode_json({**lfh_data_record, "data_encoding": "zlib"}),
+    ]
+
+    class MockTopicStream:
+        def __init__(self):
+            self.offset = 0
+            self.close = AsyncMock()
+
+        async def get(self):
+            self.offset += 1
+            if self.offset <= len(invalid_records):
+                return f"EXAMPLE:0:{self.offset}", invalid_records[self.offset - 1]
+            return f"EXAMPLE:0:{self.offset}", encode_json(lfh_data_record)
+
+    params = {"dataformat": "EXAMPLE", "from": "earliest", "limit": 1}
+    with monkeypatch.context() as m:
+        m.setattr(
+            data, "get_kafka_topic_stream", AsyncMock(return_value=MockTopicStream())
+        )
+        async with async_test_client as atc:
+            actual_response = await atc.get("/data/stream", params=params)
+            assert actual_response.status_code == 200
+            records = [json.loads(line) for line in actual_response.text.splitlines()]
+            assert [r["data_record_location"] for r in records] == ["EXAMPLE:0:3"]
@@ -0,0 +1,71 @@
+"""
+test_metrics.py
+Tests the /metrics API endpoint
+"""
+import pytest
+from connect.support import metrics
+from connect.support.metrics import MetricsRegistry
+
+
+@pytest.mark.asyncio
+async def test_metrics_get(async_test_client, monkeypatch):
+    """
+    Tests /metrics [GET]
+    :param async_test_client: Fast API async test client
+    :param monkeypatch: MonkeyPatch instance used to mock test cases
+    """
+    registry = MetricsRegistry()
+    registry.histogram("persist", data_format="FHIR-R4_PATIENT").observe(0.003)
+    registry.counter("rate_limit_rejections", path="/fhir/Patient").inc()
+    registry.gauge("kafka_producer_queue_depth", lambda: 5)
+
+    with monkeypatch.context() as m:
+        m.setattr(metrics, "metrics_registry", registry)
+
+        async with async_test_client as ac:
+            actual_response = await ac.get("/metrics")
+
+            assert actual_response.status_code == 200
+            assert actual_response.headers["content-type"].startswith("text/plain")
+
+            lines = actual_response.text.splitlines()
+            assert "# TYPE lfh_persist_seconds histogram" in lines
+            assert (
+                'lfh_persist_seconds_bucket{data_format="FHIR-R4_PATIENT",le="0.0025"} 0'
+                in lines
+            )
+            assert (
+                'lfh_persist_seconds_bucket{data_format="FHIR-R4_PATIENT",le="0.005"} 1'
+                in lines
+            )
+            assert 'lfh_persist_seconds_count{data_format="FHIR-R4_PATIENT"} 1' in lines
+            assert 'lfh_rate_limit_rejections_total{path="/fhir/Patient"} 1' in lines
+            assert "lfh_kafka_producer_queue_depth 5" in lines
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_rejections(async_test_client, monkeypatch):
+    """
+    Tests that rate limit rejections are labelled with the route's path template, rather than the request path
+    :param async_test_client: Fast API async test client
+    :param monkeypatch: MonkeyPatch instance used to mock test cases
+    """
+    registry = MetricsRegistry()
+
+    with monkeypatch.context() as m:
+        m.setattr(metrics, "metrics_registry", registry)
+
+        async with async_test_client as ac:
+            status_codes = [
+                (await ac.post("/fhir/NoSuchType", json={})).status_code
+                for _ in range(10)
+            ]
+            assert 429 in status_codes
+
+            actual_response = await ac.get("/metrics")
+            lines = actual_response.text.splitlines()
+            rejections = status_codes.count(429)
+            assert (
+                f'lfh_rate_limit_rejections_total{{path="/fhir/{{resource_type}}"}} {rejections}'
+                in lines
+            )
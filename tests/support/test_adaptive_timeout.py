@@ -0,0 +1,30 @@
+"""
+test_adaptive_timeout.py
+
+Tests the latency percentile based request timeout
+"""
+from connect.support.adaptive_timeout import AdaptiveTimeout
+
+
+def test_adaptive_timeout():
+    """
+    Validates that the timeout tracks the latency percentile, within the minimum and maximum timeout
+    """
+    timeout = AdaptiveTimeout(
+        10.0, 1.0, 30.0, percentile=90.0, multiplier=2.0, min_samples=10
+    )
+    for _ in range(9):
+        timeout.observe(0.1)
+    assert timeout.timeout == 10.0
+
+    timeout.observe(0.1)
+    assert timeout.timeout == 1.0
+
+    # 10 of 20 latencies are 2s, so p90 is 2s
+    for _ in range(10):
+        timeout.observe(2.0)
+    assert timeout.timeout == 4.0
+
+    for _ in range(200):
+        timeout.observe(60.0)
+    assert timeout.timeout == 30.0
@@ -0,0 +1,107 @@
+"""
+test_compression.py
+
+Tests Connect payload compression
+"""
+import json
+import os
+import pytest
+from connect.support.compression import (
+    PayloadCompressor,
+    train_compression_dictionary,
+)
+from connect.support.metrics import get_metrics_registry
+
+
+@pytest.fixture
+def payload() -> bytes:
+    """
+    :return: a FHIR resource payload
+    """
+    resource = {
+        "resourceType": "Patient",
+        "id": "001",
+        "active": True,
+        "name": [{"family": "Doe", "given": ["John"]}] * 20,
+    }
+    return json.dumps(resource).encode()
+
+
+def test_compress_zlib(payload: bytes):
+    """
+    Validates zlib compression, codec overrides and compression metrics
+    :param payload: The payload fixture
+    """
+    compressor = PayloadCompressor(
+        codec="zlib",
+        level=3,
+        min_size=256,
+        codec_overrides={"FHIR-R4_ENCOUNTER": "none"},
+        dictionaries={},
+    )
+    compressed, data_encoding = compressor.compress(payload, "FHIR-R4_PATIENT")
+    assert data_encoding == "zlib"
+    assert len(compressed) < len(payload)
+    assert (
+        compressor.decompress(compressed, data_encoding, "FHIR-R4_PATIENT") == payload
+    )
+
+    assert compressor.compress(payload, "FHIR-R4_ENCOUNTER") == (payload, None)
+    assert compressor.compress(b'{"id": "001"}', "FHIR-R4_PATIENT") == (
+        b'{"id": "001"}',
+        None,
+    )
+
+    # incompressible payloads are stored uncompressed
+    random_payload = os.urandom(1024)
+    assert compressor.compress(random_payload, "RANDOM") == (random_payload, None)
+
+    registry = get_metrics_registry()
+    labels = {"data_format": "FHIR-R4_PATIENT", "codec": "zlib"}
+    assert registry.counter("payload_compression_input_bytes", **labels).value > 0
+    assert registry.histogram("payload_compression", **labels).count > 0
+    ratio = registry.collect_gauges()[
+        registry._key("payload_compression_ratio", labels)
+    ]
+    assert ratio > 1
+
+    with pytest.raises(ValueError):
+        compressor.decompress(compressed, "unknown", "FHIR-R4_PATIENT")
+    with pytest.raises(ValueError):
+        compressor.decompress(b"not compressed", data_encoding, "FHIR-R4_PATIENT")
+
+
+def test_compress_zstd_dictionary(payload: bytes):
+    """
+    Validates zstd compression using a trained dictionary
+    :param payload: The payload fixture
+    """
+    pytest.importorskip("zstandard")
+
+    samples = [payload.replace(b"001", str(i).encode()) for i in range(500)]
+    dictionary = train_compression_dictionary(samples, dictionary_size=4096)
+    compressor = PayloadCompressor(
+        codec="zstd",
+        level=3,
+        min_size=0,
+        codec_overrides={},
+        dictionaries={"FHIR-R4_PATIENT": dictionary},
+    )
+
+    compressed, data_encoding = compressor.compress(payload, "FHIR-R4_PATIENT")
+    assert data_encoding == "zstd"
+    plain_compressed, _ = compressor.compress(payload, "FHIR-R4_ENCOUNTER")
+    assert len(compressed) < len(plain_compressed)
+
+    assert compressor.decompress(compressed, "zstd", "FHIR-R4_PATIENT") == payload
+    assert compressor.decompress(plain_compressed, "zstd", "FHIR-R4_ENCOUNTER") == (
+        payload
+    )
+
+    other_compressor = PayloadCompressor("zstd", 3, 0, {}, {})
+    with pytest.raises(ValueError):
+        other_compressor.decompress(compressed, "zstd", "FHIR-R4_PATIENT")
+    with pytest.raises(ValueError):
+        compressor.decompress(b"not compressed", "zstd", "FHIR-R4_PATIENT")
+    with pytest.raises(ValueError):
+        compressor.decompress(compressed[:-4], "zstd", "FHIR-R4_PATIENT")
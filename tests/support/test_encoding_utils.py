@@ -3,7 +3,16 @@ test_encoding_utils.py
 
 Tests Connect support base64 encoding convenience functions
 """
+from connect.support import encoding
 from connect.support.encoding import (
+    _create_json_backend,
+    get_json_backend,
+    encode_json,
+    decode_json,
+    encode_record,
+    decode_record,
+    decode_record_to_dict,
+    is_binary_record,
     encode_from_dict,
     encode_from_str,
     encode_from_bytes,
@@ -17,6 +26,7 @@ import datetime
 import uuid
 import copy
 import decimal
+import sys
 
 
 @pytest.fixture(scope="module")
@@ -136,3 +146,117 @@ def test_connect_encoder(dictionary_data, encoded_dictionary_data):
     encoder = ConnectEncoder()
     actual_value = encoder.encode(dictionary_data)
     assert encoded_dictionary_data == actual_value
+
+
+@pytest.mark.parametrize("backend_name", ["json", "orjson", "msgspec", "ujson"])
+def test_json_backends(backend_name, dictionary_data, decoded_dictionary_data):
+    """
+    Validates that each installed JSON backend supports the ConnectEncoder types
+    :param backend_name: The JSON backend
+    :param dictionary_data: The fixture used as the encoding input
+    :param decoded_dictionary_data: The fixture used as the expected decoding result
+    """
+    try:
+        backend = _create_json_backend(backend_name)
+    except ImportError:
+        pytest.skip(f"{backend_name} is not installed")
+
+    # bytes values are base64 encoded, including within lists
+    data = {
+        **dictionary_data,
+        "payload": b"ABCDEFabcdefABCDEF",
+        "items": [b"ABC", uuid.UUID("d897987e-133b-4236-996d-554c012ee8d9")],
+        "amount": decimal.Decimal("10.5"),
+    }
+    expected = {
+        **decoded_dictionary_data,
+        "payload": "QUJDREVGYWJjZGVmQUJDREVG",
+        "items": ["QUJD", "d897987e-133b-4236-996d-554c012ee8d9"],
+        "amount": 10.5,
+    }
+    encoded_data = backend.dumps(data)
+    assert isinstance(encoded_data, bytes)
+    assert backend.loads(encoded_data) == expected
+    assert backend.loads(b'"\\u00e9"') == "é"
+
+    with pytest.raises(ValueError):
+        backend.loads(b"{invalid")
+
+
+def test_get_json_backend(settings, monkeypatch):
+    """
+    Validates that the standard library backend is used when the configured backend is not installed
+    :param settings: The Settings fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    """
+    settings.connect_json_backend = "ujson"
+    with monkeypatch.context() as m:
+        m.setattr(encoding, "json_backend", None)
+        m.setattr(encoding, "get_settings", lambda: settings)
+        m.setitem(sys.modules, "ujson", None)
+        assert get_json_backend().name == "json"
+        assert encode_json({"id": "001"}) == b'{"id": "001"}'
+        assert decode_json(b'{"id": "001"}') == {"id": "001"}
+
+
+@pytest.mark.parametrize("record_format", ["json", "binary"])
+def test_encode_decode_record(record_format, lfh_data_record):
+    """
+    Validates that records are encoded and decoded in each record format
+    :param record_format: The record format
+    :param lfh_data_record: The LFH data record fixture
+    """
+    payload = decode_to_bytes(lfh_data_record["data"])
+    record = encode_record(lfh_data_record, payload, record_format)
+    assert is_binary_record(record) == (record_format == "binary")
+
+    message, actual_payload = decode_record(record)
+    assert actual_payload == payload
+    assert message["uuid"] == lfh_data_record["uuid"]
+    assert decode_record_to_dict(record) == lfh_data_record
+
+
+def test_decode_binary_record_invalid(lfh_data_record):
+    """
+    Validates that a truncated binary record is rejected
+    :param lfh_data_record: The LFH data record fixture
+    """
+    record = encode_record(lfh_data_record, b"payload", "binary")
+    with pytest.raises(ValueError):
+        decode_record(record[:20])
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        b'{"uuid": "782e1049-79ba-4899-90ec-5cf8a901261a"}',
+        b'{"uuid": "782e1049-79ba-4899-90ec-5cf8a901261a", "data": null}',
+        b'["not", "a", "record"]',
+        b'{"data": "bm90IGNvbXByZXNzZWQ=", "data_encoding": "zlib"}',
+    ],
+)
+def test_decode_record_invalid(record):
+    """
+    Validates that records without data, or with data which cannot be decompressed, are rejected
+    with a ValueError
+    :param record: The invalid record
+    """
+    with pytest.raises(ValueError):
+        decode_record(record)
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        b'["not", "a", "record"]',
+        b'{"data": "bm90IGNvbXByZXNzZWQ=", "data_encoding": "zlib"}',
+    ],
+)
+def test_decode_record_to_dict_invalid(record):
+    """
+    Validates that records which are not objects, or with data which cannot be decompressed, are rejected
+    with a ValueError
+    :param record: The invalid record
+    """
+    with pytest.raises(ValueError):
+        decode_record_to_dict(record)
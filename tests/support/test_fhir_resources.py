@@ -0,0 +1,87 @@
+"""
+test_fhir_resources.py
+
+Tests Connect support functions for resolving fhir.resources model classes
+"""
+import pytest
+from fhir.resources.patient import Patient
+from connect.support import fhir_resources
+from connect.support.fhir_resources import (
+    construct_fhir_resource,
+    get_fhir_resource_class,
+    is_fhir_resource_type,
+    validate_fhir_structure,
+    warm_fhir_resource_classes,
+)
+
+
+def test_get_fhir_resource_class():
+    """
+    Validates that resource classes are resolved and cached
+    """
+    assert get_fhir_resource_class("Patient") is Patient
+    assert fhir_resources._resource_classes["Patient"] is Patient
+    assert is_fhir_resource_type("Patient") is True
+    assert is_fhir_resource_type("patient") is False
+
+    with pytest.raises(LookupError):
+        get_fhir_resource_class("NoSuchResourceName")
+
+
+def test_construct_fhir_resource():
+    """
+    Validates that a FHIR resource is instantiated from a dict
+    """
+    patient = construct_fhir_resource(
+        "Patient", {"resourceType": "Patient", "id": "001", "active": True}
+    )
+    assert isinstance(patient, Patient)
+    assert patient.id == "001"
+
+
+def test_warm_fhir_resource_classes():
+    """
+    Validates that resource classes, and the element classes referenced by their fields, are resolved
+    """
+    resolved = warm_fhir_resource_classes(["Patient", "NoSuchResourceName"])
+    assert "Patient" in resolved
+    assert "HumanName" in resolved
+    assert "NoSuchResourceName" not in resolved
+    assert "HumanName" in fhir_resources._resource_classes
+
+
+def test_validate_fhir_structure():
+    """
+    Validates structural validation of element names, types, cardinality and required elements
+    """
+    patient = {
+        "resourceType": "Patient",
+        "id": "001",
+        "active": True,
+        "birthDate": "1970-01-01",
+        "name": [{"family": "Doe", "given": ["John"]}],
+        "contained": [{"resourceType": "Organization", "name": "LFH"}],
+    }
+    validate_fhir_structure("Patient", patient)
+    assert "Patient" in fhir_resources._structural_rules
+    assert "HumanName" in fhir_resources._structural_rules
+
+    invalid_resources = [
+        {**patient, "unknown": "value"},
+        {**patient, "active": "yes"},
+        {**patient, "name": {"family": "Doe"}},
+        {**patient, "name": [{"family": 1}]},
+        {**patient, "contained": [{"name": "LFH"}]},
+        {**patient, "multipleBirthBoolean": True, "multipleBirthInteger": 2},
+    ]
+    for resource in invalid_resources:
+        with pytest.raises(ValueError):
+            validate_fhir_structure("Patient", resource)
+
+    observation = {"resourceType": "Observation", "code": {"text": "weight"}}
+    with pytest.raises(ValueError, match="status"):
+        validate_fhir_structure("Observation", observation)
+    validate_fhir_structure("Observation", {**observation, "status": "final"})
+
+    with pytest.raises(LookupError):
+        validate_fhir_structure("NoSuchResourceName", {})
@@ -0,0 +1,91 @@
+"""
+test_kafka_segments.py
+
+Tests the Kafka message segmentation and reassembly functions
+"""
+import pytest
+from connect.support.kafka_segments import (
+    get_segment_headers,
+    segment_message,
+    SegmentStore,
+)
+
+
+def create_segments(message: bytes, chunk_size: int) -> list:
+    """
+    :return: list of (segment, headers) tuples for a message
+    """
+    return [
+        (bytes(segment), get_segment_headers(identifier, count, index, len(message)))
+        for segment, identifier, count, index in segment_message(message, chunk_size)
+    ]
+
+
+def test_segment_message():
+    """
+    Validates that messages are split into evenly sized segments no larger than the chunk size
+    """
+    segments = create_segments(b"0123456789", 4)
+    assert [segment for segment, _ in segments] == [b"0123", b"4567", b"89"]
+
+    segments = create_segments(b"012345678", 4)
+    assert [segment for segment, _ in segments] == [b"012", b"345", b"678"]
+
+
+def test_segment_store():
+    """
+    Validates that segments are reassembled in any order, and that duplicate segments are ignored
+    """
+    store = SegmentStore(max_bytes=100, purge_timeout=60)
+    segments = create_segments(b"0123456789", 4)
+
+    assert store.add(*segments[2], location="TOPIC:0:2") is None
+    assert store.add(*segments[0], location="TOPIC:0:3") is None
+    assert store.add(*segments[2]) is None
+    assert len(store) == 1
+    assert store.size == 10
+
+    message = store.add(*segments[1])
+    assert message.buffer == b"0123456789"
+    assert message.location == "TOPIC:0:2"
+    assert len(store) == 0
+    assert store.size == 0
+
+    with pytest.raises(ValueError):
+        store.add(b"0123", None)
+
+    with pytest.raises(ValueError):
+        segment, headers = create_segments(b"0123456789", 4)[0]
+        store.add(segment + b"4", headers)
+    assert len(store) == 0
+
+
+def test_segment_store_eviction():
+    """
+    Validates that the least recently accessed messages are evicted once the store budget is exceeded,
+    that messages larger than the store are rejected, and that expired messages are purged
+    """
+    store = SegmentStore(max_bytes=20, purge_timeout=60)
+    first = create_segments(b"0" * 10, 4)
+    second = create_segments(b"1" * 10, 4)
+    third = create_segments(b"2" * 10, 4)
+
+    store.add(*first[0])
+    store.add(*second[0])
+    store.add(*first[1])
+    store.add(*third[0])
+    assert len(store) == 2
+    assert store.size == 20
+    assert store._evicted.value >= 1
+    # the second message, the least recently accessed, was evicted
+    assert store.add(*first[2]).buffer == b"0" * 10
+    assert store.add(*second[1]) is None
+    assert len(store) == 2
+
+    assert store.add(*create_segments(b"3" * 21, 8)[0]) is None
+    assert store._rejected.value >= 1
+
+    store.purge_timeout = -1
+    assert store.add(*third[1]) is None
+    assert len(store) == 1
+    assert store._purged.value >= 1
@@ -0,0 +1,77 @@
+"""
+test_metrics.py
+
+Tests the in-process metrics registry and the @timer decorator
+"""
+import pytest
+from connect.config import get_settings
+from connect.support import metrics
+from connect.support.metrics import Histogram, MetricsRegistry
+from connect.support.timer import timer
+
+
+def test_histogram():
+    """
+    Validates histogram observations and quantile estimates
+    """
+    histogram = Histogram(buckets=(0.1, 0.2, 0.5, 1.0))
+    for value in (0.05, 0.15, 0.15, 0.3, 2.0):
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1, 0, 1]
+    assert histogram.count == 5
+
+    summary = histogram.summary()
+    assert summary["total"] == pytest.approx(2.65)
+    assert summary["average"] == pytest.approx(0.53)
+    assert 0.1 <= summary["p50"] <= 0.2
+    assert summary["p99"] == 1.0
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_registry_remote_metrics():
+    """
+    Validates that metrics exported by remote instances are aggregated in the registry summary
+    """
+    local = MetricsRegistry()
+    local.histogram("persist").observe(0.01)
+    local.counter("requests").inc()
+
+    remote = MetricsRegistry()
+    remote.histogram("persist").observe(0.03)
+    remote.histogram("transmit").observe(0.2)
+
+    local.update_remote("remote-lfh", remote.export())
+    summary = local.summary()
+    assert summary["persist"]["count"] == 2
+    assert summary["persist"]["total"] == pytest.approx(0.04)
+    assert summary["transmit"]["count"] == 1
+    assert local.summary(include_remote=False)["persist"]["count"] == 1
+    assert local.export()["counters"] == [
+        {"name": "requests", "labels": {}, "value": 1}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_timer(monkeypatch):
+    """
+    Validates that @timer records run times only when timing is enabled
+    """
+
+    @timer
+    def timed_function():
+        return "result"
+
+    registry = MetricsRegistry()
+    settings = get_settings().copy()
+    with monkeypatch.context() as m:
+        m.setattr(metrics, "metrics_registry", registry)
+        m.setattr("connect.support.timer.get_settings", lambda: settings)
+
+        settings.connect_timing_enabled = False
+        assert await timed_function() == "result"
+        assert registry.histograms == {}
+
+        settings.connect_timing_enabled = True
+        assert await timed_function() == "result"
+        assert registry.histogram("timed_function").count == 1
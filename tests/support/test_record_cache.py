@@ -0,0 +1,31 @@
+"""
+test_record_cache.py
+
+Tests the Connect stored record cache
+"""
+from connect.support.record_cache import RecordCache
+
+
+def test_record_cache():
+    """
+    Validates that records are evicted in least recently used order once the cache size is exceeded
+    """
+    cache = RecordCache(max_bytes=10)
+    cache.put("TOPIC:0:0", b"0000")
+    cache.put("TOPIC:0:1", b"1111")
+    assert cache.get("TOPIC:0:0") == b"0000"
+
+    cache.put("TOPIC:0:2", b"2222")
+    assert cache.size == 8
+    assert cache.get("TOPIC:0:1") is None
+    assert cache.get("TOPIC:0:0") == b"0000"
+    assert cache.get("TOPIC:0:2") == b"2222"
+
+    # records larger than the cache are not cached
+    cache.put("TOPIC:0:3", b"3" * 11)
+    assert cache.get("TOPIC:0:3") is None
+    assert len(cache) == 2
+
+    assert cache._hits.value >= 3
+    assert cache._misses.value >= 2
+    assert cache._evictions.value >= 1
@@ -0,0 +1,64 @@
+"""
+test_record_keys.py
+
+Tests the derivation of Kafka message keys for stored records
+"""
+import pytest
+from fhir.resources.observation import Observation
+from connect.support import record_keys
+from connect.support.record_keys import get_key_strategy, get_record_key
+
+
+record_uuid = "782e1049-79ba-4899-90ec-5cf8a901261a"
+observation = {
+    "resourceType": "Observation",
+    "id": "obs-001",
+    "status": "final",
+    "code": {"text": "heart rate"},
+    "subject": {"reference": "Patient/001"},
+}
+
+
+@pytest.mark.parametrize(
+    "strategy,message,expected",
+    [
+        ("none", observation, None),
+        ("uuid", observation, record_uuid.encode()),
+        ("resource_id", observation, b"Observation/obs-001"),
+        ("patient", observation, b"Patient/001"),
+        ("patient", {"resourceType": "Patient", "id": "001"}, b"Patient/001"),
+        ("patient", Observation.parse_obj(observation), b"Patient/001"),
+        ("resource_id", Observation.parse_obj(observation), b"Observation/obs-001"),
+        (
+            "patient",
+            {"resourceType": "Coverage", "beneficiary": {"reference": "Patient/002"}},
+            b"Patient/002",
+        ),
+        ("resource_id", {"resourceType": "Patient"}, None),
+        ("patient", {"resourceType": "Group", "id": "001"}, None),
+        ("patient", {"resourceType": "Observation", "subject": {"reference": 1}}, None),
+        ("patient", {"resourceType": "Observation", "subject": "Patient/001"}, None),
+        ("patient", b'{"resourceType": "Patient", "id": "001"}', None),
+        ("resource_id", None, None),
+    ],
+)
+def test_get_record_key(strategy, message, expected):
+    """
+    Validates record keys derived from dicts and fhir.resources instances, and that unparsed messages
+    are not keyed by their resource
+    """
+    assert get_record_key(strategy, record_uuid, message) == expected
+
+
+def test_get_key_strategy(settings, monkeypatch):
+    """
+    Validates that key strategy overrides are applied by data format
+    :param settings: The Settings fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    """
+    settings.kafka_producer_key_strategy = "uuid"
+    settings.kafka_producer_key_strategy_overrides = {"FHIR-R4_OBSERVATION": "patient"}
+    with monkeypatch.context() as m:
+        m.setattr(record_keys, "get_settings", lambda: settings)
+        assert get_key_strategy("FHIR-R4_OBSERVATION") == "patient"
+        assert get_key_strategy("FHIR-R4_PATIENT") == "uuid"
@@ -0,0 +1,222 @@
+"""
+test_retransmit_queue.py
+
+Tests the durable retransmit queue
+"""
+import asyncio
+import os
+import pytest
+import threading
+from connect.support.retransmit_queue import RetransmitQueue
+
+
+def create_message(number: int, target: str = "https://fhir/Patient") -> dict:
+    return {
+        "uuid": f"00000000-0000-0000-0000-00000000000{number}",
+        "target_endpoint_url": target,
+        "data": "eyJpZCI6ICIwMDEifQ==",
+    }
+
+
+def test_retransmit_queue(tmp_path):
+    """
+    Validates that messages are queued in order by target, and are recovered from the queue log
+    """
+    path = str(tmp_path / "retransmit.log")
+    queue = RetransmitQueue(path, max_entries=3)
+    assert queue.put(create_message(1))
+    assert queue.put(create_message(2, "https://other/Patient"))
+    assert queue.put(create_message(3))
+    assert not queue.put(create_message(4))
+    assert queue.targets() == ["https://fhir/Patient", "https://other/Patient"]
+
+    message = queue.peek("https://fhir/Patient")
+    assert message["uuid"] == create_message(1)["uuid"]
+    message["retransmit_count"] = 2
+    queue.retry(message)
+    queue.remove(create_message(2))
+    assert not queue.has_target("https://other/Patient")
+    queue.close()
+
+    queue = RetransmitQueue(path, max_entries=3)
+    assert len(queue) == 2
+    assert [m["uuid"] for m in queue] == [
+        create_message(1)["uuid"],
+        create_message(3)["uuid"],
+    ]
+    assert queue.peek("https://fhir/Patient")["retransmit_count"] == 2
+    queue.close()
+
+
+def test_retransmit_queue_partial_record(tmp_path):
+    """
+    Validates that a partially written log record is discarded when the queue is recovered
+    """
+    path = tmp_path / "retransmit.log"
+    queue = RetransmitQueue(str(path), max_entries=10)
+    queue.put(create_message(1))
+    queue.close()
+    with open(path, "ab") as f:
+        f.write(b'{"op": "put", "id": "0000')
+
+    queue = RetransmitQueue(str(path), max_entries=10)
+    assert len(queue) == 1
+    queue.put(create_message(2))
+    queue.close()
+
+    queue = RetransmitQueue(str(path), max_entries=10)
+    assert [m["uuid"] for m in queue] == [
+        create_message(1)["uuid"],
+        create_message(2)["uuid"],
+    ]
+    queue.close()
+
+
+def test_retransmit_queue_compaction(tmp_path):
+    """
+    Validates that the queue log is compacted once most records are no longer required
+    """
+    path = tmp_path / "retransmit.log"
+    queue = RetransmitQueue(str(path), max_entries=10, compact_min_records=4)
+    for number in range(3):
+        queue.put(create_message(number))
+    queue.remove(create_message(0))
+    assert queue._log_records == 4
+
+    queue.remove(create_message(1))
+    assert queue._log_records == 1
+    assert queue.peek("https://fhir/Patient")["uuid"] == create_message(2)["uuid"]
+    queue.close()
+
+    assert len(path.read_bytes().splitlines()) == 1
+    queue = RetransmitQueue(str(path), max_entries=10)
+    assert len(queue) == 1
+    queue.close()
+
+
+def test_retransmit_queue_requeued(tmp_path):
+    """
+    Validates that a message which is removed and queued again is recovered at the position of its last put
+    """
+    path = str(tmp_path / "retransmit.log")
+    queue = RetransmitQueue(path, max_entries=10)
+    queue.put(create_message(1))
+    queue.put(create_message(2))
+    queue.remove(create_message(1))
+    queue.put(create_message(1))
+    assert [m["uuid"] for m in queue] == [
+        create_message(2)["uuid"],
+        create_message(1)["uuid"],
+    ]
+    queue.close()
+
+    queue = RetransmitQueue(path, max_entries=10)
+    assert [m["uuid"] for m in queue] == [
+        create_message(2)["uuid"],
+        create_message(1)["uuid"],
+    ]
+    queue.close()
+
+
+@pytest.mark.asyncio
+async def test_retransmit_queue_compaction_executor(tmp_path, monkeypatch):
+    """
+    Validates that the log is compacted in an executor, and that records appended meanwhile are retained
+    """
+    path = tmp_path / "retransmit.log"
+    queue = RetransmitQueue(str(path), max_entries=10, compact_min_records=4)
+    release = threading.Event()
+    write_compact_log = queue._write_compact_log
+
+    def blocking_write_compact_log(*args):
+        release.wait(1.0)
+        return write_compact_log(*args)
+
+    with monkeypatch.context() as m:
+        m.setattr(queue, "_write_compact_log", blocking_write_compact_log)
+        for number in range(3):
+            queue.put(create_message(number))
+        queue.remove(create_message(0))
+        queue.remove(create_message(1))
+        await asyncio.sleep(0.01)
+        assert queue._compacting
+
+        # records appended while the compacted log is written
+        queue.put(create_message(3))
+        message = queue.peek("https://fhir/Patient")
+        message["retransmit_count"] = 2
+        queue.retry(message)
+        release.set()
+        while queue._compacting:
+            await asyncio.sleep(0.01)
+
+    assert queue._log_records == 3
+    assert [m["uuid"] for m in queue] == [
+        create_message(2)["uuid"],
+        create_message(3)["uuid"],
+    ]
+    assert queue.peek("https://fhir/Patient")["retransmit_count"] == 2
+    queue.close()
+
+    assert len(path.read_bytes().splitlines()) == 3
+    queue = RetransmitQueue(str(path), max_entries=10)
+    assert [m["uuid"] for m in queue] == [
+        create_message(2)["uuid"],
+        create_message(3)["uuid"],
+    ]
+    assert queue.peek("https://fhir/Patient")["retransmit_count"] == 2
+    queue.close()
+
+
+def test_retransmit_queue_in_memory():
+    """
+    Validates a queue which is not backed by a log
+    """
+    queue = RetransmitQueue(None, max_entries=10)
+    queue.put(create_message(1))
+    message = queue.peek("https://fhir/Patient")
+    message["retransmit_count"] = 1
+    queue.retry(message)
+    assert queue.peek("https://fhir/Patient")["retransmit_count"] == 1
+    queue.remove(message)
+    assert len(queue) == 0
+
+
+@pytest.mark.asyncio
+async def test_retransmit_queue_sync(tmp_path, monkeypatch):
+    """
+    Validates that concurrent syncs share an fsync, and that records appended during a sync are synced by
+    a following fsync
+    """
+    synced = []
+    release = threading.Event()
+
+    def fsync(fd):
+        synced.append(fd)
+        release.wait(1.0)
+
+    queue = RetransmitQueue(str(tmp_path / "retransmit.log"), max_entries=10)
+    with monkeypatch.context() as m:
+        m.setattr(os, "fsync", fsync)
+        release.set()
+        queue.put(create_message(1))
+        queue.put(create_message(2))
+        await asyncio.gather(queue.sync(), queue.sync())
+        assert len(synced) == 1
+
+        # a record appended while a sync is in progress is synced by a following sync
+        release.clear()
+        queue.put(create_message(3))
+        first = asyncio.ensure_future(queue.sync())
+        while len(synced) < 2:
+            await asyncio.sleep(0.01)
+        queue.put(create_message(4))
+        second = asyncio.ensure_future(queue.sync())
+        release.set()
+        await asyncio.gather(first, second)
+        assert len(synced) == 3
+
+        # records already synced are not synced again
+        await queue.sync()
+        assert len(synced) == 3
+    queue.close()
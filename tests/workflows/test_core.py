@@ -3,12 +3,28 @@ test_core.py
 
 Tests the processes and transitions defined within the Core Workflow implementation.
 """
+import asyncio
 from fastapi import Response
 import connect.clients.nats as nats
 import pytest
+from connect.clients.http import TransmitTarget
+from connect.exceptions import (
+    KafkaProducerQueueFullError,
+    TransmitTargetUnavailableError,
+)
+from connect.routes.data import LinuxForHealthDataRecordResponse
+from connect.support import encoding, record_keys
+from connect.support.compression import PayloadCompressor
+from connect.support.retransmit_queue import RetransmitQueue
+from connect.support.encoding import (
+    decode_json,
+    decode_record_to_dict,
+    encode_from_bytes,
+)
 from connect.workflows import core
 from connect.workflows.core import CoreWorkflow
 import datetime
+import httpx
 from unittest.mock import AsyncMock, Mock
 
 
@@ -78,7 +94,7 @@ async def test_manual_flow(
     with monkeypatch.context() as m:
         m.setattr(core, "get_kafka_producer", Mock(return_value=AsyncMock()))
         m.setattr(core, "KafkaCallback", kafka_callback)
-        m.setattr(core, "AsyncClient", mock_httpx_client)
+        m.setattr(core, "get_http_client_pool", Mock(return_value=mock_httpx_client()))
         m.setattr(nats, "get_nats_client", AsyncMock(return_value=nats_mock))
 
         await workflow.validate()
@@ -105,7 +121,7 @@ async def test_manual_flow(
 
         await workflow.synchronize()
         assert workflow.state.name == "sync"
-        assert nats_mock.publish.call_count == 6
+        assert nats_mock.publish.call_count == 1
 
 
 @pytest.mark.asyncio
@@ -130,7 +146,7 @@ async def test_manual_flow_transmit_disabled(
     with monkeypatch.context() as m:
         m.setattr(core, "get_kafka_producer", Mock(return_value=AsyncMock()))
         m.setattr(core, "KafkaCallback", kafka_callback)
-        m.setattr(core, "AsyncClient", mock_httpx_client)
+        m.setattr(core, "get_http_client_pool", Mock(return_value=mock_httpx_client()))
         m.setattr(nats, "get_nats_client", AsyncMock(return_value=nats_mock))
 
         await workflow.validate()
@@ -149,6 +165,193 @@ async def test_manual_flow_transmit_disabled(
         assert workflow.use_response is False
 
 
+@pytest.mark.asyncio
+async def test_transmit_target_unavailable(
+    workflow: CoreWorkflow, monkeypatch, kafka_callback
+):
+    """
+    Tests that a transmission deferred by the target's open circuit breaker is sent for retransmission,
+    without a request to the target.
+
+    :param workflow: The CoreWorkflow fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    :param kafka_callback: KafkaCallback fixture
+    """
+    workflow.start_time = datetime.datetime.utcnow()
+    nats_mock = AsyncMock()
+    client = AsyncMock()
+    target = Mock(origin="https://external-server.com")
+    target.allow_request.return_value = False
+
+    with monkeypatch.context() as m:
+        m.setattr(core, "get_kafka_producer", Mock(return_value=AsyncMock()))
+        m.setattr(core, "KafkaCallback", kafka_callback)
+        m.setattr(core, "get_http_client_pool", Mock(return_value=client))
+        m.setattr(core, "get_transmit_target", Mock(return_value=target))
+        m.setattr(nats, "get_nats_client", AsyncMock(return_value=nats_mock))
+
+        await workflow.validate()
+        await workflow.transform()
+        await workflow.persist()
+
+        workflow.transmit_server = "https://external-server.com/data"
+        with pytest.raises(TransmitTargetUnavailableError):
+            await workflow.transmit(Response())
+        assert client.post.call_count == 0
+        assert workflow.message["status"] == "ERROR"
+        assert nats_mock.publish.call_args[0][0] == nats.nats_retransmit_subject
+
+
+@pytest.mark.asyncio
+async def test_transmit_probe_cancelled(
+    workflow: CoreWorkflow, monkeypatch, kafka_callback
+):
+    """
+    Tests that a cancelled probe request is recorded as a failure, so that the target's half open circuit
+    breaker admits another probe once its reset timeout expires.
+
+    :param workflow: The CoreWorkflow fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    :param kafka_callback: KafkaCallback fixture
+    """
+    workflow.start_time = datetime.datetime.utcnow()
+    client = AsyncMock()
+    client.post.side_effect = asyncio.CancelledError()
+    target = TransmitTarget("https://external-server.com")
+    target.breaker.failures = target.breaker.failure_threshold
+
+    with monkeypatch.context() as m:
+        m.setattr(core, "get_kafka_producer", Mock(return_value=AsyncMock()))
+        m.setattr(core, "KafkaCallback", kafka_callback)
+        m.setattr(core, "get_http_client_pool", Mock(return_value=client))
+        m.setattr(core, "get_transmit_target", Mock(return_value=target))
+
+        await workflow.validate()
+        await workflow.transform()
+        await workflow.persist()
+
+        workflow.transmit_server = "https://external-server.com/data"
+        assert target.breaker.state == "half_open"
+        with pytest.raises(asyncio.CancelledError):
+            await workflow.transmit(Response())
+        assert client.post.call_count == 1
+        assert target.breaker.state == "open"
+
+        target.breaker.retry_at = 0.0
+        assert target.allow_request()
+
+
+@pytest.mark.asyncio
+async def test_run_producer_queue_full_after_persist(
+    workflow: CoreWorkflow, monkeypatch, kafka_callback
+):
+    """
+    Tests that a full producer queue, once the record is stored, does not reject the request for
+    backpressure. The message is still published for retransmission, and the workflow fails with the
+    transmit error.
+
+    :param workflow: The CoreWorkflow fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    :param kafka_callback: KafkaCallback fixture
+    """
+    nats_mock = AsyncMock()
+    client = AsyncMock()
+    client.post.side_effect = httpx.ConnectError("connection refused")
+    producer = AsyncMock()
+    producer.produce.side_effect = KafkaProducerQueueFullError()
+    # the record is stored, while the error record is not
+    producer.produce_with_callback.side_effect = [None, KafkaProducerQueueFullError()]
+
+    with monkeypatch.context() as m:
+        m.setattr(core, "get_kafka_producer", Mock(return_value=producer))
+        m.setattr(core, "KafkaCallback", kafka_callback)
+        m.setattr(core, "get_http_client_pool", Mock(return_value=client))
+        m.setattr(nats, "get_nats_client", AsyncMock(return_value=nats_mock))
+
+        workflow.transmit_server = "https://external-server.com/data"
+        with pytest.raises(Exception) as exc_info:
+            await workflow.run(Response())
+        assert not isinstance(exc_info.value, KafkaProducerQueueFullError)
+        assert "connection refused" in str(exc_info.value)
+        assert producer.produce.call_args[0][0] == "RETRANSMIT"
+        assert nats_mock.publish.call_args[0][0] == nats.nats_retransmit_subject
+
+
+@pytest.mark.asyncio
+async def test_synchronize_large_record(
+    workflow: CoreWorkflow, monkeypatch, kafka_callback, settings
+):
+    """
+    Tests that records larger than the message chunk size are not published for synchronization
+
+    :param workflow: The CoreWorkflow fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    :param kafka_callback: KafkaCallback fixture
+    :param settings: connect configuration settings fixture
+    """
+    workflow.start_time = datetime.datetime.utcnow()
+    nats_mock = AsyncMock()
+    settings.kafka_message_chunk_size = 64
+
+    with monkeypatch.context() as m:
+        m.setattr(core, "get_kafka_producer", Mock(return_value=AsyncMock()))
+        m.setattr(core, "KafkaCallback", kafka_callback)
+        m.setattr(core, "get_settings", lambda: settings)
+        m.setattr(nats, "get_nats_client", AsyncMock(return_value=nats_mock))
+
+        await workflow.validate()
+        await workflow.transform()
+        await workflow.persist()
+        await workflow.transmit(Response())
+        await workflow.synchronize()
+        assert workflow.state.name == "sync"
+        assert nats_mock.publish.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_transmit_async(
+    workflow: CoreWorkflow, monkeypatch, kafka_callback, tmp_path
+):
+    """
+    Tests that an async transmission is queued for the retransmitter, and acknowledged with a 202 response,
+    without a request to the target.
+
+    :param workflow: The CoreWorkflow fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    :param kafka_callback: KafkaCallback fixture
+    :param tmp_path: Pytest tmp_path fixture
+    """
+    workflow.start_time = datetime.datetime.utcnow()
+    workflow.transmit_mode = "async"
+    queue = RetransmitQueue(str(tmp_path / "retransmit.log"), max_entries=1)
+    client = AsyncMock()
+
+    with monkeypatch.context() as m:
+        m.setattr(core, "get_kafka_producer", Mock(return_value=AsyncMock()))
+        m.setattr(core, "KafkaCallback", kafka_callback)
+        m.setattr(core, "get_http_client_pool", Mock(return_value=client))
+        m.setattr(nats, "get_retransmit_queue", lambda: queue)
+
+        await workflow.validate()
+        await workflow.transform()
+        await workflow.persist()
+
+        workflow.transmit_server = "https://external-server.com/data"
+        response = Response()
+        await workflow.transmit(response)
+        assert response.status_code == 202
+        assert response.headers["LinuxForHealth-MessageId"] == workflow.uuid
+        assert workflow.transmit_queued is True
+        assert workflow.use_response is False
+        assert workflow.message["transmit_date"] is None
+        assert client.post.call_count == 0
+
+        message = queue.peek("https://external-server.com/data")
+        assert message["uuid"] == workflow.uuid
+        assert message["status"] == "QUEUED"
+        assert message["data"] == workflow.message["data"]
+
+
 @pytest.mark.asyncio
 async def test_run_flow(
     workflow: CoreWorkflow, monkeypatch, kafka_callback, mock_httpx_client
@@ -166,7 +369,7 @@ async def test_run_flow(
     with monkeypatch.context() as m:
         m.setattr(core, "get_kafka_producer", Mock(return_value=AsyncMock()))
         m.setattr(core, "KafkaCallback", kafka_callback)
-        m.setattr(core, "AsyncClient", mock_httpx_client)
+        m.setattr(core, "get_http_client_pool", Mock(return_value=mock_httpx_client()))
         m.setattr(nats, "get_nats_client", AsyncMock(return_value=AsyncMock()))
 
         actual_value = await workflow.run(Mock())
@@ -207,8 +410,102 @@ async def test_run_flow_error(
     with monkeypatch.context() as m:
         m.setattr(core, "get_kafka_producer", Mock(return_value=AsyncMock()))
         m.setattr(core, "KafkaCallback", kafka_callback)
-        m.setattr(core, "AsyncClient", mock_httpx_client)
+        m.setattr(core, "get_http_client_pool", Mock(return_value=mock_httpx_client()))
         m.setattr(nats, "get_nats_client", AsyncMock(return_value=AsyncMock()))
 
         with pytest.raises(Exception):
             await workflow.run(Mock())
+
+
+@pytest.mark.asyncio
+async def test_persist_raw_message(workflow: CoreWorkflow, monkeypatch, kafka_callback):
+    """
+    Tests CoreWorkflow.persist where the original message bytes are provided
+
+    :param workflow: The CoreWorkflow fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    :param kafka_callback: KafkaCallback fixture
+    """
+    workflow.start_time = datetime.datetime.utcnow()
+    workflow.raw_message = b'{"first_name":"John","last_name":"Doe"}'
+    kafka_producer = AsyncMock()
+
+    with monkeypatch.context() as m:
+        m.setattr(core, "get_kafka_producer", Mock(return_value=kafka_producer))
+        m.setattr(core, "KafkaCallback", kafka_callback)
+
+        await workflow.persist()
+        assert workflow.message["data"] == encode_from_bytes(workflow.raw_message)
+        assert workflow.message["data_record_location"] == "CUSTOM:0:0"
+
+        topic, record = kafka_producer.produce_with_callback.call_args.args
+        assert topic == "custom"
+        assert isinstance(record, bytes)
+
+        stored_message = LinuxForHealthDataRecordResponse.parse_raw(record)
+        assert stored_message.data == workflow.message["data"]
+        assert str(stored_message.uuid) == workflow.uuid
+        assert stored_message.data_record_location is None
+
+
+@pytest.mark.asyncio
+async def test_persist_compressed(workflow: CoreWorkflow, monkeypatch, kafka_callback):
+    """
+    Tests CoreWorkflow.persist where payload compression is enabled
+
+    :param workflow: The CoreWorkflow fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    :param kafka_callback: KafkaCallback fixture
+    """
+    workflow.start_time = datetime.datetime.utcnow()
+    workflow.message = {"first_name": "John" * 100, "last_name": "Doe"}
+    kafka_producer = AsyncMock()
+    compressor = PayloadCompressor("zlib", 3, 0, {}, {})
+
+    with monkeypatch.context() as m:
+        m.setattr(core, "get_kafka_producer", Mock(return_value=kafka_producer))
+        m.setattr(core, "KafkaCallback", kafka_callback)
+        m.setattr(core, "get_payload_compressor", Mock(return_value=compressor))
+        m.setattr(encoding, "get_payload_compressor", Mock(return_value=compressor))
+
+        await workflow.persist()
+        assert workflow.data_encoding == "zlib"
+        assert workflow.message["data_encoding"] is None
+
+        topic, record = kafka_producer.produce_with_callback.call_args.args
+        stored_message = decode_json(record)
+        assert stored_message["data_encoding"] == "zlib"
+        assert stored_message["data"] != workflow.message["data"]
+        assert decode_record_to_dict(record)["data"] == workflow.message["data"]
+
+
+@pytest.mark.asyncio
+async def test_persist_keyed(
+    workflow: CoreWorkflow, settings, monkeypatch, kafka_callback
+):
+    """
+    Tests CoreWorkflow.persist where records are keyed by the configured key strategy
+
+    :param workflow: The CoreWorkflow fixture
+    :param settings: The Settings fixture
+    :param monkeypatch: Pytest monkeypatch fixture
+    :param kafka_callback: KafkaCallback fixture
+    """
+    workflow.start_time = datetime.datetime.utcnow()
+    settings.kafka_producer_key_strategy_overrides = {"custom": "uuid"}
+    kafka_producer = AsyncMock()
+
+    with monkeypatch.context() as m:
+        m.setattr(core, "get_kafka_producer", Mock(return_value=kafka_producer))
+        m.setattr(core, "KafkaCallback", kafka_callback)
+        m.setattr(record_keys, "get_settings", lambda: settings)
+
+        await workflow.persist()
+        assert workflow.record_key == workflow.uuid.encode()
+        kwargs = kafka_producer.produce_with_callback.call_args.kwargs
+        assert kwargs["key"] == workflow.uuid.encode()
+
+        # error records are keyed as the stored record is keyed
+        await workflow.error("failed")
+        kwargs = kafka_producer.produce_with_callback.call_args.kwargs
+        assert kwargs["key"] == workflow.uuid.encode()
@@ -7,8 +7,10 @@ import pytest
 from pydantic import ValidationError
 
 from connect.exceptions import MissingFhirResourceType, FhirValidationError
-from connect.workflows.fhir import FhirWorkflow
-from connect.support.timer import nats
+from connect.support.metrics import get_metrics_registry
+from connect.workflows import fhir as fhir_workflow
+from connect.workflows.fhir import FhirWorkflow, get_validation_level
+from connect.clients import nats
 
 
 @pytest.fixture
@@ -75,3 +77,53 @@ async def test_validate_invalid_resource_type(
         m.setattr(nats, "get_nats_client", nats_client)
         with pytest.raises(FhirValidationError):
             await workflow.validate()
+
+
+@pytest.mark.asyncio
+async def test_validate_structural(
+    workflow: FhirWorkflow, settings, nats_client, monkeypatch
+):
+    """
+    Tests FhirWorkflow.validate where structural validation is configured
+    """
+    settings.fhir_validation_mode = "structural"
+    with monkeypatch.context() as m:
+        m.setattr(nats, "get_nats_client", nats_client)
+        m.setattr(fhir_workflow, "get_settings", lambda: settings)
+        await workflow.validate()
+        assert workflow.data_format == "FHIR-R4_PATIENT"
+        assert isinstance(workflow.message, dict)
+
+        invalid_workflow = FhirWorkflow(
+            message={"resourceType": "Patient", "active": "maybe"},
+            origin_url="http://localhost:5000/fhir",
+            certificate_verify=False,
+            lfh_id="90cf887d-eaa0-4997-b2b7-b1e39ae0ec03",
+            operation="POST",
+        )
+        with pytest.raises(FhirValidationError):
+            await invalid_workflow.validate()
+
+    registry = get_metrics_registry()
+    labels = {"mode": "structural", "level": "structural"}
+    assert registry.counter("fhir_validations", result="valid", **labels).value >= 1
+    assert registry.counter("fhir_validations", result="invalid", **labels).value >= 1
+
+
+@pytest.mark.asyncio
+async def test_validate_sampled(settings, monkeypatch):
+    """
+    Tests the validation levels applied when sampled validation is configured
+    """
+    settings.fhir_validation_mode = "structural"
+    settings.fhir_validation_mode_overrides = {"Patient": "sampled"}
+    settings.fhir_validation_sample_percent = 0.0
+    with monkeypatch.context() as m:
+        m.setattr(fhir_workflow, "get_settings", lambda: settings)
+        m.setattr(fhir_workflow, "full_validation_resource_types", set())
+        assert get_validation_level("Patient") == ("sampled", "full")
+        assert get_validation_level("Patient") == ("sampled", "structural")
+        assert get_validation_level("Encounter") == ("structural", "structural")
+
+        settings.fhir_validation_sample_percent = 100.0
+        assert get_validation_level("Patient") == ("sampled", "full")